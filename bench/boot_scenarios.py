@@ -0,0 +1,107 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Measure the boot scenario classifier (boot.py) on a library of captures.
+
+Usage: python bench/boot_scenarios.py [--captures N] [--gap SAMPLES] [--jobs N]
+
+Writes synthetic boot probes (see tracegen.py) of each scenario as .dsl
+files, classifies them in one process and in a pool, and checks that every
+capture was put in the scenario it was made for.
+'''
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import common                        # makes pcfx_scsi and the offline tools importable
+from pcfx_scsi_offline.boot import SCENARIOS, classify_library
+import tracegen
+
+NO_DISC_RETRIES = 75
+
+
+def boot_trace(scenario, gap, seed):
+    '''The BIOS probe of a scenario, with 'gap' samples of free bus between commands.'''
+    gen = tracegen.TraceGenerator(seed, {'bus_free': gap})
+
+    def poll(ready):
+        gen.transaction([0x00, 0x00, 0x00, 0x00, 0x00, 0x00], status=0x00 if ready else 0x02)
+        if not ready:
+            gen.transaction([0x03, 0x00, 0x00, 0x00, 0x12, 0x00], data_in=bytes(18))
+
+    if scenario == 'lid open':
+        poll(False)
+    elif scenario == 'no disc':
+        for _ in range(NO_DISC_RETRIES):
+            poll(False)
+    else:
+        for _ in range(1 + seed % 3):                # spinning up
+            poll(False)
+        poll(True)
+        tracks = 1 + seed % 8
+        gen.transaction([0xDE, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00], data_in=bytes([1, tracks, 0, 0]))
+        gen.transaction([0xDE, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00], data_in=bytes([0x60, 0, 0, 0]))
+        for track in range(1, tracks + 1):
+            gen.transaction([0xDE, 0x02, track, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00], data_in=bytes(4))
+        if scenario == 'data disc':
+            gen.transaction([0x1A, 0x00, 0x01, 0x00, 0x0C, 0x00], data_in=bytes(12))
+            gen.transaction([0x08, 0x00, 0x00, 0x10, 0x01, 0x00], data_in=gen.sectors(0x10, 1))
+    return gen.words()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--captures', type=int, default=32, help='captures in the library')
+    parser.add_argument('--gap', type=int, default=200000, help='samples of free bus between commands')
+    parser.add_argument('--jobs', type=int, default=0, help='processes of the pool (0: one per CPU)')
+    args = parser.parse_args()
+
+    names = [name for (name, description, ranges) in SCENARIOS]
+    folder = tempfile.mkdtemp()
+    try:
+        expected = {}
+        samples = 0
+        for index in range(args.captures):
+            path = os.path.join(folder, 'boot%04d.dsl' % index)
+            words = boot_trace(names[index % len(names)], args.gap, index)
+            tracegen.write_dsl(path, words)
+            expected[path] = names[index % len(names)]
+            samples += len(words)
+        print('%d captures, %.1fM samples each on average' % (args.captures, samples / args.captures / 1e6))
+        print('%-10s %9s %12s' % ('jobs', 'time (s)', 's / capture'))
+        wrong = 0
+        for jobs in (1, args.jobs):
+            start = time.perf_counter()
+            results = list(classify_library(sorted(expected), jobs=jobs))
+            elapsed = time.perf_counter() - start
+            print('%-10s %9.3f %12.3f' % (jobs or os.cpu_count(), elapsed, elapsed / args.captures))
+            wrong += sum(result.scenario != expected[result.path] for result in results)
+        if wrong:
+            print('%d captures classified wrongly' % wrong)
+            sys.exit(1)
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Setup shared by the benchmark scripts: makes the sigrokdecode stand-in and
+the offline tools importable, and loads pd.py as the 'pcfx_scsi' package.
+'''
+
+import importlib
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SAMPLE_CAPTURE = os.path.join(ROOT_DIR, 'samples', 'DSLogic-PCFX_SCSI_Boot_first-burst.dsl')
+
+for path in (BENCH_DIR, os.path.join(ROOT_DIR, 'tools')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import sigrokdecode
+import pcfx_scsi_offline
+
+
+def load_decoder():
+    return importlib.import_module('pcfx_scsi.pd').Decoder
+
+
+def decoded_bytes(annotations):
+    '''
+    Number of data bytes covered by the 'Byte Num' (class 30) annotations in
+    (class, texts) pairs; texts are either 'n' or 'first-last' for groups.
+    '''
+    count = 0
+    for (ann, texts) in annotations:
+        if ann == 30:
+            (first, _, last) = texts[0].partition('-')
+            count += int(last) - int(first) + 1 if last else 1
+    return count
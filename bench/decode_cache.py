@@ -0,0 +1,81 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Measure the decode cache (cache.py): cold, warm, and after a small change.
+
+Usage: python bench/decode_cache.py [--reads N] [--jobs N]
+
+Writes a synthetic capture (see tracegen.py) as a .dsl file with 2M-sample
+blocks, then times decoding it without the cache, into an empty cache, from
+the cache, and once more after glitches were added to one block of it.
+'''
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import common                        # makes pcfx_scsi and the offline tools importable
+from pcfx_scsi_offline.cache import DecodeCache, cached_decode
+from pcfx_scsi_offline.engine import run_dsl
+import tracegen
+
+BLOCK_SAMPLES = 1 << 21
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reads', type=int, default=200, help='READ commands of 8 sectors in the trace')
+    parser.add_argument('--jobs', type=int, default=1)
+    args = parser.parse_args()
+
+    # a host gap long enough to cut the capture in (see piece_min_gap())
+    (words, gen) = tracegen.synthetic_trace(reads=args.reads, sectors=8, polls=200, glitches=1000,
+                                            timing={'bus_free': 2000})
+    folder = tempfile.mkdtemp()
+    try:
+        capture = os.path.join(folder, 'trace.dsl')
+        tracegen.write_dsl(capture, words, block_samples=BLOCK_SAMPLES)
+        cache = DecodeCache(os.path.join(folder, 'cache'))
+        print('%d samples, %d transactions, %d blocks' % (len(words), gen.num_transactions,
+                                                          -(-len(words) // BLOCK_SAMPLES)))
+        print('%-20s %9s %7s %7s' % ('decode', 'time (s)', 'loaded', 'stored'))
+
+        def run(name, decode):
+            (loaded, stored) = (cache.loaded, cache.stored)
+            start = time.perf_counter()
+            decode()
+            print('%-20s %9.3f %7d %7d' % (name, time.perf_counter() - start,
+                                          cache.loaded - loaded, cache.stored - stored))
+
+        run('without cache', lambda: run_dsl(capture))
+        run('empty cache', lambda: cached_decode(capture, cache, jobs=args.jobs))
+        run('from cache', lambda: cached_decode(capture, cache, jobs=args.jobs))
+        middle = len(words) // 2
+        block = words[middle - middle % BLOCK_SAMPLES:][:BLOCK_SAMPLES]
+        tracegen.inject_glitches(block, 10, seed=1)
+        tracegen.write_dsl(capture, words, block_samples=BLOCK_SAMPLES)
+        run('one block changed', lambda: cached_decode(capture, cache, jobs=args.jobs))
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Measure how fast the sector checks ('sector_check' option) validate sectors.
+
+Usage: python bench/sector_check.py [--sectors N] [--repeat N]
+
+Builds N random raw sectors of each kind (mode 1, and mode 2 form 1 and
+form 2, with valid EDC/ECC), then checks them in READs of 1, 16 and 64
+sectors with each of the block lengths which carry check codes, and
+reports the best rate.  The PC-FX drive reads at most 150 sectors/s (2x).
+'''
+
+import argparse
+import time
+
+import numpy as np
+
+import common                        # makes pcfx_scsi importable
+from pcfx_scsi.cdrom import SECTOR_LENGTH, SYNC, MSF_LBA_OFFSET, SectorValidator, edc, ecc
+
+DRIVE_SECTORS_PER_SECOND = 150
+
+
+def raw_sectors(count, mode, form=1, seed=0):
+    # 'count' valid raw sectors from LBA 0, as a (count, 2352) uint8 array
+    raw = np.random.default_rng(seed).integers(0, 256, (count, SECTOR_LENGTH), dtype=np.uint8)
+    raw[:, :12] = SYNC
+    address = MSF_LBA_OFFSET + np.arange(count)
+    for (column, value) in enumerate((address // 4500, address // 75 % 60, address % 75)):
+        raw[:, 12 + column] = ((value // 10) << 4) | (value % 10)
+    raw[:, 15] = mode
+    if mode == 1:
+        raw[:, 2064:2068] = edc(raw[:, :2064]).astype('<u4').view(np.uint8).reshape(count, 4)
+        raw[:, 2068:2076] = 0
+        raw[:, 2076:] = ecc(raw[:, 12:])
+        return raw
+    raw[:, 18] = 0x20 if form == 2 else 0x08
+    raw[:, 20:24] = raw[:, 16:20]
+    if form == 2:
+        raw[:, 2348:] = edc(raw[:, 16:2348]).astype('<u4').view(np.uint8).reshape(count, 4)
+        return raw
+    raw[:, 2072:2076] = edc(raw[:, 16:2072]).astype('<u4').view(np.uint8).reshape(count, 4)
+    block = raw[:, 12:].copy()
+    block[:, :4] = 0
+    raw[:, 2076:] = ecc(block)
+    return raw
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sectors', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    validator = SectorValidator()
+    print('%-14s %6s %5s %12s %8s %8s' % ('sectors', 'length', 'read', 'sectors/s', 'MB/s', 'x drive'))
+    for (name, mode, form) in (('mode 1', 1, 1), ('mode 2 form 1', 2, 1), ('mode 2 form 2', 2, 2)):
+        raw = raw_sectors(args.sectors, mode, form)
+        for length in ((2352, 2340) if mode == 1 else (2352, 2340, 2336)):
+            data = np.ascontiguousarray(raw[:, SECTOR_LENGTH - length:])
+            for read in (1, 16, 64):
+                best = None
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    for first in range(0, args.sectors, read):
+                        if validator.check(first, data[first:first + read], length):
+                            raise SystemExit('valid sectors reported bad (%s, %d bytes)' % (name, length))
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                rate = args.sectors / best
+                print('%-14s %6d %5d %12.0f %8.1f %8.0f'
+                      % (name, length, read, rate, rate * length / 1e6, rate / DRIVE_SECTORS_PER_SECOND))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Local stand-in for the sigrokdecode runtime, so that pd.py can be run (and
+measured) under plain CPython.
+
+Only the parts of the API which pd.py uses are provided.  wait() follows
+DSView's libsigrokdecode: 'matched' is a bitmask with one bit per condition,
+edges never match on the first sample, and {'skip': n} matches n samples
+after the current one.
+
+Signals are held as the sample numbers where each channel toggles, so a
+wait() costs a binary search rather than a scan over samples; a condition on
+a single channel is looked up in that channel's toggles directly.
+'''
+
+from bisect import bisect_right
+import heapq
+from itertools import islice
+
+import numpy as np
+
+OUTPUT_ANN = 0
+OUTPUT_PYTHON = 1
+OUTPUT_BINARY = 2
+OUTPUT_META = 3
+
+SRD_CONF_SAMPLERATE = 10000
+
+
+class EndOfSamples(Exception):
+    pass
+
+
+class Decoder:
+
+    def register(self, output_type, meta=None):
+        return output_type
+
+    def put(self, startsample, endsample, output_id, data):
+        self.output.append((startsample, endsample, output_id, data))
+
+    def wait(self, conds=None):
+        self.wait_calls += 1
+        if conds is None:
+            conds = [{'skip': 1}]
+        elif isinstance(conds, dict):
+            conds = [conds]
+        first = None
+        for cond in conds:
+            samplenum = self._first_match(cond)
+            if samplenum is not None and (first is None or samplenum < first):
+                first = samplenum
+        if first is None or first >= self._num_samples:
+            raise EndOfSamples()
+        word = self._word(first)
+        before = self._word(first - 1) if first > 0 else word
+        matched = 0
+        for index, cond in enumerate(conds):
+            if self._matches(cond, first, word, before):
+                matched |= 1 << index
+        self.matched = matched
+        self.samplenum = first
+        self._next = first + 1
+        pins = self._pins.get(word)
+        if pins is None:
+            pins = self._pins[word] = tuple((word >> channel) & 1 for channel in range(len(self._changes)))
+        return pins
+
+    def _word(self, samplenum):
+        # All channels packed into one integer, bit n = channel n
+        return self._words[bisect_right(self._points, samplenum)]
+
+    def _value(self, channel, samplenum):
+        return self._initial[channel] ^ (bisect_right(self._changes[channel], samplenum) & 1)
+
+    def _first_match(self, cond):
+        if 'skip' in cond:
+            return self._next + cond['skip'] - 1
+        start = self._next
+        if len(cond) == 1:
+            # A single channel: its next toggle(s) can be looked up directly
+            ((channel, kind),) = cond.items()
+            changes = self._changes[channel]
+            index = bisect_right(changes, start - 1)
+            if kind == 'h' or kind == 'l':
+                if self._value(channel, start) == (kind == 'h'):
+                    return start
+                index = bisect_right(changes, start)
+            elif kind == 'r' or kind == 'f':
+                if index < len(changes) and (self._initial[channel] ^ ((index + 1) & 1)) != (kind == 'r'):
+                    index += 1
+            elif kind != 'e':
+                return self._scan(cond, start)
+            return changes[index] if index < len(changes) else None
+        return self._scan(cond, start)
+
+    def _scan(self, cond, start):
+        word = self._word(start)
+        if self._matches(cond, start, word, self._word(start - 1) if start > 0 else word):
+            return start
+        # Otherwise, a match can only happen where one of the channels toggles
+        toggles = []
+        for channel in cond:
+            changes = self._changes[channel]
+            toggles.append(islice(changes, bisect_right(changes, start), None))
+        for samplenum in heapq.merge(*toggles):
+            if self._matches(cond, samplenum, self._word(samplenum), self._word(samplenum - 1)):
+                return samplenum
+        return None
+
+    def _matches(self, cond, samplenum, word, before):
+        if 'skip' in cond:
+            return samplenum == self._next + cond['skip'] - 1
+        for channel, kind in cond.items():
+            value = (word >> channel) & 1
+            if kind == 'h' or kind == 'l':
+                if value != (kind == 'h'):
+                    return False
+                continue
+            previous = (before >> channel) & 1
+            if kind == 's':
+                if previous != value:
+                    return False
+            elif previous == value:
+                return False
+            elif (kind == 'r' and not value) or (kind == 'f' and value):
+                return False
+        return True
+
+
+def channel_changes(words, num_channels=14):
+    '''Initial value and toggle sample numbers of each channel of a packed capture.'''
+    words = np.asarray(words)
+    initial = []
+    changes = []
+    for channel in range(num_channels):
+        bits = (words >> channel) & 1
+        initial.append(int(bits[0]) if len(bits) else 0)
+        changes.append((np.flatnonzero(bits[1:] != bits[:-1]) + 1).tolist())
+    return initial, changes
+
+
+def _packed(initial, changes):
+    # Sample numbers where any channel toggles, and the packed value of all
+    # channels before the first of them ([0]) and from each of them on
+    points = np.unique(np.concatenate([np.asarray(c, dtype=np.int64) for c in changes] + [np.zeros(0, dtype=np.int64)]))
+    words = np.zeros(len(points) + 1, dtype=np.int64)
+    for channel, channel_changes in enumerate(changes):
+        toggled = np.searchsorted(np.asarray(channel_changes, dtype=np.int64), points, side='right') & 1
+        words[0] |= initial[channel] << channel
+        words[1:] |= (initial[channel] ^ toggled) << channel
+    return points.tolist(), words.tolist()
+
+
+def run(decoder_class, initial, changes, num_samples, samplerate, options=None):
+    '''
+    Run decoder_class over the given channel toggles (see channel_changes)
+    until the samples run out; returns the decoder, whose 'output' holds
+    every put() as (startsample, endsample, output_id, data).
+    '''
+    decoder = decoder_class()
+    decoder.options = {opt['id']: opt['default'] for opt in getattr(decoder_class, 'options', ())}
+    decoder.options.update(options or {})
+    decoder._initial = initial
+    decoder._changes = changes
+    decoder._points, decoder._words = _packed(initial, changes)
+    decoder._pins = {}
+    decoder._num_samples = num_samples
+    decoder._next = 0
+    decoder.samplenum = 0
+    decoder.matched = 0
+    decoder.wait_calls = 0
+    decoder.output = []
+    decoder.metadata(SRD_CONF_SAMPLERATE, samplerate)
+    decoder.start()
+    try:
+        decoder.decode()
+    except EndOfSamples:
+        pass
+    return decoder
@@ -0,0 +1,175 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Measure decode throughput on synthetic traces of several sizes.
+
+Usage: python bench/throughput.py [--decoder pd|offline|parallel ...] [--size small|medium|large ...]
+                                  [--data-detail 'per byte'|'per sector'|'per N bytes']
+                                  [--binary no|data_in|sectors]
+                                  [--repeat N] [--save] [--tolerance 0.4]
+
+Reports samples, decoded bytes and annotations per second for each decoder
+and trace size, and compares them with the stored baselines (baselines.json);
+the exit status is 1 if any rate dropped by more than the tolerance.  '--save'
+stores the current results as the new baselines.  Data In/Out is annotated
+per byte unless '--data-detail' says otherwise.  The 'parallel' decoder (the
+offline engine on all CPUs, see parallel.py) only runs when asked for, since
+its results depend on the number of CPUs.
+
+'--binary' has the 'pd' decoder put the sectors read on that binary output
+as well (its 'binary' option, off by default, as the offline engine has no
+binary output).  It costs a copy of every sector read and a put() per
+sector, which stays within the run-to-run noise of these traces (a few
+dozen sectors each) but grows with the data read, and more so with what
+the front end does with every put().
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from common import BENCH_DIR, load_decoder, decoded_bytes, sigrokdecode
+from pcfx_scsi_offline.engine import Edges, OfflineDecoder
+from pcfx_scsi_offline.parallel import parallel_decode
+import tracegen
+
+BASELINES = os.path.join(BENCH_DIR, 'baselines.json')
+
+SAMPLERATE = 50000000
+
+# synthetic_trace() arguments for each trace size; about 1 glitch per 100 bytes
+SIZES = {
+    'small':  {'reads': 4,  'sectors': 2,  'glitches': 200},
+    'medium': {'reads': 8,  'sectors': 4,  'glitches': 650},
+    'large':  {'reads': 16, 'sectors': 8,  'glitches': 2600},
+}
+
+RATES = ('samples_per_sec', 'bytes_per_sec', 'annotations_per_sec')
+
+
+def run_pd(words, data_detail, binary='no'):
+    # Decoder.decode() under the sigrokdecode stand-in; channel setup is not timed
+    initial, changes = sigrokdecode.channel_changes(words)
+    decoder_class = load_decoder()
+    start = time.perf_counter()
+    decoder = sigrokdecode.run(decoder_class, initial, changes, len(words), SAMPLERATE,
+                               {'data_detail': data_detail, 'repeats': 'expand', 'binary': binary})
+    elapsed = time.perf_counter() - start
+    return elapsed, [data for (ss, es, output, data) in decoder.output if output == sigrokdecode.OUTPUT_ANN]
+
+
+def run_offline(words, data_detail, binary='no'):
+    # Offline engine, including the edge search
+    start = time.perf_counter()
+    annotations = OfflineDecoder(data_detail=data_detail).decode(Edges(words))
+    elapsed = time.perf_counter() - start
+    return elapsed, [(ann, texts) for (ss, es, ann, texts) in annotations]
+
+
+def run_parallel(words, data_detail, binary='no'):
+    # Offline engine in a process pool, including the edge search and the pool start-up
+    start = time.perf_counter()
+    annotations = parallel_decode(Edges(words), data_detail=data_detail).annotations
+    elapsed = time.perf_counter() - start
+    return elapsed, [(ann, texts) for (ss, es, ann, texts) in annotations]
+
+
+DECODERS = {'pd': run_pd, 'offline': run_offline, 'parallel': run_parallel}
+DEFAULT_DECODERS = ('offline', 'pd')
+
+
+def measure(decoder, size, repeat, data_detail='per byte', binary='no'):
+    words, gen = tracegen.synthetic_trace(**SIZES[size])
+    best = None
+    for _ in range(repeat):
+        elapsed, annotations = DECODERS[decoder](words, data_detail, binary)
+        best = elapsed if best is None else min(best, elapsed)
+    databytes = decoded_bytes(annotations)
+    if databytes != gen.num_bytes:
+        print('%s/%s: decoded %d bytes, expected %d' % (decoder, size, databytes, gen.num_bytes), file=sys.stderr)
+    return {
+        'samples': len(words),
+        'bytes': databytes,
+        'annotations': len(annotations),
+        'seconds': best,
+        'samples_per_sec': len(words) / best,
+        'bytes_per_sec': databytes / best,
+        'annotations_per_sec': len(annotations) / best,
+    }
+
+
+def load_baselines():
+    try:
+        with open(BASELINES) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--decoder', action='append', choices=sorted(DECODERS))
+    parser.add_argument('--size', action='append', choices=list(SIZES))
+    parser.add_argument('--data-detail', default='per byte', choices=('per byte', 'per sector', 'per N bytes'))
+    parser.add_argument('--binary', default='no', choices=('no', 'data_in', 'sectors'),
+                        help="binary output of the 'pd' decoder")
+    parser.add_argument('--repeat', type=int, default=3, help='runs per trace; the fastest one counts')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.4, help='allowed drop against the baseline')
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    regressed = False
+    print('%-36s %10s %8s %8s %8s %12s %10s %12s  %s'
+          % ('decoder/size', 'samples', 'bytes', 'annots', 'seconds',
+             'samples/s', 'bytes/s', 'annots/s', 'vs. baseline'))
+    for decoder in args.decoder or DEFAULT_DECODERS:
+        for size in args.size or list(SIZES):
+            name = '%s/%s' % (decoder, size)
+            if args.data_detail != 'per byte':
+                name += '/' + args.data_detail.replace(' ', '-')
+            if args.binary != 'no' and decoder == 'pd':
+                name += '/binary-' + args.binary
+            result = measure(decoder, size, args.repeat, args.data_detail, args.binary)
+            baseline = baselines.get(name)
+            if baseline:
+                ratios = [result[rate] / baseline[rate] for rate in RATES]
+                change = '%+.0f%%' % (100 * (min(ratios) - 1))
+                if min(ratios) < 1 - args.tolerance:
+                    change += ' REGRESSION'
+                    regressed = True
+            else:
+                change = '-'
+            print('%-36s %10d %8d %8d %8.3f %12.0f %10.0f %12.0f  %s'
+                  % (name, result['samples'], result['bytes'], result['annotations'], result['seconds'],
+                     result['samples_per_sec'], result['bytes_per_sec'], result['annotations_per_sec'], change))
+            if args.save:
+                baselines[name] = {rate: round(result[rate]) for rate in RATES}
+
+    if args.save:
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+    sys.exit(1 if regressed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Measure the decode time added by the timing checks ('timing' option).
+
+Usage: python bench/timing_overhead.py [--size small|medium|large] [--repeat N]
+
+Decodes the same synthetic trace (see throughput.py) with pd.py and with
+the offline engine, with the timing checks off and on, and reports the best
+time of each and the overhead of the checks.
+'''
+
+import argparse
+import time
+
+from common import load_decoder, sigrokdecode
+from pcfx_scsi.scsi import TIMING_DEFAULTS
+from pcfx_scsi_offline.engine import Edges, OfflineDecoder
+from throughput import SAMPLERATE, SIZES
+import tracegen
+
+
+def time_pd(words, timing):
+    initial, changes = sigrokdecode.channel_changes(words)
+    decoder_class = load_decoder()
+    start = time.perf_counter()
+    decoder = sigrokdecode.run(decoder_class, initial, changes, len(words), SAMPLERATE,
+                               {'repeats': 'expand', 'timing': 'yes' if timing else 'no'})
+    elapsed = time.perf_counter() - start
+    return (elapsed, sum(1 for (ss, es, output, data) in decoder.output
+                         if output == sigrokdecode.OUTPUT_ANN and data[0] == 34))
+
+
+def time_offline(words, timing):
+    edges = Edges(words)
+    options = {'timing': dict(TIMING_DEFAULTS), 'samplerate': SAMPLERATE} if timing else {}
+    start = time.perf_counter()
+    annotations = OfflineDecoder(**options).decode(edges)
+    elapsed = time.perf_counter() - start
+    return (elapsed, sum(1 for annotation in annotations if annotation[2] == 34))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', default='medium', choices=tuple(SIZES))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    words, gen = tracegen.synthetic_trace(**SIZES[args.size])
+    print('%-8s %10s %10s %9s %11s' % ('decoder', 'off (s)', 'on (s)', 'overhead', 'violations'))
+    for (name, run) in (('pd', time_pd), ('offline', time_offline)):
+        best = {}
+        for _ in range(args.repeat):
+            for timing in (False, True):         # alternated, so that both see the same machine load
+                (elapsed, violations) = run(words, timing)
+                best[timing] = min(best.get(timing, elapsed), elapsed)
+        print('%-8s %10.3f %10.3f %8.1f%% %11d'
+              % (name, best[False], best[True], 100 * (best[True] / best[False] - 1), violations))
+
+if __name__ == '__main__':
+    main()
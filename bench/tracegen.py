@@ -0,0 +1,221 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Synthetic PC-FX SCSI bus traces.
+
+A trace is packed the same way as DslCapture.read_words(): one uint16 per
+sample, bit 'n' being decoder channel 'n'.  All lines are active-low, so an
+idle bus reads as 0x3FFF.  The bus sequence follows what pd.py expects:
+SEL falls (arbitration), the IDs go on the data bus, BSY falls (selection),
+SEL rises (information transfer), and BSY rises again at the end.
+
+Every phase is appended as runs of (value, length), and the samples are
+only expanded by words(), so long traces are built quickly.
+'''
+
+import random
+import struct
+import zipfile
+
+import numpy as np
+
+from pcfx_scsi_offline.dsl import CHANNEL_IDS
+from pcfx_scsi_offline.engine import SEL, BSY, CD, IO, MSG, ACK
+
+IDLE = 0x3FFF
+
+# Subphases, as numbered by pd.py: (MSG << 2) + (CD << 1) + IO
+COMMAND = 5
+DATA_IN = 6
+DATA_OUT = 7
+STATUS = 4
+MESSAGE_IN = 0
+MESSAGE_OUT = 1
+
+SECTOR_SIZE = 2048
+
+# Durations in samples (50 MHz, as the sample capture)
+DEFAULT_TIMING = {
+    'bus_free': 400,         # idle bus between transactions
+    'arbitration': 120,
+    'selection': 60,
+    'phase': 20,             # settle time after CD/IO/MSG change
+    'setup': 5,              # data valid before ACK
+    'ack': 15,               # ACK pulse width
+    'hold': 10,              # after ACK is released
+    'seek': 2000,            # target busy between command and data
+}
+
+
+class TraceGenerator:
+    '''Builds a packed trace one bus transaction at a time.'''
+
+    def __init__(self, seed=0, timing=None):
+        self.random = random.Random(seed)
+        self.timing = dict(DEFAULT_TIMING, **(timing or {}))
+        self.word = IDLE
+        self.runs = []               # (values, lengths) arrays, in order
+        self.num_samples = 0
+        self.num_bytes = 0           # bytes transferred with ACK
+        self.num_transactions = 0
+
+    def emit(self, word, samples):
+        self.word = word
+        self.runs.append((np.array([word], dtype=np.uint16), np.array([samples], dtype=np.int64)))
+        self.num_samples += samples
+
+    def bus_free(self, samples=None):
+        self.emit(IDLE, self.timing['bus_free'] if samples is None else samples)
+
+    def select(self, initiator=7, target=0):
+        ids = 0xFF & ~((1 << initiator) | (1 << target))
+        self.emit(IDLE & ~SEL, self.timing['arbitration'] // 2)
+        self.emit((self.word & ~0xFF) | ids, self.timing['arbitration'] // 2)
+        self.emit(self.word & ~BSY, self.timing['selection'])
+        self.emit(self.word | SEL, self.timing['phase'])
+
+    def phase(self, subphase):
+        lines = (MSG if subphase & 4 else 0) | (CD if subphase & 2 else 0) | (IO if subphase & 1 else 0)
+        self.emit((self.word & ~(MSG | CD | IO)) | lines, self.timing['phase'])
+
+    def transfer(self, data):
+        # Per byte: data set up with ACK high, ACK low, ACK high again
+        count = len(data)
+        if not count:
+            return
+        timing = self.timing
+        base = self.word & ~0xFF & ~ACK
+        bus = (~np.frombuffer(bytes(data), dtype=np.uint8) & 0xFF).astype(np.uint16) | base
+        values = np.empty((count, 3), dtype=np.uint16)
+        values[:, 0] = bus | ACK
+        values[:, 1] = bus
+        values[:, 2] = bus | ACK
+        lengths = np.empty((count, 3), dtype=np.int64)
+        lengths[:, 0] = timing['setup']
+        lengths[:, 1] = timing['ack']
+        lengths[:, 2] = timing['hold']
+        self.runs.append((values.reshape(-1), lengths.reshape(-1)))
+        self.word = int(values[-1, 2])
+        self.num_samples += count * (timing['setup'] + timing['ack'] + timing['hold'])
+        self.num_bytes += count
+
+    def transaction(self, cdb, data_in=b'', data_out=b'', status=0x00, message=0x00,
+                    initiator=7, target=0):
+        self.bus_free()
+        self.select(initiator, target)
+        self.phase(COMMAND)
+        self.transfer(cdb)
+        if data_in or data_out:
+            self.emit(self.word, self.timing['seek'])
+        if data_in:
+            self.phase(DATA_IN)
+            self.transfer(data_in)
+        if data_out:
+            self.phase(DATA_OUT)
+            self.transfer(data_out)
+        self.phase(STATUS)
+        self.transfer([status])
+        self.phase(MESSAGE_IN)
+        self.transfer([message])
+        self.emit(self.word | BSY, self.timing['phase'])
+        self.num_transactions += 1
+
+    def sectors(self, lba, count):
+        # Recognisable sector contents: each sector starts with its LBA
+        data = bytearray(self.random.getrandbits(8) for _ in range(16)) * (SECTOR_SIZE * count // 16)
+        for index in range(count):
+            data[index * SECTOR_SIZE:index * SECTOR_SIZE + 4] = struct.pack('>I', lba + index)
+        return data
+
+    def words(self):
+        # The trace ends with an idle bus
+        runs = self.runs + [(np.array([IDLE], dtype=np.uint16), np.array([self.timing['bus_free']]))]
+        values = np.concatenate([run[0] for run in runs])
+        lengths = np.concatenate([run[1] for run in runs])
+        return np.repeat(values, lengths)
+
+
+def inject_glitches(words, count, seed=0, lines=(BSY, CD, IO, MSG, ACK), margin=2):
+    '''
+    Invert one line for a single sample at 'count' random places during
+    information transfer (SEL high, BSY low), each at least 'margin' samples
+    away from any other edge.  A deglitch width between 2 and 'margin'
+    samples therefore rejects all of them without moving any real edge.
+    Returns the number of glitches injected.
+    '''
+    rng = np.random.default_rng(seed)
+    span = len(words) - 2 * margin
+    if span <= 0 or count <= 0:
+        return 0
+    inside = words[margin:margin + span]
+    quiet = (inside & (SEL | BSY)) == SEL
+    for offset in range(-margin, margin + 1):
+        quiet &= words[margin + offset:margin + offset + span] == inside
+    places = np.flatnonzero(quiet) + margin
+    if not len(places):
+        return 0
+    places = np.sort(rng.choice(places, size=min(count, len(places)), replace=False))
+    places = places[np.concatenate(([True], np.diff(places) > 2 * margin))]     # keep them apart
+    words[places] ^= np.array(lines, dtype=np.uint16)[rng.integers(0, len(lines), size=len(places))]
+    return len(places)
+
+
+def synthetic_trace(reads=8, sectors=4, polls=4, glitches=0, seed=0, timing=None):
+    '''
+    A boot-like workload: TEST UNIT READY / REQUEST SENSE polling, READ TOC,
+    READ HEADER, then 'reads' READ(10) commands of 'sectors' sectors each,
+    from consecutive LBAs.  Returns (words, generator); the generator holds
+    the number of bytes and transactions in the trace.
+    '''
+    gen = TraceGenerator(seed, timing)
+    for _ in range(polls):
+        gen.transaction([0x00, 0x00, 0x00, 0x00, 0x00, 0x00], status=0x02)
+        gen.transaction([0x03, 0x00, 0x00, 0x00, 0x12, 0x00], data_in=bytes(18))
+    gen.transaction([0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+    gen.transaction([0x43, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x04, 0x00], data_in=bytes([0, 10, 1, 2]))
+    gen.transaction([0x43, 0x02, 0x00, 0x00, 0x00, 0x00, 0x01, 0x00, 0x0C, 0x00], data_in=bytes(12))
+    gen.transaction([0x44, 0x00, 0x00, 0x00, 0x00, 0x10, 0x00, 0x00, 0x08, 0x00], data_in=bytes(8))
+    lba = 0x10
+    for _ in range(reads):
+        cdb = [0x28, 0x00] + list(struct.pack('>I', lba)) + [0x00] + list(struct.pack('>H', sectors)) + [0x00]
+        gen.transaction(cdb, data_in=gen.sectors(lba, sectors))
+        lba += sectors
+    words = gen.words()
+    inject_glitches(words, glitches, seed)
+    return words, gen
+
+
+def write_dsl(path, words, samplerate=50000000, block_samples=1 << 24):
+    '''
+    Save a trace as a DSView .dsl file, with one probe per decoder channel
+    (named as DslCapture expects) and 'block_samples' samples per block.
+    '''
+    header = ['[version]', 'version = 3', '[header]', 'driver = virtual-session', 'capturefile = data',
+              'total samples = %d' % len(words), 'total probes = %d' % len(CHANNEL_IDS),
+              'total blocks = %d' % -(-len(words) // block_samples),
+              'samplerate = %d MHz' % (samplerate // 1000000)]
+    header += ['probe%d = %s' % (bit, name.upper()) for (bit, name) in enumerate(CHANNEL_IDS)]
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('header', '\n'.join(header) + '\n')
+        for (block, start) in enumerate(range(0, len(words), block_samples)):
+            part = words[start:start + block_samples]
+            for bit in range(len(CHANNEL_IDS)):
+                archive.writestr('L-%d/%d' % (bit, block),
+                                 np.packbits((part >> bit) & 1, bitorder='little').tobytes())
@@ -0,0 +1,90 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Measure the memory held per decoded transaction.
+
+Usage: python bench/transaction_memory.py [--polls N] [--reads N] [--sectors N]
+
+Decodes a synthetic trace (see tracegen.py) with the offline engine, and
+counts the memory held by its transactions in two forms: a list of
+Transaction objects as TransactionBuilder makes them (the records, their
+bytes, memoryviews, Data In/Out buffers and phase tuples), and the
+TransactionStore (scsi.py) the engine keeps them in.  Both are shown per
+transaction, next to the bytes actually transferred.
+'''
+
+import argparse
+import sys
+
+import common                        # makes pcfx_scsi and the offline tools importable
+from pcfx_scsi.scsi import TransactionStore
+from pcfx_scsi_offline.engine import Edges, OfflineDecoder
+import tracegen
+
+# Short bus timing, so that megabytes of sectors fit in a trace of a reasonable size
+TIMING = {'setup': 2, 'ack': 3, 'hold': 2}
+
+
+def object_size(value, seen):
+    # Bytes held by 'value' and everything it refers to, each object counted once
+    if id(value) in seen or value is None:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, memoryview):
+        size += object_size(value.obj, seen)
+    elif isinstance(value, (list, tuple)):
+        size += sum(object_size(item, seen) for item in value)
+    elif hasattr(value, '__slots__'):
+        size += sum(object_size(getattr(value, name), seen) for name in value.__slots__)
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--polls', type=int, default=5000,
+                        help='TEST UNIT READY / REQUEST SENSE pairs (default %(default)s)')
+    parser.add_argument('--reads', type=int, default=200, help='READ(10) commands (default %(default)s)')
+    parser.add_argument('--sectors', type=int, default=4, help='sectors per READ (default %(default)s)')
+    args = parser.parse_args()
+
+    (words, gen) = tracegen.synthetic_trace(reads=args.reads, sectors=args.sectors, polls=args.polls,
+                                            timing=TIMING)
+    edges = Edges(words)
+    del words
+
+    decoder = OfflineDecoder()
+    decoder.transactions = []
+    decoder.decode(edges)
+    objects = decoder.transactions
+    store = TransactionStore()
+    store.extend(objects)
+
+    count = max(len(objects), 1)
+    payload = sum(len(t.cdb) + len(t.msg_in) + len(t.msg_out) +
+                  (len(t.data_in) if t.data_in is not None else 0) +
+                  (len(t.data_out) if t.data_out is not None else 0) for t in objects)
+    seen = set()
+    print('%d transactions, %.1f bytes transferred per transaction' % (len(objects), payload / count))
+    print('  Transaction objects: %8.1f bytes per transaction' % (object_size(objects, seen) / count))
+    print('  TransactionStore:    %8.1f bytes per transaction' % (store.nbytes() / count))
+
+if __name__ == '__main__':
+    main()
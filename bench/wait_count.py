@@ -0,0 +1,52 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Count the wait() calls Decoder.decode() makes per decoded byte.
+
+Usage: python bench/wait_count.py [capture.dsl] [--deglitch N] [--deglitch-unit samples|ns]
+'''
+
+import argparse
+
+from common import SAMPLE_CAPTURE, load_decoder, decoded_bytes, sigrokdecode
+from pcfx_scsi_offline.dsl import DslCapture
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('capture', nargs='?', default=SAMPLE_CAPTURE)
+    parser.add_argument('--deglitch', type=int, default=2)
+    parser.add_argument('--deglitch-unit', default='samples', choices=('samples', 'ns'))
+    args = parser.parse_args()
+
+    with DslCapture(args.capture) as capture:
+        words = capture.read_words()
+        samplerate = capture.samplerate
+    initial, changes = sigrokdecode.channel_changes(words)
+    decoder = sigrokdecode.run(load_decoder(), initial, changes, len(words), samplerate,
+                               {'deglitch': args.deglitch, 'deglitch_unit': args.deglitch_unit,
+                                'repeats': 'expand'})
+
+    databytes = decoded_bytes(data for (ss, es, output, data) in decoder.output if output == sigrokdecode.OUTPUT_ANN)
+    print('%d wait() calls, %d bytes decoded: %.2f wait() calls per byte'
+          % (decoder.wait_calls, databytes, decoder.wait_calls / max(databytes, 1)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# CD-ROM sector checks (the 'sector_check' option)
+#
+# A raw CD-ROM sector is 2352 bytes: 12 sync bytes, a 4-byte header (the
+# sector's MSF address in BCD, and its mode), then for mode 1 2048 bytes of
+# data, a 4-byte EDC (a CRC-32 of everything before it), 8 zero bytes and
+# 276 bytes of ECC (P and Q Reed-Solomon parity over the header onwards).
+# Mode 2 has an 8-byte subheader (sent twice) after the header; form 1 then
+# has 2048 bytes of data, EDC and ECC (with the header taken as zero), and
+# form 2 has 2324 bytes of data and an optional EDC at the end.
+#
+# How much of that can be checked depends on how much of each sector the
+# drive sends, which MODE SELECT sets (see _VENDOR_BLOCK_LENGTH in scsi.py):
+# all of it (2352), all but the sync (2340), or the mode 2 part after the
+# header (2336).  With 2056 bytes there is only the subheader to check, and
+# 2048-byte blocks (user data alone) have nothing to check at all.
+#
+# The EDC and the ECC are both linear over GF(2), so each is the XOR of one
+# table entry per byte, looked up by the byte's position and value.  The
+# tables are built on first use, and the Data In of a READ is then checked
+# as one array of sectors: a gather and an XOR reduction per code, with no
+# loop over the bytes in Python.  This needs NumPy.
+
+import numpy as np
+
+from .scsi import read_blocks, data_in_span
+
+SECTOR_LENGTH = 2352
+SYNC = np.frombuffer(b'\x00' + b'\xFF' * 10 + b'\x00', np.uint8)
+MSF_LBA_OFFSET = 150                 # LBA 0 is at MSF 00:02:00
+RAW_OFFSET = {2352: 0, 2340: 12, 2336: 16, 2056: 16}    # where a block of each length starts in the raw sector
+EDC_POLYNOMIAL = 0xD8018001          # x^32 + x^31 + x^16 + x^15 + x^4 + x^3 + x + 1, bit-reversed
+ECC_POLYNOMIAL = 0x11D               # GF(2^8) of the P and Q codes
+BAD_SECTORS_LISTED = 4               # in the annotation, before '...'
+
+# Which byte (counted from the header) goes into each [minor][major] step of the P and Q codes;
+# P covers 2064 bytes, Q 2236 (the P parity too)
+_P_INDEX = np.arange(86)[None, :] + 86 * np.arange(24)[:, None]
+_Q_INDEX = ((np.arange(52) >> 1) * 86 + (np.arange(52) & 1))[None, :] + 88 * np.arange(43)[:, None]
+_Q_INDEX %= 52 * 43
+_P_PARITY = slice(2076, 2248)
+_Q_PARITY = slice(2248, 2352)
+
+_tables = None
+
+
+class _Tables:
+    # Built once, on first use (a few ms)
+    def __init__(self):
+        # EDC of a single byte, then edc[d][v]: what a byte of value v adds to
+        # the EDC when d more bytes follow it (up to the mode 2 form 2 area)
+        crc = np.arange(256, dtype=np.uint32)
+        for bit in range(8):
+            crc = (crc >> 1) ^ np.where(crc & 1, np.uint32(EDC_POLYNOMIAL), np.uint32(0))
+        self.edc = np.empty((2348 - 16, 256), np.uint32)
+        self.edc[0] = crc
+        for distance in range(1, len(self.edc)):
+            previous = self.edc[distance - 1]
+            self.edc[distance] = (previous >> 8) ^ crc[previous & 0xFF]
+
+        # Multiplication by alpha (forward) and by 1 / (1 + alpha) (backward) in GF(2^8),
+        # and power[k][v] = alpha^k * v
+        value = np.arange(256)
+        self.forward = ((value << 1) ^ np.where(value & 0x80, ECC_POLYNOMIAL, 0)).astype(np.uint8)
+        self.backward = np.empty(256, np.uint8)
+        self.backward[value ^ self.forward] = value
+        self.power = np.empty((44, 256), np.uint8)
+        self.power[0] = value
+        for k in range(1, len(self.power)):
+            self.power[k] = self.forward[self.power[k - 1]]
+
+
+def _load_tables():
+    global _tables
+    if _tables is None:
+        _tables = _Tables()
+    return _tables
+
+
+def edc(data):
+    '''EDC of each row of 'data' (a 2-D uint8 array), as a uint32 array.'''
+    length = data.shape[-1]
+    by_position = _load_tables().edc[length - 1::-1]
+    return np.bitwise_xor.reduce(by_position[np.arange(length), data], axis=-1)
+
+
+def _parity(block, index):
+    # P or Q parity of each row of 'block' (bytes from the header on)
+    t = _load_tables()
+    minor_count = index.shape[0]
+    words = block[:, index]                                  # (sectors, minor, major)
+    weight = (minor_count - np.arange(minor_count))[None, :, None]
+    a = np.bitwise_xor.reduce(t.power[weight, words], axis=1)
+    b = np.bitwise_xor.reduce(words, axis=1)
+    a = t.backward[t.forward[a] ^ b]
+    return np.concatenate((a, a ^ b), axis=1)
+
+
+def ecc(block):
+    '''P and Q parity (276 bytes) of each row of 'block', the 2340 bytes of a sector after the sync.'''
+    p = _parity(block, _P_INDEX)
+    block = block.copy()
+    block[:, _P_PARITY.start - 12:_P_PARITY.stop - 12] = p
+    return np.concatenate((p, _parity(block, _Q_INDEX)), axis=1)
+
+
+def _ecc_bad(raw, zero_header=False):
+    # Rows of 'raw' (whole sectors) whose stored P or Q parity is wrong
+    block = raw[:, 12:]
+    if zero_header:
+        block = block.copy()
+        block[:, :4] = 0
+    return ~((_parity(block, _P_INDEX) == raw[:, _P_PARITY]).all(axis=1)
+             & (_parity(block, _Q_INDEX) == raw[:, _Q_PARITY]).all(axis=1))
+
+
+def _stored_edc(raw, offset):
+    return raw[:, offset:offset + 4].copy().view('<u4')[:, 0]
+
+
+def _bcd(value):
+    return ((value // 10) << 4) | (value % 10)
+
+
+class SectorValidator:
+    '''Checks the sectors returned by READ commands (see the comment above).'''
+
+    def __init__(self):
+        _load_tables()
+
+    def check(self, lba, data, length):
+        '''
+        Problems of the blocks in 'data' (a uint8 array, one row of 'length'
+        bytes per block, from 'lba' on), as a list of (index, [texts]) of
+        the bad ones.  Blocks of a length without check codes are not bad.
+        '''
+        if length not in RAW_OFFSET or not len(data):
+            return []
+        count = len(data)
+        offset = RAW_OFFSET[length]
+        whole = (offset + length == SECTOR_LENGTH)           # ends with the EDC and ECC
+        raw = np.zeros((count, SECTOR_LENGTH), np.uint8)
+        raw[:, offset:offset + length] = data
+        if offset:
+            raw[:, :12] = SYNC                               # not sent, but part of the mode 1 EDC
+        problems = {}
+
+        def mark(rows, text):
+            for row in np.flatnonzero(rows):
+                problems.setdefault(int(row), []).append(text if isinstance(text, str) else text(row))
+
+        if offset == 0:
+            mark(~(data[:, :12] == SYNC).all(axis=1), 'SYNC')
+        if offset <= 12:
+            address = lba + MSF_LBA_OFFSET + np.arange(count)
+            msf = np.stack((_bcd(address // 4500), _bcd(address // 75 % 60), _bcd(address % 75)), axis=1)
+            mark((raw[:, 12:15] != msf).any(axis=1),
+                 lambda row: 'HEADER %02X:%02X:%02X' % tuple(raw[row, 12:15].tolist()))
+            mode = raw[:, 15]
+            mark(mode > 2, lambda row: 'MODE %d' % int(mode[row]))
+        else:
+            mode = np.full(count, 2, np.uint8)               # only mode 2 sectors are sent without their header
+
+        rows = np.flatnonzero(mode == 1)
+        if whole and len(rows):
+            sectors = raw[rows]
+            mark_rows = np.zeros(count, bool)
+            mark_rows[rows] = edc(sectors[:, :2064]) != _stored_edc(sectors, 2064)
+            mark(mark_rows, 'EDC')
+            mark_rows[rows] = _ecc_bad(sectors)
+            mark(mark_rows, 'ECC')
+
+        rows = np.flatnonzero(mode == 2)
+        if len(rows):
+            sectors = raw[rows]
+            mark_rows = np.zeros(count, bool)
+            mark_rows[rows] = (sectors[:, 16:20] != sectors[:, 20:24]).any(axis=1)
+            mark(mark_rows, 'SUBHEADER')
+            if whole:
+                form2 = (sectors[:, 18] & 0x20) != 0
+                mark_rows[:] = False
+                form1 = rows[~form2]
+                if len(form1):
+                    mark_rows[form1] = edc(sectors[~form2, 16:2072]) != _stored_edc(sectors[~form2], 2072)
+                    mark(mark_rows, 'EDC')
+                    mark_rows[form1] = _ecc_bad(sectors[~form2], zero_header=True)
+                    mark(mark_rows, 'ECC')
+                    mark_rows[:] = False
+                form2_rows = rows[form2]
+                if len(form2_rows):
+                    stored = _stored_edc(sectors[form2], 2348)
+                    mark_rows[form2_rows] = (stored != 0) & (edc(sectors[form2, 16:2348]) != stored)
+                    mark(mark_rows, 'EDC')         # 0 means form 2 has no EDC
+        return sorted(problems.items())
+
+    def validate(self, t):
+        '''Bad sectors of a READ Transaction, as a list of (lba, [texts]).'''
+        layout = read_blocks(t)
+        if layout is None or layout[2] not in RAW_OFFSET:
+            return []
+        (lba, blocks, length) = layout
+        whole = len(t.data_in) // length
+        data = np.frombuffer(t.data_in, np.uint8, whole * length).reshape(whole, length)
+        bad = [(lba + index, texts) for (index, texts) in self.check(lba, data, length)]
+        if len(t.data_in) % length:
+            bad.append((lba + whole, ['SHORT']))         # cut off
+        return bad
+
+    def annotation(self, t):
+        '''(startsample, endsample, texts) over the Data In of a READ with bad sectors, or None.'''
+        bad = self.validate(t)
+        if not bad:
+            return None
+        return data_in_span(t) + (bad_sector_texts(bad),)
+
+
+def bad_sector_texts(bad):
+    '''Annotation texts of the bad sectors of one READ (see SectorValidator.validate()).'''
+    listed = ', '.join('0x%06X (%s)' % (lba, ', '.join(texts)) for (lba, texts) in bad[:BAD_SECTORS_LISTED])
+    if len(bad) > BAD_SECTORS_LISTED:
+        listed += ', ...'
+    if len(bad) == 1:
+        return ['BAD SECTOR ' + listed, 'BAD SECTOR', 'BAD']
+    return ['%d BAD SECTORS: %s' % (len(bad), listed), '%d BAD SECTORS' % len(bad), 'BAD']
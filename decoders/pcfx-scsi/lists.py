@@ -0,0 +1,46 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Lookup tables, built once at import time so that the per-byte work in
+# decode() is reduced to indexing.  Like scsi.py, this module must not
+# depend on the sigrokdecode runtime.
+
+# D0-D7 pin values (as returned by wait()) packed into one integer, bit n = Dn
+BUS_LEVELS = {tuple((raw >> bit) & 1 for bit in range(8)): raw for raw in range(256)}
+
+# The data bus is active-low: byte value for each packed pin level
+BYTE_VALUE = tuple(raw ^ 0xFF for raw in range(256))
+
+# Units asserting the bus during arbitration/selection, i.e. 'LUN 7,2'
+LUN_LABEL = tuple('LUN ' + ','.join(str(bit) for bit in range(7, -1, -1) if not (raw >> bit) & 1)
+                  for raw in range(256))
+
+# Annotation texts for each byte value.  These lists are shared by every
+# annotation carrying that value, so they must never be modified.
+HEX_TEXT = tuple(['0x%2.2X' % value] for value in range(256))
+
+# Annotation texts for byte counters (see byte_number_text); prebuilt for
+# one raw CD-ROM sector and extended on demand
+BYTE_NUMBER_TEXT = [['%d' % number] for number in range(2352)]
+
+
+def byte_number_text(number):
+    if number >= len(BYTE_NUMBER_TEXT):
+        BYTE_NUMBER_TEXT.extend(['%d' % count] for count in range(len(BYTE_NUMBER_TEXT), 2 * number + 1))
+    return BYTE_NUMBER_TEXT[number]
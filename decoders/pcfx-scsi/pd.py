@@ -18,213 +18,18 @@
 ##
 
 import sigrokdecode as srd
-from collections import deque
+from .scsi import getluns, getbyteval, subphase_label, command_annotation, command_label, \
+                  deglitch_samples, Deglitcher, data_group_texts, GROUP_PREVIEW_BYTES, \
+                  TransactionBuilder, METRICS, transaction_metrics, status_end, host_gap, \
+                  RepeatCollapser, repeat_texts, AccessPattern, access_texts, \
+                  read_sectors, data_in_span, SECTOR_HEADER, TIMING_RULES, TIMING_DEFAULTS, TimingChecker
+from .lists import HEX_TEXT, byte_number_text
+from .profiling import DecodeProfile
 
 class SamplerateError(Exception):
     pass
 
 
-def getluns(datapins):
-    value = "LUN "
-    first = 0
-    for iter in range (7, -1, -1):
-        if datapins[iter] == 0:
-            if first == 0:
-                value = value + str(iter)
-                first = 1
-            else:
-                value = value + "," + str(iter)
-    return value
-
-
-def getbyteval(datapins):
-    number = 0
-    for iter in range (0, 8):
-        if datapins[iter] == 0:
-            number = number + (1 << iter)
-#    value = '0x%2.2X' % number
-    return number
-
-
-def subphase_label(subphase):
-    if subphase == 0:
-        sp_label = ['Message In',      'Msg In',   'MI']
-    elif subphase == 1:
-        sp_label = ['Message Out',     'Msg Out',  'MO']
-    elif subphase == 2:
-        sp_label = ['Unused Subphase', 'Unused',   'U']
-    elif subphase == 3:
-        sp_label = ['Unused Subphase', 'Unused',   'U']
-    elif subphase == 4:
-        sp_label = ['Status',          'Stat',     'S']
-    elif subphase == 5:
-        sp_label = ['Command',         'Cmd',      'C']
-    elif subphase == 6:
-        sp_label = ['Data In',         'Data In',  'DI']
-    else:
-        sp_label = ['Data Out',        'Data Out', 'DO']
-    return sp_label
-
-
-def command_annotation(byte0):
-    if ((byte0 == 0x00) or (byte0 == 0x03) or (byte0 == 0x1E)):     # status-type
-        annotation = 21
-
-    elif ((byte0 == 0x43) or (byte0 == 0x44)):                      # directory-type
-        annotation = 22
-
-    elif ((byte0 == 0x08) or (byte0 == 0x28)):                      # data-type
-        annotation = 23
-
-    elif ((byte0 == 0xD8) or (byte0 == 0xD9) or (byte0 == 0x4B)):   # audio-type
-        annotation = 24
-
-    elif ((byte0 == 0x42) or (byte0 == 0xDD)):                      # subcode-type
-        annotation = 25
-
-    else:                                                           # unknown
-        annotation = 28
-
-    return annotation
-
-
-def command_label(ctype):
-    if (ctype[0] == 0x00):              # 00 = TEST UNIT READY
-        cmd_label = [ f"[00]: TEST UNIT READY   [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-
-    elif (ctype[0] == 0x03):            # 03 = REQUEST SENSE
-        if ctype[4] == 0x12:
-            cmd_label = [ f"[03]: REQUEST SENSE (18 bytes)    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-        else:
-            cmd_label = [ f"[03]: REQUEST SENSE ({ctype[4]} bytes)    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-
-    elif (ctype[0] == 0x08):            # 08 = READ (6)
-        lba = ((ctype[1] & 0x1F ) << 16) + (ctype[2] << 8) + ctype[3]
-        if (ctype[4] == 0x00):
-            blks = 256
-        else:
-            blks = ctype[4]
-        cmd_label = [ f"[08]: READ LBA 0x{lba:06X}, 0x{blks:02X} BLOCKS    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-
-    elif (ctype[0] == 0x15):            # 15 = MODE SELECT
-        if ctype[1] == 0x00:
-            cmd_label = [ f"[15]: MODE SELECT (VENDOR-SPECIFIC), LIST LENGTH=0x{ctype[4]:02X}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-        else:
-            cmd_label = [ f"[15]: MODE SELECT (SCSI-2 COMPLIANT), LIST LENGTH=0x{ctype[4]:02X}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-
-    elif (ctype[0] == 0x1A):            # 1A = MODE SENSE
-        pc = (ctype[2] & 0xC0) >> 6
-        page_code = (ctype[2] & 0xBF)
-        if ((ctype[1] == 0x00) and (ctype[2] == 0x00)):
-            cmd_label = [ f"[1A]: MODE SENSE (VENDOR-SPECIFIC), LIST LENGTH=0x{ctype[4]:02X}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-        else:
-            cmd_label = [ f"[1A]: MODE SENSE PC={pc}, PAGE CODE=0x{page_code:02X}, LIST LENGTH=0x{ctype[4]:02X}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-
-    elif (ctype[0] == 0x1E):            # 1E = PREVENT/ALLOW MEDIUM REMOVAL
-        if ctype[4] == 0x00:
-            cmd_label = [ f"[1E]: ALLOW MEDIUM REMOVAL    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-        else:
-            cmd_label = [ f"[1E]: PREVENT MEDIUM REMOVAL    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-
-    elif (ctype[0] == 0x28):            # 28 = READ EXTENDED (10)
-        lba = (ctype[2] << 24) + (ctype[3] << 16) + (ctype[4] << 8) + ctype[5]
-        blks = (ctype[7] << 8) + ctype[8]
-        if ctype[9] == 0x00:
-            cmd_label = [ f"[28]: READ LBA 0x{lba:08X}, 0x{blks:04X} BLOCKS    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        elif ctype[9] == 0x40:
-            cmd_label = [ f"[28]: READ MSF {ctype[2]:02X}:{ctype[3]:02X}:{ctype[4]:02X}, 0x{blks:04X} BLOCKS    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        elif ctype[9] == 0x80:
-            cmd_label = [ f"[28]: READ TRACK {ctype[2]:02X}, 0x{blks:04X} BLOCKS    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        else:
-            cmd_label = [ f"[28]: UNKNOWN READ, 0x{blks:04X} BLOCKS    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-
-    elif (ctype[0] == 0x43):            # 43 = READ TOC FORMAT
-        numbytes = (ctype[7] << 8) + ctype[8]
-        numtracks = (numbytes - 4) >> 3
-        if ctype[1] == 0x00:
-            cmd_label = [ f"[43]: READ TOC, LBA FORMAT, TRACK {ctype[6]}, {numtracks} TRACK(S)    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        else:
-            cmd_label = [ f"[43]: READ TOC, MSF FORMAT, TRACK {ctype[6]}, {numtracks} TRACK(S)    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-
-    elif (ctype[0] == 0x44):            # 44 = READ HEADER
-        lba = (ctype[2] << 24) + (ctype[3] << 16) + (ctype[4] << 8) + ctype[5]
-        numbytes = (ctype[7] << 8) + ctype[8]
-        if ctype[1] == 0x00:
-            cmd_label = [ f"[44]: READ HEADER, LBA {lba:08X}, {numbytes:04X} BYTES (RETURN IN LBA FORMAT)    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        else:
-            cmd_label = [ f"[44]: READ HEADER, LBA {lba:08X}, {numbytes:04X} BYTES (RETURN IN MSF FORMAT)    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-
-    elif (ctype[0] == 0x4B):            # 4B = PAUSE/RESUME
-        if ctype[8] == 0x00:
-            cmd_label = [ f"[4B]: PAUSE AUDIO PLAYBACK/SCANNING    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        else:
-            cmd_label = [ f"[4B]: RESUME AUDIO PLAYBACK/SCANNING    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-
-    elif (ctype[0] == 0xD8):            # D8 = AUDIO TRACK SEARCH
-        lba = (ctype[2] << 24) + (ctype[3] << 16) + (ctype[4] << 8) + ctype[5]
-        if ctype[1] == 0x00:
-            oper = "PAUSE"
-        else:
-            oper = "PLAY"
-
-        if ctype[9] == 0x00:
-            cmd_label = [ f"[D8]: AUDIO TRACK SEARCH - LBA 0x{lba:08X}, {oper}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        elif ctype[9] == 0x40:
-            cmd_label = [ f"[D8]: AUDIO TRACK SEARCH - MSF {ctype[2]:02X}:{ctype[3]:02X}:{ctype[4]:02X}, {oper}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        elif ctype[9] == 0x80:
-            cmd_label = [ f"[D8]: AUDIO TRACK SEARCH - TRACK {ctype[2]:02X}, {oper}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-
-    elif (ctype[0] == 0xD9):            # D9 = PLAY
-        lba = (ctype[2] << 24) + (ctype[3] << 16) + (ctype[4] << 8) + ctype[5]
-        playmode = ctype[1] & 0x03
-        if (playmode == 0):
-            mode = "(MUTE)"
-        elif (playmode == 1):
-            mode = "(L-CH)"
-        elif (playmode == 2):
-            mode = "(R-CH)"
-        elif (playmode == 3):
-            mode = "(STEREO)"
-        elif (playmode == 4):
-            mode = "(REPEAT)"
-        elif (playmode == 5):
-            mode = "(BUSY)"
-        elif (playmode == 6):
-            mode = "(UNKNOWN)"
-        else:
-            mode = "(UNKNOWN)"
-
-        if ctype[9] == 0x00:
-            cmd_label = [ f"[D9]: PLAY UNTIL - LBA 0x{lba:08X}, {mode}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        elif ctype[9] == 0x40:
-            cmd_label = [ f"[D9]: PLAY UNTIL - MSF {ctype[2]:02X}:{ctype[3]:02X}:{ctype[4]:02X}, {mode}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        elif ctype[9] == 0x80:
-            cmd_label = [ f"[D9]: PLAY UNTIL - TRACK {ctype[2]:02X}, {mode}    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-
-    elif (ctype[0] == 0xDA):            # DA = STILL
-        cmd_label = [ f"[DA]: STILL    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-
-    elif (ctype[0] == 0xDD):            # DD = READ SUBCODE-Q
-        numbytes = (ctype[1] & 0x1F)
-        cmd_label = [ f"[DD]: READ SUBCODEQ {numbytes} BYTES    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-
-    elif (ctype[0] == 0xDE):            # DE = READ TOC
-        rdtype = (ctype[1] & 3)
-        if rdtype == 0:
-            cmd_label = [ f"[DE]: READ TOC (NUM TRACKS)    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        elif rdtype == 1:
-            cmd_label = [ f"[DE]: READ TOC (LEADOUT)    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        elif rdtype == 2:
-            cmd_label = [ f"[DE]: READ TOC INFO (TRACK {ctype[2]:02X})    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-        elif rdtype == 3:
-            cmd_label = [ f"[DE]: READ TOC PARAMETER ({ctype[2]:02X})    [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} 0x{ctype[6]:02X} 0x{ctype[7]:02X} 0x{ctype[8]:02X} 0x{ctype[9]:02X} ]" ]
-
-    else:                               # ALL OTHERS
-        cmd_label = [ f"[{ctype[0]:02X}]: Unknown command  [ 0x{ctype[0]:02X} 0x{ctype[1]:02X} 0x{ctype[2]:02X} 0x{ctype[3]:02X} 0x{ctype[4]:02X} 0x{ctype[5]:02X} ]" ]
-
-    return cmd_label
-
-
 class Decoder(srd.Decoder):
     api_version = 3
     id = 'pcfx_scsi'
@@ -233,7 +38,7 @@ class Decoder(srd.Decoder):
     desc = 'SCSI protocol for NEC PC-FX videogame console'
     license = 'gplv2+'
     inputs = ['logic']
-    outputs = []
+    outputs = ['pcfx_scsi']
     tags = ['Retro computing']
     channels = (
         {'id': 'scsi_d0',  'name': 'D0',  'desc': 'Data 0'},
@@ -251,6 +56,25 @@ class Decoder(srd.Decoder):
         {'id': 'scsi_msg', 'name': 'MSG', 'desc': 'Msg'},
         {'id': 'scsi_ack', 'name': 'ACK', 'desc': 'Ack'},
     )
+    options = (
+        {'id': 'deglitch', 'desc': 'Min. pulse width (CD/IO/MSG/ACK/BSY)', 'default': 2},
+        {'id': 'deglitch_unit', 'desc': 'Min. pulse width unit', 'default': 'samples',
+            'values': ('samples', 'ns')},
+        {'id': 'data_detail', 'desc': 'Data In/Out annotations', 'default': 'per sector',
+            'values': ('per sector', 'per N bytes', 'per byte')},
+        {'id': 'group_bytes', 'desc': 'N bytes per Data In/Out annotation', 'default': 256},
+        {'id': 'repeats', 'desc': 'Repeated transactions', 'default': 'expand',
+            'values': ('collapse', 'expand')},
+        {'id': 'profile', 'desc': 'Profiling counters (printed at end)', 'default': 'no',
+            'values': ('no', 'yes')},
+        {'id': 'sector_check', 'desc': 'Sector checks (sync/header/EDC/ECC, needs NumPy)', 'default': 'no',
+            'values': ('no', 'yes')},
+        {'id': 'timing', 'desc': 'Timing checks', 'default': 'no',
+            'values': ('no', 'yes')},
+        {'id': 'binary', 'desc': 'Sectors read on binary output', 'default': 'no',
+            'values': ('no', 'data_in', 'sectors')},
+    ) + tuple({'id': 'timing_' + name, 'desc': f'{label} {kind}. (ns, 0 = off)', 'default': limit}
+              for (name, label, short, limit, kind, desc) in TIMING_RULES)
 
 # Each of these defines a piece of data and a color
 #
@@ -295,6 +119,15 @@ class Decoder(srd.Decoder):
         ('10', 'bytenum',     'Byte in Sequence'),   # 30 = (row 6)
 
         ('6',  'cmd_type',    'Cmd Type'),           # 31 = (row 3)
+
+        ('9',  'repeat',      'Repeated'),           # 32 = (row 7)
+        ('2',  'access',      'Disc access'),        # 33 = (row 8)
+        ('0',  'timing',      'Timing violation'),   # 34 = (row 9)
+        ('0',  'bad_sector',  'Bad sector'),         # 35 = (row 10)
+    )
+    binary = (
+        ('data_in',      'Data In of READ commands'),
+        ('sectors',      'Sectors read, each after an 8-byte LBA/length header'),
     )
     annotation_rows = (
         ('phase',        'Phase',       (0,1,2,3,4,5,6,7,8,9,10,)),
@@ -303,6 +136,10 @@ class Decoder(srd.Decoder):
         ('to_target',    'To Target',   (20,21,22,23,24,25,26,27,28,)),
         ('from_target',  'From Target', (29,)),
         ('byte_num',     'Byte Num',    (30,)),
+        ('repeats',      'Repeats',     (32,)),
+        ('access',       'Access',      (33,)),
+        ('timing',       'Timing',      (34,)),
+        ('sector_check', 'Sector Check', (35,)),
     )
 
 # Note - SCSI Phases:
@@ -331,6 +168,24 @@ class Decoder(srd.Decoder):
         self.datafound = 0           # Do not display subphases unless data was actually transferred within them
                                      # (could just be CD/IO/MSG toggling)
         self.cmd_type = [ 100, 101 ]
+        self.command_annote = 28
+        self.deglitcher = Deglitcher(1)
+        self.data_detail = 'per byte'
+        self.group_bytes = 256
+        self.transaction = TransactionBuilder()    # also tracks bytes per sector (MODE SELECT)
+        self.last_transaction = None # for the host gap before the next one
+        self.access = AccessPattern() # head position, blocks read and track starts
+        self.group_size = 0          # bytes per Data In/Out annotation in this subphase (0 = one per byte)
+        self.group_count = 0         # bytes in the current Data In/Out annotation
+        self.group_first = 0         # byte number of its first byte
+        self.group_preview = []      # values of its first bytes
+        self.groupstartsample = 0
+        self.repeats = None          # RepeatCollapser, if repeated transactions are collapsed
+        self.held_annotations = []   # annotations of the current transaction, while collapsing
+        self.timing = None           # TimingChecker, if timing is checked
+        self.sectors = None          # SectorValidator, if the sectors read are checked
+        self.profile = None          # DecodeProfile, if the 'profile' option is on
+        self.binary_class = None     # binary class the sectors read are put on, if any
 
 
     def metadata(self, key, value):
@@ -339,6 +194,11 @@ class Decoder(srd.Decoder):
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.out_python = self.register(srd.OUTPUT_PYTHON)
+        self.out_binary = self.register(srd.OUTPUT_BINARY)
+        self.out_meta = {}
+        for (name, label, desc) in METRICS:
+            self.out_meta[name] = self.register(srd.OUTPUT_META, meta=(float, label, desc))
 
 
     #
@@ -353,42 +213,89 @@ class Decoder(srd.Decoder):
     #
     # 2) Currently, SCSI_ATN is not evaluated
     #
-    # 3) No time values are currently evaluated (i.e. settling time or timeouts)
+    # 3) Timing is only checked on the edges waited for (see TimingChecker),
+    #    so without REQ or the data lines
     #
     def decode(self):
         if not self.samplerate:
             raise SamplerateError('Cannot decode without samplerate.')
 
+        # Pulses on CD/IO/MSG/ACK/BSY narrower than this are rejected as glitches
+        # (the default of 2 samples drops single-sample glitches)
+        self.deglitcher = Deglitcher(deglitch_samples(self.options['deglitch'],
+                                                      self.options['deglitch_unit'], self.samplerate))
+        self.data_detail = self.options['data_detail']
+        self.group_bytes = max(int(self.options['group_bytes']), 1)
+        if self.options['profile'] == 'yes':
+            self.profile = DecodeProfile(self.annotation_rows)
+        if self.options['sector_check'] == 'yes':
+            from .cdrom import SectorValidator             # (NumPy is only needed for this)
+            self.sectors = SectorValidator()
+        if self.options['timing'] == 'yes':
+            self.check_timing()
+        if self.options['binary'] != 'no':
+            self.binary_class = [name for (name, desc) in self.binary].index(self.options['binary'])
+        if self.options['repeats'] == 'collapse':
+            self.repeats = RepeatCollapser(lambda ss, es, count, transactions:
+                                           (ss, es, [32, repeat_texts(count, transactions)]))
+        try:
+            self.decode_states()
+        finally:
+            if self.state == 'INFO XFER':
+                # end of the input: the edges still pending in the deglitch filter take effect
+                for (edgesample, lines, edgepins) in self.deglitcher.finish():
+                    self.info_edge(edgesample, lines, edgepins)
+                    if self.state != 'INFO XFER':
+                        break
+            if self.repeats:
+                # end of the input: put what is still held back
+                self.put_held(self.repeats.finish() + self.held_annotations)
+                self.held_annotations = []
+            if self.profile:
+                self.profile.glitches = self.deglitcher.glitches
+                self.profile.report()
+
+    def decode_states(self):
         while True:
             if self.state == 'BUS FREE':
                 # Wait for falling transition on channel 8 (scsi_sel), which starts arbitration/selection
-                self.wait({8: 'f'})
-                self.put(self.startsamplenum, self.samplenum, self.out_ann,
-                                 [0, ['Bus Free', 'Free', 'F']])
+                if self.profile:
+                    self.profile.wait(self, {8: 'f'})
+                else:
+                    self.wait({8: 'f'})
+                self.emit(self.startsamplenum, self.samplenum, [0, ['Bus Free', 'Free', 'F']])
+                if self.samplerate and self.last_transaction:
+                    self.put(status_end(self.last_transaction), self.samplenum, self.out_meta['host_gap'],
+                             host_gap(self.last_transaction, self.samplenum, self.samplerate))
+                if self.timing:
+                    self.put_timing(self.timing.selection_start(self.samplenum))
                 self.state = 'ARBITRATION'
                 self.startsamplenum = self.samplenum
 
 
             if self.state == 'ARBITRATION':
                 # Wait for falling transition on channel 9 (scsi_bsy), which completes arbitration
-                (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack) = self.wait({9: 'f'})
+                (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack) = \
+                    self.profile.wait(self, {9: 'f'}) if self.profile else self.wait({9: 'f'})
                 pins = (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack)
                 value = getluns(pins)
-                self.put(self.startsamplenum, self.samplenum, self.out_ann,
-                                 [1, ['Arbitration', 'Arb', 'A']])
-                self.put(self.startsamplenum, self.samplenum, self.out_ann,
-                                 [11, [value]])
+                self.transaction.start(self.startsamplenum, getbyteval(pins), value)
+                self.emit(self.startsamplenum, self.samplenum, [1, ['Arbitration', 'Arb', 'A']])
+                self.emit(self.startsamplenum, self.samplenum, [11, [value]])
+                if self.timing:
+                    self.put_timing(self.timing.target_busy(self.samplenum))
                 self.state = 'SELECT'
                 self.startsamplenum = self.samplenum
 
             if self.state == 'SELECT':
                 # Wait for rising transition on channel 8 (scsi_sel), which completed selection
-                (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack) = self.wait({8: 'r'})
+                (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack) = \
+                    self.profile.wait(self, {8: 'r'}) if self.profile else self.wait({8: 'r'})
                 value = getluns(pins)
-                self.put(self.startsamplenum, self.samplenum, self.out_ann,
-                                 [2, ['Selection', 'Sel', 'Se']])
-                self.put(self.startsamplenum, self.samplenum, self.out_ann,
-                                 [11, [value]])
+                self.emit(self.startsamplenum, self.samplenum, [2, ['Selection', 'Sel', 'Se']])
+                self.emit(self.startsamplenum, self.samplenum, [11, [value]])
+                if self.timing:
+                    self.put_timing(self.timing.selection_end(self.samplenum))
                 self.state = 'INFO XFER'
                 self.startsamplenum = self.samplenum
                 # set up for (potential) data captures
@@ -396,7 +303,12 @@ class Decoder(srd.Decoder):
                 self.datastartsample = self.samplenum
                 # get values of cd, io, msg for subphase
                 self.subphase = (scsi_msg << 2) + (scsi_cd << 1) + scsi_io
+                self.group_size = self.data_group_size(self.subphase)
                 self.phasestartsample = self.samplenum
+                self.deglitcher.reset()
+                if (scsi_bsy == 1):
+                    self.deglitcher.hold(4, self.samplenum,
+                                         (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack))
 
 
             if self.state == 'INFO XFER':
@@ -404,123 +316,199 @@ class Decoder(srd.Decoder):
                 # SCSI_CD = Command (when low), Data (when High)
                 # SCSI_IO = Input (when low), Output (when High)
                 #
-                # Wait for rising transition on channel 9 (scsi_bsy), which completes transaction
-                (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack) = self.wait([{10: 'e'}, {11: 'e'}, {12: 'e'}, {13: 'e'}, {9: 'h'}])
+                # Wait for any edge on CD/IO/MSG/ACK or BSY (rising BSY completes the transaction).
+                # Edges only take effect once the deglitch filter has seen them stay stable; a
+                # pending BSY edge also waits for its deadline, as nothing else may follow it.
+                conditions = [{10: 'e'}, {11: 'e'}, {12: 'e'}, {13: 'e'}, {9: 'e'}]
+                bsy_deadline = self.deglitcher.deadline(4)
+                if bsy_deadline is not None:
+                    conditions.append({'skip': bsy_deadline - self.samplenum})
+
+                pins = self.profile.wait(self, conditions) if self.profile else self.wait(conditions)
+
+                for (edgesample, lines, edgepins) in self.deglitcher.edges(self.samplenum, self.matched & 0b11111, pins):
+                    self.info_edge(edgesample, lines, edgepins)
+                    if self.state != 'INFO XFER':
+                        self.deglitcher.reset()
+                        break
 
-                pins = (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack)
+            self.last_samplenum = self.samplenum
 
-                self.match_criteria = self.matched
-                double_check = 1
-                end_subphase = 0
-
-                while (double_check == 1):
-
-                    end_subphase = 0
-                    (ch0, ch1, ch2, ch3, ch4, ch5, ch6, ch7, ch8, ch9, ch10, ch11, ch12, ch13) = self.wait([{10: 'e'}, {11: 'e'}, {12: 'e'}, {13: 'e'}, {9: 'e'}, {'skip': 1}])
-
-                    if ((self.matched & 0b11111) == 0):             # if nothing triggered except the 'skip' message (critical lines didn't toggle)
-                        double_check = 0
-
-                    if ((self.match_criteria & (0b1 << 0)) and (self.matched & (0b1 << 0))):        # They should cancel each other out
-                        self.match_criteria = (self.match_criteria & 0b111110)
-                        self.matched        = (self.matched & 0b111110)
-
-                    if ((self.match_criteria & (0b1 << 1)) and (self.matched & (0b1 << 1))):        # They should cancel each other out
-                        self.match_criteria = (self.match_criteria & 0b111101)
-                        self.matched        = (self.matched & 0b111101)
-
-                    if ((self.match_criteria & (0b1 << 2)) and (self.matched & (0b1 << 2))):        # They should cancel each other out
-                        self.match_criteria = (self.match_criteria & 0b111011)
-                        self.matched        = (self.matched & 0b111011)
-
-                    if ((self.match_criteria & (0b1 << 3)) and (self.matched & (0b1 << 3))):        # They should cancel each other out
-                        self.match_criteria = (self.match_criteria & 0b110111)
-                        self.matched        = (self.matched & 0b110111)
-
-                    if ((self.match_criteria & (0b1 << 4)) and (self.matched & (0b1 << 4))):        # They should cancel each other out
-                        self.match_criteria = (self.match_criteria & 0b101111)
-                        self.matched        = (self.matched & 0b101111)
-
-                    if ((self.match_criteria & (0b1 << 0)) and not (self.matched & (0b1 << 0))):    # triggered on first wait, and confirmed as 'not a glitch'
-                        end_subphase = 1
-
-                    if ((self.match_criteria & (0b1 << 1)) and not (self.matched & (0b1 << 1))):
-                        end_subphase = 1
-
-                    if ((self.match_criteria & (0b1 << 2)) and not (self.matched & (0b1 << 2))):
-                        end_subphase = 1
-
-                    # falling ACK (end of REQ, start of ACK) means data should be sampled
-                    if ((self.match_criteria & (0b1 << 3)) and not (self.matched & (0b1 << 3))):
-                        if (scsi_ack == 0):                                             # sample data on falling ACK
-                            self.dataval = getbyteval(pins)
-
-                        else:
-
-                    # rising ACK means end of data pulse
-                            if (self.subphase == 5):        # COMMAND
-                                if (self.datafound == 0):   # first byte of command
-                                    command_annote = command_annotation(self.dataval)
-                                    self.cmd_type.clear()                    # clear cmd_type list
-                                self.cmd_type.append(self.dataval)           # add bytes to cmd_type list
-                            else:
-                                command_annote = 20                     # DATA (if data is being xferred to target)
-
-                            if (self.subphase & (0b1 << 0)):                            # If scsi_io is set, direction is to target device
-                                self.put(self.datastartsample, self.samplenum, self.out_ann,
-                                                 [command_annote, ['0x%2.2X' % self.dataval]])
-                            else:                                                       # If scsi_io is not set, direction is from target device
-                                self.put(self.datastartsample, self.samplenum, self.out_ann,
-                                                 [29, ['0x%2.2X' % self.dataval]])
-                            self.put(self.datastartsample, self.samplenum, self.out_ann,
-                                                 [30, ['%d' % self.datafound]])
-                            self.datafound = self.datafound + 1
-                            self.datastartsample = self.samplenum
-
-                    # High BSY means end of Information Transfer phase
-                    if ((self.match_criteria & (0b1 << 4)) and not (self.matched & (0b1 << 4))):
-                        self.put(self.startsamplenum, self.samplenum, self.out_ann,
-                                         [4, ['Information Transfer', 'Info Xfer', 'Inf']])
-                        self.state = 'BUS FREE'
-                        self.startsamplenum = self.samplenum
-                        end_subphase = 1
-
-                    if (end_subphase == 1):
-                        temp_subphase = (scsi_msg << 2) + (scsi_cd << 1) + (scsi_io << 0)
-                        if self.datafound > 0:                                          # only annotate if there was data transferred
-                            subph_label = subphase_label(self.subphase)
-                            self.put(self.phasestartsample, self.samplenum, self.out_ann,
-                                         [(12+self.subphase), subph_label])
-
-                            if (self.subphase == 5):                                    # If the command has ended, make extended annotation
-                                cmd_type_label = command_label(self.cmd_type)
-                                self.put(self.phasestartsample, self.samplenum, self.out_ann,
-                                         [31, cmd_type_label])
-
-                        self.phasestartsample = self.samplenum
-                        self.subphase = temp_subphase
-                        self.datafound = 0
-                        self.datastartsample = self.samplenum
-                        end_subphase = 0
-
-                    if (double_check == 1):
-                        self.last_samplenum = self.samplenum
-                        self.match_criteria = self.matched
-                        d0 = ch0
-                        d1 = ch1
-                        d2 = ch2
-                        d3 = ch3
-                        d4 = ch4
-                        d5 = ch5
-                        d6 = ch6
-                        d7 = ch7
-                        scsi_sel = ch8
-                        scsi_bsy = ch9
-                        scsi_cd  = ch10
-                        scsi_io  = ch11
-                        scsi_msg = ch12
-                        scsi_ack = ch13
-                        pins = (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack)
 
+    def info_edge(self, samplenum, lines, pins):
+        # Handle deglitched edges at 'samplenum' during Information Transfer.
+        # 'lines' has bit 0 = CD, 1 = IO, 2 = MSG, 3 = ACK, 4 = BSY
+        # and 'pins' holds the values of all channels at that sample.
+        (d0, d1, d2, d3, d4, d5, d6, d7, scsi_sel, scsi_bsy, scsi_cd, scsi_io, scsi_msg, scsi_ack) = pins
+
+        if self.timing:
+            violations = self.timing.info_edge(samplenum, lines, scsi_ack, scsi_bsy)
+            if violations:
+                self.put_timing(violations)
+
+        end_subphase = 0
+        if (lines & 0b111):                                             # CD, IO or MSG changed
+            end_subphase = 1
+
+        if (lines & (0b1 << 3)):
+            if (scsi_ack == 0):                                         # sample data on falling ACK
+                self.dataval = getbyteval(pins)
+
+            elif self.group_size:
+
+            # rising ACK, Data In/Out grouped into one annotation per sector or N bytes
+                self.transaction.byte(self.subphase, self.dataval)
+                if self.profile:
+                    self.profile.bytes += 1
+                if (self.group_count == 0):
+                    self.group_first = self.datafound
+                    self.groupstartsample = self.datastartsample
+                    self.group_preview = []
+                if (self.group_count < GROUP_PREVIEW_BYTES):
+                    self.group_preview.append(self.dataval)
+                self.group_count = self.group_count + 1
+                if (self.group_count == self.group_size):
+                    self.put_group(samplenum)
+                self.datafound = self.datafound + 1
+                self.datastartsample = samplenum
 
-            self.last_samplenum = self.samplenum
+            else:
+
+            # rising ACK means end of data pulse
+                self.transaction.byte(self.subphase, self.dataval)
+                if self.profile:
+                    self.profile.bytes += 1
+                if (self.subphase == 5):        # COMMAND
+                    if (self.datafound == 0):   # first byte of command
+                        self.command_annote = command_annotation(self.dataval)
+                        self.cmd_type.clear()                    # clear cmd_type list
+                    self.cmd_type.append(self.dataval)           # add bytes to cmd_type list
+                else:
+                    self.command_annote = 20                     # DATA (if data is being xferred to target)
+
+                if (self.subphase & (0b1 << 0)):                            # If scsi_io is set, direction is to target device
+                    self.emit(self.datastartsample, samplenum, [self.command_annote, HEX_TEXT[self.dataval]])
+                else:                                                       # If scsi_io is not set, direction is from target device
+                    self.emit(self.datastartsample, samplenum, [29, HEX_TEXT[self.dataval]])
+                self.emit(self.datastartsample, samplenum, [30, byte_number_text(self.datafound)])
+                self.datafound = self.datafound + 1
+                self.datastartsample = samplenum
+
+        # High BSY means end of Information Transfer phase
+        if ((lines & (0b1 << 4)) and (scsi_bsy == 1)):
+            self.emit(self.startsamplenum, samplenum, [4, ['Information Transfer', 'Info Xfer', 'Inf']])
+            self.state = 'BUS FREE'
+            self.startsamplenum = samplenum
+            end_subphase = 1
+
+        if (end_subphase == 1):
+            temp_subphase = (scsi_msg << 2) + (scsi_cd << 1) + (scsi_io << 0)
+            if self.group_count > 0:                                        # last (partial) sector
+                self.put_group(self.datastartsample)
+            if self.datafound > 0:                                          # only annotate if there was data transferred
+                self.transaction.phase(self.subphase, self.phasestartsample, samplenum)
+                subph_label = subphase_label(self.subphase)
+                self.emit(self.phasestartsample, samplenum, [(12+self.subphase), subph_label])
+
+                if (self.subphase == 5):                                    # If the command has ended, make extended annotation
+                    if self.profile:
+                        cmd_type_label = self.profile.format(command_label, self.cmd_type)
+                    else:
+                        cmd_type_label = command_label(self.cmd_type)
+                    self.emit(self.phasestartsample, samplenum, [31, cmd_type_label])
+
+            if (self.state == 'BUS FREE'):                                  # transaction complete
+                self.last_transaction = self.transaction.finish(samplenum)
+                self.put(self.transaction.startsample, samplenum, self.out_python,
+                         ['TRANSACTION', self.last_transaction])
+                if self.samplerate:
+                    self.put_metrics(self.last_transaction)
+                if self.binary_class is not None:
+                    self.put_sectors(self.last_transaction)
+                if self.sectors:
+                    self.put_bad_sectors(self.last_transaction)
+                access = self.access.add(self.last_transaction)
+                if access:
+                    self.emit(access.startsample, access.endsample, [33, access_texts(access)])
+                if self.repeats:
+                    self.put_held(self.repeats.add(self.last_transaction, self.held_annotations))
+                    self.held_annotations = []
+
+            self.phasestartsample = samplenum
+            self.subphase = temp_subphase
+            self.group_size = self.data_group_size(temp_subphase)
+            self.datafound = 0
+            self.datastartsample = samplenum
+
+    def data_group_size(self, subphase):
+        # Bytes per annotation in Data In (6) / Data Out (7); 0 annotates each byte
+        if ((subphase & 0b110) != 0b110) or (self.data_detail == 'per byte'):
+            return 0
+        if (self.data_detail == 'per sector'):
+            return self.transaction.block_length
+        return self.group_bytes
+
+    def put_metrics(self, transaction):
+        # Timing of a completed transaction, one OUTPUT_META value per metric
+        for (name, value) in transaction_metrics(transaction, self.samplerate).items():
+            if value is not None:
+                self.put(transaction.startsample, transaction.endsample, self.out_meta[name], value)
+
+    def check_timing(self):
+        # From here on, info_edge() also checks the edges with a TimingChecker
+        self.timing = TimingChecker({name: self.options['timing_' + name] for name in TIMING_DEFAULTS},
+                                    self.samplerate)
+
+    def put_timing(self, violations):
+        # Violations are put straight away, so that a collapsed run of
+        # repeats cannot hide them
+        self.put_held([(ss, es, [34, texts]) for (ss, es, texts) in violations])
+
+    def emit(self, ss, es, data):
+        # An annotation of the current transaction; while repeats are
+        # collapsed, it is held back until the transaction is known not to
+        # repeat the ones before it (see put_held)
+        if self.repeats:
+            self.held_annotations.append((ss, es, data))
+        elif self.profile:
+            self.profile.put(self, ss, es, data)
+        else:
+            self.put(ss, es, self.out_ann, data)
+
+    def put_held(self, annotations):
+        for (ss, es, data) in annotations:
+            if self.profile:
+                self.profile.put(self, ss, es, data)
+            else:
+                self.put(ss, es, self.out_ann, data)
+
+    def put_sectors(self, transaction):
+        # Data In of a READ, one block at a time, on the chosen OUTPUT_BINARY
+        # class (each block is copied once, into the bytes put)
+        (ss, es) = data_in_span(transaction)
+        for (lba, sector) in read_sectors(transaction):
+            if self.binary_class == 0:
+                data = bytes(sector)
+            else:
+                data = SECTOR_HEADER.pack(lba, len(sector)) + sector
+            self.put(ss, es, self.out_binary, [self.binary_class, data])
+
+    def put_bad_sectors(self, transaction):
+        # One annotation over the Data In of a READ with bad sectors
+        annotation = self.sectors.annotation(transaction)
+        if annotation:
+            (ss, es, texts) = annotation
+            self.emit(ss, es, [35, texts])
+
+    def put_group(self, endsample):
+        if self.profile:
+            (data_texts, range_texts) = self.profile.format(data_group_texts, self.group_first, self.group_count,
+                                                            self.group_preview)
+        else:
+            (data_texts, range_texts) = data_group_texts(self.group_first, self.group_count, self.group_preview)
+        if (self.subphase & (0b1 << 0)):                                    # to target device
+            self.emit(self.groupstartsample, endsample, [20, data_texts])
+        else:                                                               # from target device
+            self.emit(self.groupstartsample, endsample, [29, data_texts])
+        self.emit(self.groupstartsample, endsample, [30, range_texts])
+        self.group_count = 0
@@ -0,0 +1,101 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Profiling counters for Decoder.decode() (the 'profile' option).
+#
+# With the option on, the decoder holds a DecodeProfile in 'profile' and
+# goes through it at each place that is counted or timed: wait(), putting
+# annotations, label formatting and the bytes of a transaction.  With it
+# off, 'profile' is None, and each of those places costs one test.  The
+# report is written when the decode ends (see Decoder.decode()).
+
+import sys
+from time import perf_counter
+
+STATES = ('BUS FREE', 'ARBITRATION', 'SELECT', 'INFO XFER')
+
+
+class DecodeProfile:
+    '''Counters and timers of one decode, reported when the input ends.'''
+
+    def __init__(self, annotation_rows):
+        self.waits = dict.fromkeys(STATES, 0)        # wait() calls, by state
+        self.wait_time = 0.0
+        self.put_time = 0.0
+        self.format_time = 0.0                       # command labels and Data In/Out groups
+        self.bytes = 0
+        self.glitches = 0
+        self.row_of = {}                             # annotation class -> row id
+        for (row, desc, classes) in annotation_rows:
+            for ann in classes:
+                self.row_of[ann] = row
+        self.annotations = dict.fromkeys([row for (row, desc, classes) in annotation_rows], 0)
+        self.start = perf_counter()
+        self.reported = False
+
+    def wait(self, decoder, conditions):
+        # decoder.wait(conditions), counted by state and timed
+        self.waits[decoder.state] = self.waits.get(decoder.state, 0) + 1
+        start = perf_counter()
+        try:
+            return decoder.wait(conditions)
+        finally:
+            self.wait_time += perf_counter() - start
+
+    def put(self, decoder, ss, es, data):
+        # An annotation put, counted by row and timed
+        start = perf_counter()
+        row = self.row_of.get(data[0])
+        self.annotations[row] = self.annotations.get(row, 0) + 1
+        decoder.put(ss, es, decoder.out_ann, data)
+        self.put_time += perf_counter() - start
+
+    def format(self, function, *args):
+        # function(*args), timed as label formatting
+        start = perf_counter()
+        result = function(*args)
+        self.format_time += perf_counter() - start
+        return result
+
+    def lines(self):
+        total = perf_counter() - self.start
+        lines = ['PCFX SCSI decode profile: %.3f s' % total]
+        lines.append('  wait() calls: %d (%.3f s)' % (sum(self.waits.values()), self.wait_time))
+        for (state, count) in self.waits.items():
+            lines.append('    %-12s %d' % (state, count))
+        lines.append('  bytes decoded: %d' % self.bytes)
+        if self.bytes:
+            lines.append('  wait() calls per byte: %.2f' % (sum(self.waits.values()) / self.bytes))
+        lines.append('  glitches rejected: %d' % self.glitches)
+        lines.append('  annotations: %d (put() %.3f s)' % (sum(self.annotations.values()), self.put_time))
+        for (row, count) in self.annotations.items():
+            lines.append('    %-12s %d' % (row or '(no row)', count))
+        lines.append('  label formatting: %.3f s' % self.format_time)
+        lines.append('  decoder (the rest): %.3f s' % (total - self.wait_time - self.put_time - self.format_time))
+        return lines
+
+    def report(self, out=None):
+        # Once per decode
+        if self.reported:
+            return
+        self.reported = True
+        out = out or sys.stderr
+        for line in self.lines():
+            out.write(line + '\n')
+        out.flush()
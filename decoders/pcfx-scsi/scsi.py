@@ -0,0 +1,1409 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+# Helpers shared by the sigrok decoder (pd.py) and the offline tools; this
+# module must not depend on the sigrokdecode runtime.
+
+from array import array
+from collections import OrderedDict
+import struct
+import zlib
+
+from .lists import BUS_LEVELS, BYTE_VALUE, LUN_LABEL
+
+
+def getluns(datapins):
+    return LUN_LABEL[BUS_LEVELS[datapins[:8]]]
+
+
+def getbyteval(datapins):
+    return BYTE_VALUE[BUS_LEVELS[datapins[:8]]]
+
+
+def subphase_label(subphase):
+    if subphase == 0:
+        sp_label = ['Message In',      'Msg In',   'MI']
+    elif subphase == 1:
+        sp_label = ['Message Out',     'Msg Out',  'MO']
+    elif subphase == 2:
+        sp_label = ['Unused Subphase', 'Unused',   'U']
+    elif subphase == 3:
+        sp_label = ['Unused Subphase', 'Unused',   'U']
+    elif subphase == 4:
+        sp_label = ['Status',          'Stat',     'S']
+    elif subphase == 5:
+        sp_label = ['Command',         'Cmd',      'C']
+    elif subphase == 6:
+        sp_label = ['Data In',         'Data In',  'DI']
+    else:
+        sp_label = ['Data Out',        'Data Out', 'DO']
+    return sp_label
+
+
+#
+# Command Descriptor Blocks (CDBs)
+#
+# Each opcode from reference/SCSI_Command_List.txt has an entry in COMMANDS:
+# (name, annotation class, field parser).  The parser takes the complete CDB
+# and returns the text which follows '[XX]: ' in the label.  The CDB length
+# is given by the opcode's group (top 3 bits); the PC-FX vendor-unique
+# commands (groups 6 and 7) are 10 bytes long.
+#
+
+CDB_GROUP_LENGTH = (6, 10, 10, 6, 6, 12, 10, 10)
+
+# Annotation classes used for the command bytes (see Decoder.annotations)
+STATUS_TYPE = 21
+DIRECTORY_TYPE = 22
+DATA_TYPE = 23
+AUDIO_TYPE = 24
+SUBCODE_TYPE = 25
+UNKNOWN_TYPE = 28
+
+
+def cdb_length(opcode):
+    return CDB_GROUP_LENGTH[opcode >> 5]
+
+
+def _address(c, addr_type):
+    # 4-byte address in bytes 2-5, interpreted by the TYPE bits (0x00/0x40/0x80)
+    if addr_type == 0x00:
+        lba = (c[2] << 24) + (c[3] << 16) + (c[4] << 8) + c[5]
+        return f"LBA 0x{lba:08X}"
+    elif addr_type == 0x40:
+        return f"MSF {c[2]:02X}:{c[3]:02X}:{c[4]:02X}"
+    elif addr_type == 0x80:
+        return f"TRACK {c[2]:02X}"
+    return f"UNKNOWN ADDRESS TYPE (0x{addr_type:02X})"
+
+
+def _immed(c):
+    return ", IMMED" if (c[1] & 0x01) else ""
+
+
+def _test_unit_ready(c):
+    return "TEST UNIT READY"
+
+
+def _rezero_unit(c):
+    return "REZERO UNIT"
+
+
+def _request_sense(c):
+    return f"REQUEST SENSE ({c[4]} bytes)"
+
+
+def _read6(c):
+    lba = ((c[1] & 0x1F) << 16) + (c[2] << 8) + c[3]
+    blks = c[4] if c[4] else 256
+    return f"READ LBA 0x{lba:06X}, 0x{blks:02X} BLOCKS"
+
+
+def _seek6(c):
+    lba = ((c[1] & 0x1F) << 16) + (c[2] << 8) + c[3]
+    return f"SEEK LBA 0x{lba:06X}"
+
+
+def _no_operation(c):
+    return "NO OPERATION"
+
+
+def _inquiry(c):
+    return f"INQUIRY LUN {c[1] >> 5}, {c[4]} BYTES"
+
+
+def _mode_select(c):
+    if c[1] == 0x00:
+        return f"MODE SELECT (VENDOR-SPECIFIC), LIST LENGTH=0x{c[4]:02X}"
+    return f"MODE SELECT (SCSI-2 COMPLIANT), LIST LENGTH=0x{c[4]:02X}"
+
+
+def _reserve(c):
+    return "RESERVE"
+
+
+def _release(c):
+    return "RELEASE"
+
+
+def _mode_sense(c):
+    pc = (c[2] & 0xC0) >> 6
+    page_code = (c[2] & 0x3F)
+    if (c[1] == 0x00) and (c[2] == 0x00):
+        return f"MODE SENSE (VENDOR-SPECIFIC), LIST LENGTH=0x{c[4]:02X}"
+    return f"MODE SENSE PC={pc}, PAGE CODE=0x{page_code:02X}, LIST LENGTH=0x{c[4]:02X}"
+
+
+_START_STOP = ("STOP", "START", "STOP & EJECT", "LOAD & START")
+
+
+def _start_stop_unit(c):
+    return f"START/STOP UNIT - {_START_STOP[c[4] & 0x03]}{_immed(c)}"
+
+
+def _send_diagnostic(c):
+    if c[1] & 0x04:
+        return "SEND DIAGNOSTIC (SELF TEST)"
+    return "SEND DIAGNOSTIC"
+
+
+def _prevent_allow(c):
+    if c[4] == 0x00:
+        return "ALLOW MEDIUM REMOVAL"
+    return "PREVENT MEDIUM REMOVAL"
+
+
+def _read_capacity(c):
+    lba = (c[2] << 24) + (c[3] << 16) + (c[4] << 8) + c[5]
+    return f"READ CD-ROM CAPACITY, LBA 0x{lba:08X}, PMI={c[8] & 0x01}"
+
+
+def _read10(c):
+    blks = (c[7] << 8) + c[8]
+    if c[9] in (0x00, 0x40, 0x80):
+        return f"READ {_address(c, c[9])}, 0x{blks:04X} BLOCKS"
+    return f"UNKNOWN READ, 0x{blks:04X} BLOCKS"
+
+
+def _seek10(c):
+    return f"SEEK {_address(c, c[9] & 0xC0)}"
+
+
+def _verify10(c):
+    blks = (c[7] << 8) + c[8]
+    return f"VERIFY {_address(c, c[9] & 0xC0)}, 0x{blks:04X} BLOCKS"
+
+
+_SUBCHANNEL_FORMATS = {
+    0x00: "SUB-Q CHANNEL DATA",
+    0x01: "CURRENT POSITION",
+    0x02: "MEDIA CATALOG NUMBER",
+}
+
+
+def _read_subchannel(c):
+    numbytes = (c[7] << 8) + c[8]
+    msf = "MSF" if (c[1] & 0x02) else "LBA"
+    if not (c[2] & 0x40):
+        data = "HEADER ONLY"
+    elif c[3] == 0x03:
+        data = f"ISRC (TRACK {c[6]})"
+    else:
+        data = _SUBCHANNEL_FORMATS.get(c[3], f"FORMAT 0x{c[3]:02X}")
+    return f"READ SUB-CHANNEL, {data}, {msf} FORMAT, {numbytes} BYTES"
+
+
+def _read_toc(c):
+    numbytes = (c[7] << 8) + c[8]
+    numtracks = (numbytes - 4) >> 3
+    if c[1] == 0x00:
+        return f"READ TOC, LBA FORMAT, TRACK {c[6]}, {numtracks} TRACK(S)"
+    return f"READ TOC, MSF FORMAT, TRACK {c[6]}, {numtracks} TRACK(S)"
+
+
+def _read_header(c):
+    lba = (c[2] << 24) + (c[3] << 16) + (c[4] << 8) + c[5]
+    numbytes = (c[7] << 8) + c[8]
+    if c[1] == 0x00:
+        return f"READ HEADER, LBA {lba:08X}, {numbytes:04X} BYTES (RETURN IN LBA FORMAT)"
+    return f"READ HEADER, LBA {lba:08X}, {numbytes:04X} BYTES (RETURN IN MSF FORMAT)"
+
+
+def _play_msf(c):
+    # binary (not BCD) minutes/seconds/frames
+    return f"PLAY AUDIO MSF {c[3]:02d}:{c[4]:02d}:{c[5]:02d} - {c[6]:02d}:{c[7]:02d}:{c[8]:02d}"
+
+
+def _play_track_index(c):
+    return f"PLAY AUDIO TRACK {c[4]} INDEX {c[5]} - TRACK {c[7]} INDEX {c[8]}"
+
+
+def _play_track_relative10(c):
+    lba = (c[2] << 24) + (c[3] << 16) + (c[4] << 8) + c[5]
+    blks = (c[7] << 8) + c[8]
+    return f"PLAY AUDIO TRACK {c[6]}, RELATIVE LBA 0x{lba:08X}, 0x{blks:04X} BLOCKS"
+
+
+def _pause_resume(c):
+    if c[8] == 0x00:
+        return "PAUSE AUDIO PLAYBACK/SCANNING"
+    return "RESUME AUDIO PLAYBACK/SCANNING"
+
+
+def _read12(c):
+    blks = (c[6] << 24) + (c[7] << 16) + (c[8] << 8) + c[9]
+    return f"READ {_address(c, c[11] & 0xC0)}, 0x{blks:08X} BLOCKS"
+
+
+def _play_track_relative12(c):
+    lba = (c[2] << 24) + (c[3] << 16) + (c[4] << 8) + c[5]
+    blks = (c[6] << 24) + (c[7] << 16) + (c[8] << 8) + c[9]
+    return f"PLAY AUDIO TRACK {c[10]}, RELATIVE LBA 0x{lba:08X}, 0x{blks:08X} BLOCKS"
+
+
+def _verify12(c):
+    blks = (c[6] << 24) + (c[7] << 16) + (c[8] << 8) + c[9]
+    return f"VERIFY {_address(c, c[11] & 0xC0)}, 0x{blks:08X} BLOCKS"
+
+
+def _audio_scan(c):
+    speed = "FAST" if (c[1] & 0x02) else "SLOW"
+    direction = "REVERSE" if (c[1] & 0x01) else "FORWARD"
+    return f"AUDIO SCAN {speed} {direction} UNTIL {_address(c, c[9] & 0xC0)}"
+
+
+def _audio_track_search(c):
+    oper = "PLAY" if c[1] else "PAUSE"
+    return f"AUDIO TRACK SEARCH - {_address(c, c[9])}, {oper}"
+
+
+_PLAY_MODES = ("(MUTE)", "(L-CH)", "(R-CH)", "(STEREO)", "(REPEAT)", "(BUSY)", "(UNKNOWN)", "(UNKNOWN)")
+
+
+def _play(c):
+    return f"PLAY UNTIL - {_address(c, c[9])}, {_PLAY_MODES[c[1] & 0x07]}"
+
+
+def _still(c):
+    return "STILL"
+
+
+def _set_stop_time(c):
+    # BCD minutes:seconds
+    return f"SET STOP-TIME {c[1] & 0x1F:02X}:{c[2]:02X}"
+
+
+def _eject(c):
+    return f"EJECT{_immed(c)}"
+
+
+def _read_subcode_q(c):
+    return f"READ SUBCODEQ {c[1] & 0x1F} BYTES"
+
+
+def _read_toc_vendor(c):
+    rdtype = (c[1] & 3)
+    if rdtype == 0:
+        return "READ TOC (NUM TRACKS)"
+    elif rdtype == 1:
+        return "READ TOC (LEADOUT)"
+    elif rdtype == 2:
+        return f"READ TOC INFO (TRACK {c[2]:02X})"
+    return f"READ TOC PARAMETER ({c[2]:02X})"
+
+
+COMMANDS = {
+    0x00: ("TEST UNIT READY",                 STATUS_TYPE,    _test_unit_ready),
+    0x01: ("REZERO UNIT",                     STATUS_TYPE,    _rezero_unit),
+    0x03: ("REQUEST SENSE",                   STATUS_TYPE,    _request_sense),
+    0x08: ("READ(6)",                         DATA_TYPE,      _read6),
+    0x0B: ("SEEK(6)",                         DATA_TYPE,      _seek6),
+    0x0D: ("NO OPERATION",                    STATUS_TYPE,    _no_operation),
+    0x12: ("INQUIRY",                         STATUS_TYPE,    _inquiry),
+    0x15: ("MODE SELECT",                     STATUS_TYPE,    _mode_select),
+    0x16: ("RESERVE",                         STATUS_TYPE,    _reserve),
+    0x17: ("RELEASE",                         STATUS_TYPE,    _release),
+    0x1A: ("MODE SENSE",                      STATUS_TYPE,    _mode_sense),
+    0x1B: ("START/STOP UNIT",                 STATUS_TYPE,    _start_stop_unit),
+    0x1D: ("SEND DIAGNOSTIC",                 STATUS_TYPE,    _send_diagnostic),
+    0x1E: ("PREVENT/ALLOW MEDIUM REMOVAL",    STATUS_TYPE,    _prevent_allow),
+    0x25: ("READ CD-ROM CAPACITY",            DIRECTORY_TYPE, _read_capacity),
+    0x28: ("READ EXTENDED(10)",               DATA_TYPE,      _read10),
+    0x2B: ("SEEK EXTENDED(10)",               DATA_TYPE,      _seek10),
+    0x2F: ("VERIFY",                          DATA_TYPE,      _verify10),
+    0x42: ("READ SUB-CHANNEL",                SUBCODE_TYPE,   _read_subchannel),
+    0x43: ("READ TOC",                        DIRECTORY_TYPE, _read_toc),
+    0x44: ("READ HEADER",                     DIRECTORY_TYPE, _read_header),
+    0x47: ("PLAY AUDIO MSF",                  AUDIO_TYPE,     _play_msf),
+    0x48: ("PLAY AUDIO TRACK INDEX",          AUDIO_TYPE,     _play_track_index),
+    0x49: ("PLAY AUDIO TRACK RELATIVE",       AUDIO_TYPE,     _play_track_relative10),
+    0x4B: ("PAUSE/RESUME",                    AUDIO_TYPE,     _pause_resume),
+    0xA8: ("READ(12)",                        DATA_TYPE,      _read12),
+    0xA9: ("PLAY AUDIO TRACK RELATIVE(12)",   AUDIO_TYPE,     _play_track_relative12),
+    0xAF: ("VERIFY(12)",                      DATA_TYPE,      _verify12),
+    0xD2: ("AUDIO SCAN",                      AUDIO_TYPE,     _audio_scan),
+    0xD8: ("AUDIO TRACK SEARCH",              AUDIO_TYPE,     _audio_track_search),
+    0xD9: ("PLAY",                            AUDIO_TYPE,     _play),
+    0xDA: ("STILL",                           AUDIO_TYPE,     _still),
+    0xDB: ("SET STOP-TIME",                   AUDIO_TYPE,     _set_stop_time),
+    0xDC: ("EJECT",                           STATUS_TYPE,    _eject),
+    0xDD: ("READ SUBCODE-Q",                  SUBCODE_TYPE,   _read_subcode_q),
+    0xDE: ("READ TOC",                        DIRECTORY_TYPE, _read_toc_vendor),
+}
+
+# Annotation class for the bytes of a command, indexed by opcode
+COMMAND_ANNOTATION = tuple(COMMANDS[opcode][1] if opcode in COMMANDS else UNKNOWN_TYPE
+                           for opcode in range(256))
+
+# Labels of recently seen CDBs, keyed on the raw bytes, most recent last.
+# Games repeat the same few commands thousands of times, so most labels
+# are found here rather than formatted again.
+LABEL_CACHE_SIZE = 256
+_label_cache = OrderedDict()
+
+
+def command_annotation(byte0):
+    return COMMAND_ANNOTATION[byte0]
+
+
+def command_text(cdb):
+    # The fields of a CDB as text, as in its label (without the opcode and bytes)
+    opcode = cdb[0]
+    length = cdb_length(opcode)
+    if opcode not in COMMANDS:
+        return "Unknown command"
+    elif len(cdb) < length:
+        return f"{COMMANDS[opcode][0]} (INCOMPLETE, {len(cdb)} OF {length} BYTES)"
+    return COMMANDS[opcode][2](cdb)
+
+
+def format_command_label(cdb):
+    opcode = cdb[0]
+    dump = ' '.join(['0x%2.2X' % byte for byte in cdb[:cdb_length(opcode)]])
+    # TEST UNIT READY and unknown commands keep the narrower gaps before the
+    # bytes which their labels have always had
+    gap = '   ' if opcode == 0x00 else '    ' if opcode in COMMANDS else '  '
+    return [ f"[{opcode:02X}]: {command_text(cdb)}{gap}[ {dump} ]" ]
+
+
+def command_label(ctype):
+    # The returned list is shared between all annotations of the same CDB
+    key = bytes(ctype)
+    cmd_label = _label_cache.get(key)
+    if cmd_label is None:
+        cmd_label = format_command_label(key)
+        _label_cache[key] = cmd_label
+        if len(_label_cache) > LABEL_CACHE_SIZE:
+            _label_cache.popitem(last=False)
+    else:
+        _label_cache.move_to_end(key)
+    return cmd_label
+
+
+#
+# Disc addresses of commands
+#
+
+def msf_to_lba(m, s, f):
+    # Minutes/seconds/frames (binary) to LBA; MSF 00:02:00 is LBA 0
+    return (m * 60 + s) * 75 + f - 150
+
+
+def _bcd(value):
+    return (value >> 4) * 10 + (value & 0x0F)
+
+
+def _address_lba(c, addr_type, bcd=False):
+    # LBA of a 4-byte address in bytes 2-5 (see _address); None for a track number
+    if addr_type == 0x00:
+        return (c[2] << 24) + (c[3] << 16) + (c[4] << 8) + c[5]
+    elif addr_type == 0x40:
+        if bcd:
+            return msf_to_lba(_bcd(c[2]), _bcd(c[3]), _bcd(c[4]))
+        return msf_to_lba(c[2], c[3], c[4])
+    return None
+
+
+def command_address(cdb):
+    '''
+    Disc area a command refers to, as (lba, blocks), or None if it has no
+    address (or only a track number).  'blocks' is the transfer length; it
+    is 0 for commands which only position the head (SEEK, READ HEADER,
+    AUDIO TRACK SEARCH, PLAY, ...).
+    '''
+    if not cdb or len(cdb) < cdb_length(cdb[0]):
+        return None
+    c = cdb
+    opcode = c[0]
+    if opcode == 0x08:
+        return (((c[1] & 0x1F) << 16) + (c[2] << 8) + c[3], c[4] or 256)
+    elif opcode == 0x0B:
+        return (((c[1] & 0x1F) << 16) + (c[2] << 8) + c[3], 0)
+    elif opcode in (0x28, 0x2F):
+        lba = _address_lba(c, c[9] & 0xC0)
+        blocks = (c[7] << 8) + c[8]
+    elif opcode in (0xA8, 0xAF):
+        lba = _address_lba(c, c[11] & 0xC0)
+        blocks = (c[6] << 24) + (c[7] << 16) + (c[8] << 8) + c[9]
+    elif opcode in (0x2B, 0x44):
+        lba = _address_lba(c, c[9] & 0xC0 if opcode == 0x2B else 0x00)
+        blocks = 0
+    elif opcode == 0x47:
+        lba = msf_to_lba(c[3], c[4], c[5])
+        blocks = max(msf_to_lba(c[6], c[7], c[8]) - lba, 0)
+    elif opcode in (0xD2, 0xD8, 0xD9):
+        lba = _address_lba(c, c[9] & 0xC0, bcd=True)
+        blocks = 0
+    else:
+        return None
+    return None if lba is None else (lba, blocks)
+
+
+#
+# Data In/Out annotations grouped by sector or by a number of bytes
+#
+
+DEFAULT_BLOCK_LENGTH = 2048
+GROUP_PREVIEW_BYTES = 8
+
+# Vendor-unique MODE SELECT (PF = 0): bytes per block by EJ, for XA = 0 / XA = 1 and SH = 0
+_VENDOR_BLOCK_LENGTH = ((2048, 2048, 2336, 2340), (2056, 2056, 2336, 2340))
+
+
+def mode_select_block_length(cdb, params):
+    # Logical block length set by a MODE SELECT parameter list, or None
+    if len(params) >= 12 and params[3] == 8:               # SCSI-2 block descriptor
+        return (params[9] << 16) + (params[10] << 8) + params[11]
+    if len(cdb) > 1 and not (cdb[1] & 0x10) and len(params) >= 5:     # vendor-unique parameter list
+        xa_without_sh = (params[4] & 0xC0) == 0x80
+        return _VENDOR_BLOCK_LENGTH[xa_without_sh][params[4] & 0x03]
+    return None
+
+
+def data_group_texts(first, count, preview):
+    # Texts for 'count' data bytes starting at byte number 'first', with the
+    # first few values in 'preview': (data row texts, byte number row texts)
+    dump = ' '.join(['%2.2X' % value for value in preview])
+    if count > len(preview):
+        dump += ' ...'
+    return ([ f"{dump}  ({count} bytes)", dump, f"{count} bytes" ],
+            [ f"{first}-{first + count - 1}", f"{first}" ])
+
+
+#
+# Transactions (OUTPUT_PYTHON)
+#
+
+# Data In/Out buffer size when the CDB does not give the transfer length
+DEFAULT_PAYLOAD_CAPACITY = 256
+MAX_PAYLOAD_CAPACITY = 1 << 20         # preallocate no more than this; the buffer grows if needed
+
+
+def expected_data_length(cdb, block_length):
+    # Number of Data In/Out bytes the CDB asks for, or None if unknown
+    if not cdb or len(cdb) < cdb_length(cdb[0]):
+        return None
+    opcode = cdb[0]
+    if opcode == 0x08:
+        return (cdb[4] or 256) * block_length
+    elif opcode == 0x28:
+        return ((cdb[7] << 8) + cdb[8]) * block_length
+    elif opcode == 0xA8:
+        return ((cdb[6] << 24) + (cdb[7] << 16) + (cdb[8] << 8) + cdb[9]) * block_length
+    elif opcode in (0x03, 0x12, 0x15, 0x1A):
+        return cdb[4]
+    elif opcode in (0x42, 0x43, 0x44):
+        return (cdb[7] << 8) + cdb[8]
+    elif opcode == 0x25:
+        return 8
+    elif opcode == 0xDD:
+        return cdb[1] & 0x1F
+    elif opcode == 0xDE:
+        return 4
+    return None
+
+
+class PayloadBuffer:
+    '''
+    Data In or Data Out bytes of one transaction, stored straight into a
+    bytearray allocated for the expected transfer length (doubled if more
+    bytes arrive), so that no Python object is kept per byte.
+    '''
+
+    __slots__ = ('buffer', 'length')
+
+    def __init__(self, capacity):
+        self.buffer = bytearray(max(capacity, 1))
+        self.length = 0
+
+    def append(self, value):
+        if self.length == len(self.buffer):
+            self.buffer.extend(bytes(len(self.buffer)))
+        self.buffer[self.length] = value
+        self.length += 1
+
+    def view(self):
+        # Read-only view of the bytes received; the buffer must not grow after this
+        return memoryview(self.buffer).toreadonly()[:self.length]
+
+
+class Transaction:
+    '''
+    One completed SCSI transaction, from the start of arbitration until BUS
+    FREE, as put() on OUTPUT_PYTHON:  ['TRANSACTION', Transaction].
+
+    ids        - SCSI IDs asserted on the data bus at selection (bit n = ID n)
+    luns       - the same, as text ('LUN 7,0')
+    cdb        - command bytes
+    data_in    - Data In bytes (memoryview), or None
+    data_out   - Data Out bytes (memoryview), or None
+    status     - status byte, or None
+    msg_in     - Message In bytes
+    msg_out    - Message Out bytes
+    phases     - (subphase, startsample, endsample) of each subphase in which
+                 bytes were transferred, in order (see subphase_label)
+    block_length - bytes per block when the command was sent (see MODE SELECT)
+    '''
+
+    __slots__ = ('startsample', 'endsample', 'ids', 'luns', 'cdb', 'data_in', 'data_out',
+                 'status', 'msg_in', 'msg_out', 'phases', 'block_length')
+
+    def __init__(self, startsample, endsample, ids, luns, cdb, data_in, data_out,
+                 status, msg_in, msg_out, phases, block_length=DEFAULT_BLOCK_LENGTH):
+        self.startsample = startsample
+        self.endsample = endsample
+        self.ids = ids
+        self.luns = luns
+        self.cdb = cdb
+        self.data_in = data_in
+        self.data_out = data_out
+        self.status = status
+        self.msg_in = msg_in
+        self.msg_out = msg_out
+        self.phases = phases
+        self.block_length = block_length
+
+    def __getstate__(self):
+        # memoryviews cannot be pickled
+        return tuple(bytes(value) if isinstance(value, memoryview) else value
+                     for value in (getattr(self, name) for name in self.__slots__))
+
+    def __setstate__(self, state):
+        for (name, value) in zip(self.__slots__, state):
+            if name in ('data_in', 'data_out') and value is not None:
+                value = memoryview(value)
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return '<Transaction %d-%d %s>' % (self.startsample, self.endsample, self.cdb.hex())
+
+
+class TransactionBuilder:
+    '''
+    Collects the bytes of the current transaction by subphase.  It also keeps
+    the block length set by the last MODE SELECT, which outlives transactions.
+    '''
+
+    def __init__(self):
+        self.block_length = DEFAULT_BLOCK_LENGTH
+        self.start(0, 0, '')
+
+    def start(self, startsample, ids, luns):
+        self.startsample = startsample
+        self.ids = ids
+        self.luns = luns
+        self.cdb = bytearray()
+        self.data_in = None
+        self.data_out = None
+        self.status = None
+        self.msg_in = bytearray()
+        self.msg_out = bytearray()
+        self.phases = []
+        self.capacity = DEFAULT_PAYLOAD_CAPACITY
+        self.command_block_length = self.block_length
+
+    def byte(self, subphase, value):
+        if subphase == 6:
+            if self.data_in is None:
+                self.data_in = PayloadBuffer(self.capacity)
+            self.data_in.append(value)
+        elif subphase == 7:
+            if self.data_out is None:
+                self.data_out = PayloadBuffer(self.capacity)
+            self.data_out.append(value)
+        elif subphase == 5:
+            self.cdb.append(value)
+        elif subphase == 4:
+            self.status = value
+        elif subphase == 0:
+            self.msg_in.append(value)
+        elif subphase == 1:
+            self.msg_out.append(value)
+
+    def phase(self, subphase, startsample, endsample):
+        # End of a subphase in which bytes were transferred
+        self.phases.append((subphase, startsample, endsample))
+        if subphase == 5:
+            length = expected_data_length(self.cdb, self.block_length)
+            self.capacity = min(length, MAX_PAYLOAD_CAPACITY) if length else DEFAULT_PAYLOAD_CAPACITY
+        elif subphase == 7 and self.cdb and self.cdb[0] == 0x15:     # MODE SELECT may change the sector size
+            params = self.data_out.buffer[:self.data_out.length]
+            self.block_length = mode_select_block_length(self.cdb, params) or self.block_length
+
+    def finish(self, endsample):
+        return Transaction(self.startsample, endsample, self.ids, self.luns, bytes(self.cdb),
+                           self.data_in.view() if self.data_in is not None else None,
+                           self.data_out.view() if self.data_out is not None else None,
+                           self.status, bytes(self.msg_in), bytes(self.msg_out), self.phases,
+                           self.command_block_length)
+
+
+#
+# Transaction store
+#
+# A long capture holds hundreds of thousands of transactions.  As Python
+# objects, each costs about 800 bytes besides its data (the record, its bytes,
+# memoryviews, buffer and phase tuples), and its Data In buffer keeps the
+# capacity it was preallocated with.  TransactionStore keeps the same
+# records in columns of machine numbers (the 'array' module), with all the
+# bytes of a transaction packed together into large shared chunks.
+#
+# The chunks are allocated at their full size and never resized, so the
+# memoryviews handed out stay valid while more transactions are added.
+#
+
+PAYLOAD_CHUNK_SIZE = 1 << 20           # bytes per shared payload chunk (larger payloads get their own)
+
+
+class TransactionStore:
+    '''
+    Transactions in columns.  store[i] (and iterating) gives a Transaction
+    whose Data In/Out are read-only memoryviews into the shared chunks.
+    The per-command columns can also be read directly:
+
+    startsample, endsample - sample numbers
+    opcode       - first CDB byte, or -1 without a CDB
+    lba, blocks  - see command_address(); blocks is -1 without an address
+    status       - status byte, or -1
+    block_length - bytes per block when the command was sent
+    '''
+
+    def __init__(self):
+        self.startsample = array('q')
+        self.endsample = array('q')
+        self.ids = array('B')
+        self.luns = array('H')                 # index into lun_texts
+        self.opcode = array('h')
+        self.lba = array('q')
+        self.blocks = array('q')
+        self.status = array('h')
+        self.block_length = array('I')
+        # Bytes of each transaction, in this order: cdb, msg_in, msg_out, data_in, data_out
+        self.chunk = array('I')
+        self.offset = array('I')
+        self.cdb_length = array('I')
+        self.msg_in_length = array('I')
+        self.msg_out_length = array('I')
+        self.data_in_length = array('q')       # -1 for None
+        self.data_out_length = array('q')
+        # Phases of all transactions, one after another; phase_first[i] is the first of transaction i
+        self.phase_first = array('Q', [0])
+        self.phase_subphase = array('B')
+        self.phase_start = array('q')
+        self.phase_end = array('q')
+        self.lun_texts = []
+        self._lun_index = {}
+        self._chunks = []
+        self._views = []
+        self._fill = 0
+
+    def __len__(self):
+        return len(self.startsample)
+
+    def __iter__(self):
+        for index in range(len(self.startsample)):
+            yield self[index]
+
+    def _reserve(self, size):
+        # (chunk, offset) of 'size' free bytes
+        if not self._chunks or self._fill + size > len(self._chunks[-1]):
+            chunk = bytearray(max(size, PAYLOAD_CHUNK_SIZE))
+            self._chunks.append(chunk)
+            self._views.append(memoryview(chunk).toreadonly())
+            self._fill = 0
+        offset = self._fill
+        self._fill += size
+        return (len(self._chunks) - 1, offset)
+
+    def append(self, t):
+        '''Add a copy of the Transaction 't'.'''
+        self.startsample.append(t.startsample)
+        self.endsample.append(t.endsample)
+        self.ids.append(t.ids)
+        lun = self._lun_index.get(t.luns)
+        if lun is None:
+            lun = self._lun_index[t.luns] = len(self.lun_texts)
+            self.lun_texts.append(t.luns)
+        self.luns.append(lun)
+        self.opcode.append(t.cdb[0] if t.cdb else -1)
+        address = command_address(t.cdb)
+        self.lba.append(address[0] if address else 0)
+        self.blocks.append(address[1] if address else -1)
+        self.status.append(-1 if t.status is None else t.status)
+        self.block_length.append(t.block_length)
+
+        parts = [part for part in (t.cdb, t.msg_in, t.msg_out, t.data_in, t.data_out) if part]
+        (chunk, offset) = self._reserve(sum(len(part) for part in parts))
+        self.chunk.append(chunk)
+        self.offset.append(offset)
+        buffer = self._chunks[chunk]
+        for part in parts:
+            buffer[offset:offset + len(part)] = part
+            offset += len(part)
+        self.cdb_length.append(len(t.cdb))
+        self.msg_in_length.append(len(t.msg_in))
+        self.msg_out_length.append(len(t.msg_out))
+        self.data_in_length.append(-1 if t.data_in is None else len(t.data_in))
+        self.data_out_length.append(-1 if t.data_out is None else len(t.data_out))
+
+        for (subphase, startsample, endsample) in t.phases:
+            self.phase_subphase.append(subphase)
+            self.phase_start.append(startsample)
+            self.phase_end.append(endsample)
+        self.phase_first.append(len(self.phase_subphase))
+
+    def extend(self, transactions):
+        for t in transactions:
+            self.append(t)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.startsample)
+        view = self._views[self.chunk[index]]
+        start = self.offset[index]
+        lengths = (self.cdb_length[index], self.msg_in_length[index], self.msg_out_length[index],
+                   self.data_in_length[index], self.data_out_length[index])
+        parts = []
+        for length in lengths:
+            if length < 0:
+                parts.append(None)
+            else:
+                parts.append(view[start:start + length])
+                start += length
+        (cdb, msg_in, msg_out, data_in, data_out) = parts
+        (first, end) = (self.phase_first[index], self.phase_first[index + 1])
+        status = self.status[index]
+        return Transaction(self.startsample[index], self.endsample[index], self.ids[index],
+                           self.lun_texts[self.luns[index]], bytes(cdb), data_in, data_out,
+                           None if status < 0 else status, bytes(msg_in), bytes(msg_out),
+                           list(zip(self.phase_subphase[first:end], self.phase_start[first:end],
+                                    self.phase_end[first:end])),
+                           self.block_length[index])
+
+    def address(self, index):
+        # (lba, blocks) of transaction 'index', as command_address(), or None
+        blocks = self.blocks[index]
+        return None if blocks < 0 else (self.lba[index], blocks)
+
+    def nbytes(self):
+        '''Memory held by the columns and the payload chunks.'''
+        columns = sum(len(column) * column.itemsize for column in self.__dict__.values()
+                      if isinstance(column, array))
+        return columns + sum(len(chunk) for chunk in self._chunks)
+
+    def __getstate__(self):
+        # Without the views (which cannot be pickled), and with the unused end of the last chunk cut off
+        state = dict(self.__dict__)
+        del state['_views']
+        if self._chunks:
+            state['_chunks'] = self._chunks[:-1] + [self._chunks[-1][:self._fill]]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views = [memoryview(chunk).toreadonly() for chunk in self._chunks]
+        if self._chunks:
+            self._fill = len(self._chunks[-1])
+
+
+#
+# Timing metrics (OUTPUT_META)
+#
+# Measured on Transaction records, so the decoder and the offline tools
+# agree.  'Selection' is the end of the Selection phase, i.e. the start of
+# Information Transfer.  There is no REQ line on the capture, so the
+# REQ/ACK cycle is the Data phase time divided by its bytes.
+#
+
+# (name, short label, description); all values are floats
+METRICS = (
+    ('latency',   'Latency',   'Selection to the first Data phase (or Status if none), in seconds'),
+    ('data_time', 'Data time', 'Duration of the Data In/Out phases, in seconds'),
+    ('data_rate', 'Data rate', 'Data In/Out bytes per second during the Data phases'),
+    ('ack_cycle', 'ACK cycle', 'Average REQ/ACK cycle of the Data phases, in seconds'),
+    ('host_gap',  'Host gap',  'End of the Status phase to the next arbitration, in seconds'),
+)
+
+
+def transaction_metrics(t, samplerate):
+    '''
+    Timing of a Transaction, as a dict by METRICS name (except 'host_gap',
+    see host_gap()).  A value is None if the transaction has no such phase.
+    '''
+    data_time = 0
+    first_data = None
+    status_start = None
+    for (subphase, ss, es) in t.phases:
+        if (subphase & 0b110) == 0b110:              # Data In / Data Out
+            data_time += es - ss
+            if first_data is None:
+                first_data = ss
+        elif subphase == 4 and status_start is None:
+            status_start = ss
+    data_bytes = (len(t.data_in) if t.data_in is not None else 0) + \
+                 (len(t.data_out) if t.data_out is not None else 0)
+    response = first_data if first_data is not None else status_start
+    latency = None
+    if t.phases and response is not None:
+        latency = (response - t.phases[0][1]) / samplerate
+    if not data_bytes or not data_time:
+        return {'latency': latency, 'data_time': None, 'data_rate': None, 'ack_cycle': None}
+    return {
+        'latency': latency,
+        'data_time': data_time / samplerate,
+        'data_rate': data_bytes * samplerate / data_time,
+        'ack_cycle': data_time / data_bytes / samplerate,
+    }
+
+
+def status_end(t):
+    # End of the (last) Status phase, or of the transaction
+    for (subphase, ss, es) in reversed(t.phases):
+        if subphase == 4:
+            return es
+    return t.endsample
+
+
+def host_gap(t, nextsample, samplerate):
+    # Time the initiator took to start arbitration again ('nextsample') after 't'
+    return (nextsample - status_end(t)) / samplerate
+
+
+#
+# Repeated transactions
+#
+# A closed drive without a disc makes the BIOS retry TEST UNIT READY and
+# REQUEST SENSE about 75 times, and games poll READ SUBCODE-Q all through CD
+# audio.  A run of identical transactions (or of an identical cycle of up to
+# MAX_REPEAT_PERIOD of them) is shown once in full, and the repeats after it
+# are replaced by one annotation over the whole run ('repeats' option).
+#
+
+MAX_REPEAT_PERIOD = 4                # longest cycle of transactions recognised as repeating
+
+
+def _payload_key(data):
+    # CRC-32 of Data In/Out bytes (read straight from the memoryview)
+    return None if data is None else (len(data), zlib.crc32(data))
+
+
+def transaction_key(t):
+    # Hash of everything but the timing; equal keys are confirmed with same_transaction()
+    return hash((t.ids, t.cdb, t.status, _payload_key(t.data_in), _payload_key(t.data_out), t.msg_in, t.msg_out,
+                 tuple([subphase for (subphase, ss, es) in t.phases])))
+
+
+def same_transaction(a, b):
+    return (a.ids == b.ids and a.cdb == b.cdb and a.status == b.status and a.data_in == b.data_in
+            and a.data_out == b.data_out and a.msg_in == b.msg_in and a.msg_out == b.msg_out
+            and [p[0] for p in a.phases] == [p[0] for p in b.phases])
+
+
+def repeat_texts(count, transactions):
+    # '×75 TEST UNIT READY/REQUEST SENSE' for 'count' cycles of 'transactions'
+    names = []
+    for t in transactions:
+        if not t.cdb:
+            names.append('NO COMMAND')
+        else:
+            names.append(COMMANDS[t.cdb[0]][0] if t.cdb[0] in COMMANDS else 'UNKNOWN COMMAND')
+    return ['×%d %s' % (count, '/'.join(names)), '×%d' % count]
+
+
+class RepeatCollapser:
+    '''
+    Holds back the annotations of each transaction until it is known not to
+    repeat the ones before it.  add() takes a completed Transaction with the
+    annotations put since the Bus Free annotation before it (inclusive),
+    and returns the annotations to put now; finish() returns the rest at the
+    end of the input.  'summary(ss, es, count, transactions)' makes the
+    annotation for a run of 'count' cycles of 'transactions'.
+    '''
+
+    def __init__(self, summary, max_period=MAX_REPEAT_PERIOD):
+        self.summary = summary
+        self.max_period = max_period
+        self.recent = []             # (key, transaction, annotations) since the last run, the last 'held' not yet put
+        self.held = 0
+        self.pattern = None          # the cycle being repeated, or None outside a run
+        self.partial = []            # the next repeat of the cycle, while it is incomplete
+        self.count = 0
+        self.run_start = 0
+        self.run_end = 0
+
+    def add(self, transaction, annotations):
+        unit = (transaction_key(transaction), transaction, annotations)
+        if self.pattern is None:
+            return self._add_single(unit)
+        expected = self.pattern[len(self.partial)]
+        if unit[0] == expected[0] and same_transaction(unit[1], expected[1]):
+            self.partial.append(unit)
+            if len(self.partial) == len(self.pattern):
+                self.count += 1
+                self.run_end = transaction.endsample
+                self.partial = []
+            return []
+        # the run ends: units of an incomplete cycle are shown after all
+        out = self._end_run()
+        for unit in self.partial + [unit]:
+            out.extend(self._add_single(unit))
+        self.partial = []
+        return out
+
+    def finish(self):
+        out = []
+        if self.pattern is not None:
+            out = self._end_run()
+            self.recent = self.partial
+            self.held = len(self.partial)
+            self.partial = []
+        for unit in self.recent[len(self.recent) - self.held:]:
+            out.extend(unit[2])
+        self.recent = []
+        self.held = 0
+        return out
+
+    def _end_run(self):
+        out = [self.summary(self.run_start, self.run_end, self.count, [unit[1] for unit in self.pattern])]
+        self.pattern = None
+        return out
+
+    def _add_single(self, unit):
+        recent = self.recent
+        recent.append(unit)
+        self.held += 1
+        for period in range(1, min(self.max_period, len(recent) // 2) + 1):
+            first = recent[-2 * period:-period]
+            second = recent[-period:]
+            if all(a[0] == b[0] and same_transaction(a[1], b[1]) for (a, b) in zip(first, second)):
+                # 'second' repeats 'first': put what came before it, and start a run
+                out = []
+                for unit in recent[len(recent) - self.held:-period]:
+                    out.extend(unit[2])
+                self.pattern = first
+                self.count = 2
+                self.run_start = first[0][1].startsample
+                self.run_end = second[-1][1].endsample
+                self.recent = []
+                self.held = 0
+                return out
+        out = []
+        if self.held > self.max_period:
+            out = recent[-self.held][2]
+            self.held -= 1
+        if len(recent) > 2 * self.max_period:
+            del recent[0]
+        return out
+
+
+#
+# Disc access pattern
+#
+# The addresses of successive commands (see command_address) show how the
+# disc is read: sequential runs, seeks, and blocks read more than once (the
+# host's cache missed).  The track start addresses from READ TOC (0x43 and
+# the vendor-unique 0xDE) place each access in a track.
+#
+
+READ_OPCODES = (0x08, 0x28, 0xA8)    # commands whose blocks are transferred as Data In
+LEAD_OUT = 0xAA                      # track number of the lead-out in READ TOC data
+
+
+def toc_entries(t):
+    '''
+    (track, lba) of each track start (LEAD_OUT for the lead-out) in the
+    Data In of a READ TOC transaction; an empty list for other commands.
+    '''
+    c = t.cdb
+    data = t.data_in
+    if not c or len(c) < cdb_length(c[0]) or data is None or t.status != 0:
+        return []
+    entries = []
+    if c[0] == 0x43:
+        for offset in range(4, len(data) - 7, 8):
+            if c[1] & 0x02:                          # MSF (binary)
+                lba = msf_to_lba(data[offset + 5], data[offset + 6], data[offset + 7])
+            else:
+                lba = (data[offset + 4] << 24) + (data[offset + 5] << 16) + (data[offset + 6] << 8) + data[offset + 7]
+            if 1 <= data[offset + 2] <= 99 or data[offset + 2] == LEAD_OUT:
+                entries.append((data[offset + 2], lba))
+    elif c[0] == 0xDE and len(data) >= 3:            # BCD MSF
+        lba = msf_to_lba(_bcd(data[0]), _bcd(data[1]), _bcd(data[2]))
+        if (c[1] & 3) == 1:
+            entries.append((LEAD_OUT, lba))
+        elif (c[1] & 3) == 2:
+            entries.append((_bcd(c[2]), lba))
+    return entries
+
+
+class Access:
+    '''
+    Where one command went on the disc (see AccessPattern.add):
+
+    kind       - 'first', 'sequential' (starts where the last one ended),
+                 'seek' or 're-read' (a read of blocks already read)
+    seek       - LBA distance from the end of the last access, or None
+    rereads    - blocks of this read which had been read before
+    run        - number of the sequential run it belongs to
+    track      - track it starts in, or None before a READ TOC
+    '''
+
+    __slots__ = ('startsample', 'endsample', 'opcode', 'lba', 'blocks', 'kind', 'seek',
+                 'rereads', 'run', 'track')
+
+    def __init__(self, startsample, endsample, opcode, lba, blocks, kind, seek, rereads, run, track):
+        self.startsample = startsample
+        self.endsample = endsample
+        self.opcode = opcode
+        self.lba = lba
+        self.blocks = blocks
+        self.kind = kind
+        self.seek = seek
+        self.rereads = rereads
+        self.run = run
+        self.track = track
+
+
+class AccessPattern:
+    '''
+    Follows the head position from command to command.  add() takes each
+    completed Transaction and returns an Access for commands with a disc
+    address, or None.  'reads' counts how often each LBA was read.
+    '''
+
+    def __init__(self):
+        self.head = None             # LBA following the last access
+        self.run = 0
+        self.reads = {}              # lba -> times read
+        self.toc = {}                # track -> start lba
+
+    def add(self, t):
+        for (track, lba) in toc_entries(t):
+            self.toc[track] = lba
+        address = command_address(t.cdb)
+        if address is None:
+            return None
+        (lba, blocks) = address
+        opcode = t.cdb[0]
+        read = opcode in READ_OPCODES
+        if read:
+            # blocks actually transferred, a cut-off one included (as in
+            # read_sectors); a failed read moves nothing
+            layout = read_blocks(t) if t.status == 0 else None
+            blocks = min(blocks, -(-len(t.data_in) // layout[2])) if layout else 0
+        rereads = 0
+        if read:
+            for block in range(lba, lba + blocks):
+                count = self.reads.get(block, 0)
+                rereads += count > 0
+                self.reads[block] = count + 1
+        seek = None if self.head is None else lba - self.head
+        if rereads:
+            kind = 're-read'
+        elif seek is None:
+            kind = 'first'
+        elif seek == 0:
+            kind = 'sequential'
+        else:
+            kind = 'seek'
+        if kind != 'sequential':
+            self.run += 1
+        self.head = lba + blocks if read else lba
+        return Access(t.startsample, t.endsample, opcode, lba, blocks, kind, seek, rereads, self.run,
+                      self.track_of(lba))
+
+    def track_of(self, lba):
+        track = None
+        start = None
+        for (number, first) in self.toc.items():
+            if number != LEAD_OUT and first <= lba and (start is None or first > start):
+                (track, start) = (number, first)
+        return track
+
+
+def access_texts(access):
+    # Annotation texts for an Access, longest first
+    where = 'LBA 0x%06X' % access.lba
+    if access.track is not None:
+        where += ' (TRACK %d)' % access.track
+    if access.kind == 'first':
+        return ['%s, %d BLOCKS' % (where, access.blocks), 'FIRST']
+    if access.kind == 'sequential':
+        return ['SEQUENTIAL %s, %d BLOCKS' % (where, access.blocks), 'SEQ']
+    if access.kind == 're-read':
+        return ['RE-READ %d OF %d BLOCKS AT %s, SEEK %+d' % (access.rereads, access.blocks, where, access.seek or 0),
+                'RE-READ %d' % access.rereads, 'RR']
+    return ['SEEK %+d TO %s, %d BLOCKS' % (access.seek, where, access.blocks), 'SEEK %+d' % access.seek, 'SK']
+
+
+#
+# Sectors read (OUTPUT_BINARY)
+#
+# The Data In of a READ command is cut into its blocks, each tagged with its
+# LBA.  The block length is taken from the data itself (bytes / blocks), as
+# it depends on the MODE SELECT in force (2048, 2336 or 2340 bytes).
+#
+
+SECTOR_HEADER = struct.Struct('<II')  # lba, length; before each sector on the 'sectors' binary class
+
+
+def read_blocks(t):
+    '''
+    (lba, blocks, block length) of a READ transaction's Data In, or None
+    for other transactions.
+    '''
+    if t.data_in is None or not t.cdb or t.cdb[0] not in READ_OPCODES:
+        return None
+    address = command_address(t.cdb)
+    if address is None or not address[1]:
+        return None
+    (lba, blocks) = address
+    length = t.block_length
+    if len(t.data_in) > blocks * length:
+        length = -(-len(t.data_in) // blocks)        # the block length was changed some other way
+    return (lba, blocks, length)
+
+
+def read_sectors(t):
+    '''
+    (lba, sector) of each block of a READ transaction's Data In, where
+    'sector' is a memoryview slice (no copy); the last one is short if the
+    transfer was cut off.  Yields nothing for other transactions.
+    '''
+    layout = read_blocks(t)
+    if layout is None:
+        return
+    (lba, blocks, length) = layout
+    data = t.data_in
+    for (index, offset) in enumerate(range(0, len(data), length)):
+        yield (lba + index, data[offset:offset + length])
+
+
+def data_in_span(t):
+    # First and last sample of the Data In phases of a Transaction
+    spans = [(ss, es) for (subphase, ss, es) in t.phases if subphase == 6]
+    if not spans:
+        return (t.startsample, t.endsample)
+    return (spans[0][0], spans[-1][1])
+
+
+#
+# Timing checks
+#
+# The edges the decoder waits for already carry their sample numbers, so
+# the SCSI timing limits are checked on the time between them: no sample
+# is looked at twice.  There is no REQ line on the capture, so the REQ/ACK
+# handshake is checked on ACK alone, and the data lines are not waited on,
+# so data setup and hold cannot be checked.  Pulses narrower than the
+# deglitch width never reach the checks.
+#
+
+# (name, label, short label, default limit in ns, 'min' or 'max', what is measured)
+TIMING_RULES = (
+    ('bus_free',     'Bus free',          'Free',   800,       'min', 'BSY released to SEL asserted'),
+    ('selection',    'Selection timeout', 'Sel',    250000000, 'max', 'SEL asserted to BSY asserted'),
+    ('deskew',       'Deskew',            'Deskew', 90,        'min', 'BSY asserted to SEL released (2 deskew delays)'),
+    ('bus_settle',   'Bus settle',        'Settle', 400,       'min', 'CD/IO/MSG changed to the next ACK asserted'),
+    ('ack_width',    'ACK width',         'ACK',    30,        'min', 'ACK asserted to ACK released'),
+    ('ack_negation', 'ACK negation',      'Neg',    30,        'min', 'ACK released to ACK asserted again'),
+)
+TIMING_DEFAULTS = {rule[0]: rule[3] for rule in TIMING_RULES}
+
+
+def duration_text(seconds):
+    # '240 ns', '1.5 us', '312 ms'
+    for (scale, unit) in ((1e-9, 'ns'), (1e-6, 'us'), (1e-3, 'ms')):
+        if seconds < scale * 1000:
+            return '%.3g %s' % (seconds / scale, unit)
+    return '%.3g s' % seconds
+
+
+class TimingChecker:
+    '''
+    Checks the time between edges against the limits of TIMING_RULES
+    ('limits' by rule name, in ns; 0 turns a rule off).  Each method takes
+    one edge and returns the violations it ends, as (startsample,
+    endsample, texts) for the 'timing' annotation.
+    '''
+
+    def __init__(self, limits, samplerate):
+        self.samplerate = samplerate
+        self.limits = {}             # name -> limit in ns, of the rules checked
+        self.samples = {}            # name -> limit in samples (0 or infinity if not checked)
+        for (name, label, short, default, kind, desc) in TIMING_RULES:
+            limit = limits.get(name, default)
+            if limit:
+                self.limits[name] = limit
+            self.samples[name] = limit * samplerate / 1e9 if limit else (0 if kind == 'min' else float('inf'))
+        self.rules = {rule[0]: rule for rule in TIMING_RULES}
+        (self.min_settle, self.min_ack, self.min_negation) = \
+            (self.samples['bus_settle'], self.samples['ack_width'], self.samples['ack_negation'])
+        self.bus_released = None     # BSY released (end of the last transaction)
+        self.sel_asserted = None
+        self.bsy_asserted = None
+        self.phase_changed = None    # CD/IO/MSG changed, no ACK since
+        self.ack_asserted = None
+        self.ack_released = None     # in the current phase
+
+    def _violation(self, name, ss, es):
+        (name, label, short, default, kind, desc) = self.rules[name]
+        measured = duration_text((es - ss) / self.samplerate)
+        return (ss, es, ['%s %s (%s. %s)' % (label, measured, kind, duration_text(self.limits[name] / 1e9)),
+                         '%s %s' % (short, measured), short])
+
+    def _check(self, name, ss, es):
+        limit = self.samples[name]
+        if (es - ss < limit) if self.rules[name][4] == 'min' else (es - ss > limit):
+            return (self._violation(name, ss, es),)
+        return ()
+
+    def selection_start(self, samplenum):
+        # SEL asserted (end of Bus Free)
+        self.sel_asserted = samplenum
+        if self.bus_released is None:
+            return ()
+        return self._check('bus_free', self.bus_released, samplenum)
+
+    def target_busy(self, samplenum):
+        # BSY asserted by the target (end of Arbitration)
+        self.bsy_asserted = samplenum
+        return self._check('selection', self.sel_asserted, samplenum)
+
+    def selection_end(self, samplenum):
+        # SEL released (start of Information Transfer)
+        self.phase_changed = self.ack_asserted = self.ack_released = None
+        return self._check('deskew', self.bsy_asserted, samplenum)
+
+    def info_edge(self, samplenum, lines, ack, bsy):
+        # A deglitched edge during Information Transfer (see Decoder.info_edge),
+        # with the levels of ACK and BSY after it.  Called for every edge, so
+        # the limits are compared inline.
+        violations = ()
+        if lines & 0b111:
+            self.phase_changed = samplenum
+            self.ack_released = None
+        if lines & 0b1000:
+            if not ack:
+                if self.phase_changed is not None:
+                    if samplenum - self.phase_changed < self.min_settle:
+                        violations += (self._violation('bus_settle', self.phase_changed, samplenum),)
+                    self.phase_changed = None
+                if self.ack_released is not None and samplenum - self.ack_released < self.min_negation:
+                    violations += (self._violation('ack_negation', self.ack_released, samplenum),)
+                self.ack_asserted = samplenum
+            elif self.ack_asserted is not None:
+                if samplenum - self.ack_asserted < self.min_ack:
+                    violations += (self._violation('ack_width', self.ack_asserted, samplenum),)
+                self.ack_asserted = None
+                self.ack_released = samplenum
+        if (lines & 0b10000) and bsy:
+            self.bus_released = samplenum
+        return violations
+
+
+def deglitch_samples(width, unit, samplerate):
+    # Minimum pulse width option, converted to a whole number of samples (at least 1)
+    if unit == 'ns':
+        samples = -(-int(width) * samplerate // 1000000000)
+    else:
+        samples = int(width)
+    return max(samples, 1)
+
+
+class Deglitcher:
+    '''
+    Glitch filter for the lines watched during Information Transfer.
+
+    Lines are numbered by their match bit in the INFO XFER wait():
+    0 = CD, 1 = IO, 2 = MSG, 3 = ACK, 4 = BSY.
+
+    An edge is held as pending until its line has been stable for 'width'
+    samples.  Since that is only known once a later wait() returns, a valid
+    edge costs one wait(); if the same line toggles back sooner, the pulse
+    was a glitch and both edges are dropped.  Nothing is held when width
+    is 1.
+    '''
+
+    def __init__(self, width):
+        self.width = width
+        self.pending = {}            # line -> (samplenum, pins) of unconfirmed edge
+        self.glitches = 0            # pulses rejected
+
+    def reset(self):
+        self.pending.clear()
+
+    def hold(self, line, samplenum, pins):
+        self.pending[line] = (samplenum, pins)
+
+    def deadline(self, line):
+        # Sample at which a pending edge on 'line' becomes valid, or None
+        if line in self.pending:
+            return self.pending[line][0] + self.width
+        return None
+
+    def edges(self, samplenum, toggled, pins):
+        '''
+        Feed the lines which toggled at 'samplenum' (bitmask) with the pin
+        values there; returns the edges confirmed so far, oldest first, as
+        (samplenum, lines, pins) with one entry per edge sample.
+        '''
+        confirmed = []
+        for line in list(self.pending):
+            (edgesample, edgepins) = self.pending[line]
+            if samplenum - edgesample >= self.width:
+                confirmed.append((edgesample, line, edgepins))
+                del self.pending[line]
+            elif toggled & (1 << line):                    # toggled back too soon: glitch
+                del self.pending[line]
+                self.glitches += 1
+                toggled &= ~(1 << line)
+
+        if self.width <= 1:
+            if toggled:
+                confirmed.append((samplenum, -1, pins))
+        else:
+            for line in range(5):
+                if toggled & (1 << line):
+                    self.pending[line] = (samplenum, pins)
+
+        return self._merged(confirmed, toggled)
+
+    def finish(self):
+        '''
+        At the end of the input: the edges still pending, as edges() returns
+        them.  Their lines did not toggle back before the input ended, so
+        they are taken as valid.
+        '''
+        confirmed = [(edgesample, line, edgepins) for (line, (edgesample, edgepins)) in self.pending.items()]
+        self.pending.clear()
+        return self._merged(confirmed, 0)
+
+    def _merged(self, confirmed, toggled):
+        # One (samplenum, lines, pins) per edge sample, oldest first
+        if not confirmed:
+            return confirmed
+        confirmed.sort(key=lambda edge: edge[0])
+        merged = []
+        for (edgesample, line, edgepins) in confirmed:
+            lines = toggled if line < 0 else (1 << line)
+            if merged and merged[-1][0] == edgesample:
+                merged[-1] = (edgesample, merged[-1][1] | lines, edgepins)
+            else:
+                merged.append((edgesample, lines, edgepins))
+        return merged
@@ -0,0 +1,99 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''Helpers shared by the tests: running pd.py and the offline engine on a trace.'''
+
+import random
+
+import common
+import sigrokdecode
+import tracegen
+from pcfx_scsi_offline.engine import Edges, OfflineDecoder, add_access_annotations, SEL
+
+SAMPLERATE = 50000000
+
+
+def mixed_trace(seed, glitches=40, margin=4):
+    '''
+    A short trace of random commands: READ(10) of odd lengths, MODE SELECT
+    changing the block length, TEST UNIT READY / REQUEST SENSE repeated,
+    failed commands, SEL without BSY, and then up to 'glitches' glitches
+    (see tracegen.inject_glitches()).  Returns the packed words.
+    '''
+    rng = random.Random(seed)
+    gen = tracegen.TraceGenerator(seed, {'bus_free': 60, 'seek': 30})
+    for _ in range(rng.randint(8, 24)):
+        choice = rng.random()
+        if choice < 0.15:
+            block_length = rng.choice((2048, 2336, 512, 2340))
+            gen.transaction([0x15, 0x10, 0x00, 0x00, 0x0C, 0x00],
+                            data_out=bytes([0, 0, 0, 8, 0, 0, 0, 0, 0]) + block_length.to_bytes(3, 'big'))
+        elif choice < 0.25:
+            for _ in range(rng.randint(1, 3)):
+                gen.transaction([0x00, 0x00, 0x00, 0x00, 0x00, 0x00], status=0x02)
+                gen.transaction([0x03, 0x00, 0x00, 0x00, 0x12, 0x00], data_in=bytes(18))
+        elif choice < 0.32:
+            gen.bus_free()
+            gen.emit(tracegen.IDLE & ~SEL, 30)
+            gen.emit(tracegen.IDLE, rng.choice((5, 100, 300)))
+        else:
+            blocks = rng.randint(1, 2)
+            data = bytes(rng.randrange(256) for _ in range(rng.randint(100, 3000)))
+            gen.transaction([0x28, 0x00, 0x00, 0x00, 0x00, rng.randint(0, 50), 0x00, 0x00, blocks, 0x00],
+                            data_in=data, status=rng.choice((0x00, 0x00, 0x00, 0x02)))
+    words = gen.words()
+    tracegen.inject_glitches(words, rng.randint(0, glitches), seed, margin=margin)
+    return words
+
+
+def pd_decode(words, **options):
+    '''
+    Run pd.py over a packed trace (one word per sample, see tracegen.py);
+    returns its annotations as (ss, es, class, texts) and its transactions.
+    '''
+    (initial, changes) = sigrokdecode.channel_changes(words)
+    decoder = sigrokdecode.run(common.load_decoder(), initial, changes, len(words), SAMPLERATE, options)
+    annotations = [(ss, es, data[0], data[1]) for (ss, es, output, data) in decoder.output
+                   if output == sigrokdecode.OUTPUT_ANN]
+    transactions = [data[1] for (ss, es, output, data) in decoder.output if output == sigrokdecode.OUTPUT_PYTHON]
+    return (annotations, transactions)
+
+
+def offline_decode(words, deglitch=2, **options):
+    '''The OfflineDecoder after decoding a packed trace.'''
+    decoder = OfflineDecoder(deglitch, **options)
+    decoder.decode(Edges(words))
+    return decoder
+
+
+def offline_annotations(decoder):
+    # As pd.py puts them (with the Access row)
+    return add_access_annotations(decoder.annotations, decoder.transactions)
+
+
+def transaction_key(t):
+    '''Everything a Transaction holds, comparable with =='''
+    return (t.startsample, t.endsample, t.ids, t.luns, bytes(t.cdb),
+            None if t.data_in is None else bytes(t.data_in), None if t.data_out is None else bytes(t.data_out),
+            t.status, bytes(t.msg_in), bytes(t.msg_out), [tuple(phase) for phase in t.phases], t.block_length)
+
+
+def count_class(annotations, ann):
+    return sum(1 for annotation in annotations if annotation[2] == ann)
@@ -0,0 +1,65 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''AccessPattern (scsi.py): which blocks a command read, and where the head went.'''
+
+import common
+from pcfx_scsi.scsi import AccessPattern, Transaction
+
+
+def read10(lba, blocks, data, status=0x00, block_length=2048):
+    cdb = bytes([0x28, 0x00]) + lba.to_bytes(4, 'big') + bytes([0x00]) + blocks.to_bytes(2, 'big') + bytes([0x00])
+    return Transaction(0, 1, 0x81, 'LUN 7,0', cdb, None if data is None else memoryview(bytes(data)), None,
+                       status, b'\x00', b'', [], block_length)
+
+
+def test_whole_read():
+    pattern = AccessPattern()
+    access = pattern.add(read10(0x10, 4, bytes(4 * 2048)))
+    assert (access.blocks, access.kind) == (4, 'first')
+    assert sorted(pattern.reads) == [0x10, 0x11, 0x12, 0x13]
+    assert pattern.head == 0x14
+
+
+def test_truncated_read():
+    # 8 blocks asked for, but the transfer stopped in the third one
+    pattern = AccessPattern()
+    access = pattern.add(read10(0x10, 8, bytes(2 * 2048 + 100)))
+    assert access.blocks == 3
+    assert sorted(pattern.reads) == [0x10, 0x11, 0x12]
+    assert pattern.head == 0x13
+    access = pattern.add(read10(0x13, 1, bytes(2048)))
+    assert (access.kind, access.seek, access.rereads) == ('sequential', 0, 0)
+
+
+def test_truncated_read_of_raw_sectors():
+    # the block length set by MODE SELECT counts, not the byte count
+    pattern = AccessPattern()
+    access = pattern.add(read10(0x20, 4, bytes(2352 + 10), block_length=2352))
+    assert access.blocks == 2
+    assert pattern.head == 0x22
+
+
+def test_failed_read():
+    pattern = AccessPattern()
+    access = pattern.add(read10(0x10, 8, None, status=0x02))
+    assert access.blocks == 0
+    assert pattern.reads == {}
+    assert pattern.head == 0x10
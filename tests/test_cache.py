@@ -0,0 +1,119 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''The decode cache (cache.py): the same decode as without it, and only what changed decoded again.'''
+
+import os
+
+import tracegen
+from pcfx_scsi_offline import cache
+from pcfx_scsi_offline.cache import DecodeCache, cached_decode
+from pcfx_scsi_offline.engine import run_dsl
+
+from support import transaction_key
+
+BLOCK_SAMPLES = 1 << 16
+SPAN_SAMPLES = 1 << 17
+
+
+def _trace():
+    (words, gen) = tracegen.synthetic_trace(reads=6, sectors=2, polls=20, glitches=20,
+                                            timing={'bus_free': 3000})
+    return words
+
+
+def _same(decoder, reference):
+    return (decoder.annotations == reference.annotations
+            and [transaction_key(t) for t in decoder.transactions] == [transaction_key(t) for t in reference.transactions]
+            and decoder.carried_state() == reference.carried_state())
+
+
+def _small_spans(monkeypatch):
+    span_cuts = cache.span_cuts
+    monkeypatch.setattr(cache, 'span_cuts', lambda edges, min_gap: span_cuts(edges, min_gap, SPAN_SAMPLES))
+
+
+def test_cold_and_warm(tmp_path, monkeypatch):
+    _small_spans(monkeypatch)
+    path = str(tmp_path / 'trace.dsl')
+    tracegen.write_dsl(path, _trace(), block_samples=BLOCK_SAMPLES)
+    for options in ({}, {'data_detail': 'per byte'}, {'sector_check': True}):
+        reference = run_dsl(path, **options)
+        decode_cache = DecodeCache(str(tmp_path / 'cache'))
+        (decoder, samplerate) = cached_decode(path, decode_cache, **options)
+        assert _same(decoder, reference)
+        assert decode_cache.stored > 2                          # spans and the manifest
+        warm = DecodeCache(str(tmp_path / 'cache'))
+        (decoder, samplerate) = cached_decode(path, warm, **options)
+        assert _same(decoder, reference)
+        assert warm.stored == 0
+
+
+def test_changed_block(tmp_path, monkeypatch):
+    _small_spans(monkeypatch)
+    words = _trace()
+    tracegen.write_dsl(str(tmp_path / 'a.dsl'), words, block_samples=BLOCK_SAMPLES)
+    cold = DecodeCache(str(tmp_path / 'cache'))
+    cached_decode(str(tmp_path / 'a.dsl'), cold)
+    # glitches in one block only: the spans elsewhere are reused
+    changed = words.copy()
+    tracegen.inject_glitches(changed[5 * BLOCK_SAMPLES:6 * BLOCK_SAMPLES], 5, seed=1)
+    path = str(tmp_path / 'b.dsl')
+    tracegen.write_dsl(path, changed, block_samples=BLOCK_SAMPLES)
+    decode_cache = DecodeCache(str(tmp_path / 'cache'))
+    (decoder, samplerate) = cached_decode(path, decode_cache)
+    assert _same(decoder, run_dsl(path))
+    assert decode_cache.loaded > 0
+    assert 0 < decode_cache.stored < cold.stored
+
+
+class RecordingCache(DecodeCache):
+    '''A DecodeCache which lists the keys stored, in order.'''
+
+    def __init__(self, directory):
+        DecodeCache.__init__(self, directory)
+        self.keys = []
+
+    def put(self, key, value):
+        self.keys.append(key)
+        DecodeCache.put(self, key, value)
+
+
+def test_only_missing_entries_decoded(tmp_path, monkeypatch):
+    _small_spans(monkeypatch)
+    path = str(tmp_path / 'trace.dsl')
+    tracegen.write_dsl(path, _trace(), block_samples=BLOCK_SAMPLES)
+    directory = str(tmp_path / 'cache')
+    cold = RecordingCache(directory)
+    cached_decode(path, cold, jobs=2)
+    manifest_key = cold.keys[-1]
+    span_keys = cold.get(manifest_key)[1]
+    assert len(span_keys) > 2
+    reference = run_dsl(path)
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError('pool started for fewer than two spans')
+    monkeypatch.setattr(cache, 'ProcessPoolExecutor', no_pool)
+    for key in (manifest_key, span_keys[len(span_keys) // 2]):
+        os.remove(cold._path(key))
+        warm = RecordingCache(directory)
+        (decoder, samplerate) = cached_decode(path, warm, jobs=2)
+        assert _same(decoder, reference)
+        assert warm.keys == [key]                               # not the manifest again, once found
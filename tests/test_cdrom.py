@@ -0,0 +1,120 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''The sector checks (cdrom.py): EDC and ECC known answers, and the problems found in damaged sectors.'''
+
+import zlib
+
+import numpy as np
+import pytest
+
+import common
+from pcfx_scsi.cdrom import SYNC, SectorValidator, edc, ecc
+
+# (lba, mode, form, EDC, CRC-32 of the whole sector), worked out with a
+# bit-by-bit reference implementation of the EDC and the P/Q parity
+KNOWN_SECTORS = (
+    (16, 1, 1, 0x825B3BE9, 0xF89B584F),
+    (17, 2, 1, 0xD66F04B7, 0x83290601),
+    (18, 2, 2, 0x02058589, 0x55A5524A),
+)
+
+
+def _bcd(value):
+    return ((value // 10) << 4) | (value % 10)
+
+
+def _sector(lba, mode, form):
+    # A raw sector (a uint8 array of 2352), the data being (7 * n + lba) & 0xFF
+    sector = np.zeros(2352, np.uint8)
+    sector[:12] = SYNC
+    address = lba + 150
+    sector[12:16] = (_bcd(address // 4500), _bcd(address // 75 % 60), _bcd(address % 75), mode)
+    if mode == 1:
+        (data, edc_at) = (slice(16, 2064), 2064)
+    else:
+        sector[16:24] = [0, 1, 0x20 if form == 2 else 0x08, 0] * 2
+        (data, edc_at) = (slice(24, 2072), 2072) if form == 1 else (slice(24, 2348), 2348)
+    sector[data] = (7 * np.arange(data.stop - data.start) + lba) & 0xFF
+    start = 0 if mode == 1 else 16
+    sector[edc_at:edc_at + 4] = edc(sector[None, start:edc_at]).astype('<u4').view(np.uint8)
+    if form == 1:
+        block = sector[None, 12:].copy()
+        if mode == 2:
+            block[:, :4] = 0                                     # the header does not count in mode 2
+        sector[2076:] = ecc(block)[0]
+    return sector
+
+
+def test_edc_check_value():
+    # CRC-32/CD-ROM-EDC, as listed in the catalogue of parametrised CRC algorithms
+    assert edc(np.frombuffer(b'123456789', np.uint8)[None])[0] == 0x6EC2EDC4
+
+
+@pytest.mark.parametrize('lba, mode, form, edc_value, crc', KNOWN_SECTORS)
+def test_known_sector(lba, mode, form, edc_value, crc):
+    sector = _sector(lba, mode, form)
+    edc_at = {1: 2064, 2: 2072}[mode] if form == 1 else 2348
+    assert int(sector[edc_at:edc_at + 4].view('<u4')[0]) == edc_value
+    assert zlib.crc32(sector.tobytes()) == crc
+
+
+@pytest.mark.parametrize('lba, mode, form, edc_value, crc', KNOWN_SECTORS)
+def test_good_sectors(lba, mode, form, edc_value, crc):
+    validator = SectorValidator()
+    sectors = np.stack([_sector(lba + index, mode, form) for index in range(3)])
+    for (length, offset) in ((2352, 0), (2340, 12)) + (((2336, 16),) if mode == 2 else ()):
+        assert validator.check(lba, sectors[:, offset:offset + length], length) == []
+
+
+def _problems(sector, lba, length=2352, offset=0):
+    found = SectorValidator().check(lba, sector[None, offset:offset + length], length)
+    return {text.split()[0] for (index, texts) in found for text in texts}
+
+
+@pytest.mark.parametrize('lba, mode, form, edc_value, crc', KNOWN_SECTORS)
+def test_damaged_sectors(lba, mode, form, edc_value, crc):
+    data = _sector(lba, mode, form)
+    data[500] ^= 0x01
+    assert _problems(data, lba) == ({'EDC', 'ECC'} if form == 1 else {'EDC'})
+
+    header = _sector(lba, mode, form)
+    header[13] ^= 0x01
+    assert _problems(header, lba) == ({'HEADER', 'EDC', 'ECC'} if mode == 1 else {'HEADER'})
+    if mode == 2:
+        assert _problems(header, lba, 2336, 16) == set()         # (not sent)
+
+    sync = _sector(lba, mode, form)
+    sync[0] ^= 0x01
+    assert _problems(sync, lba) == ({'SYNC', 'EDC'} if mode == 1 else {'SYNC'})
+    assert _problems(sync, lba, 2340, 12) == set()
+
+    if mode == 2:
+        subheader = _sector(lba, mode, form)
+        subheader[17] ^= 0x04
+        assert _problems(subheader, lba, 2336, 16) == ({'SUBHEADER', 'EDC', 'ECC'} if form == 1
+                                                        else {'SUBHEADER', 'EDC'})
+
+
+def test_form2_without_edc():
+    # an EDC of 0 means that the form 2 sector has none
+    sector = _sector(18, 2, 2)
+    sector[2348:2352] = 0
+    assert _problems(sector, 18) == set()
@@ -0,0 +1,34 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''Command labels (format_command_label in scsi.py), as the decoder has always shown them.'''
+
+import common
+from pcfx_scsi.scsi import format_command_label
+
+
+def test_labels():
+    assert format_command_label(bytes(6)) == ['[00]: TEST UNIT READY   [ 0x00 0x00 0x00 0x00 0x00 0x00 ]']
+    assert format_command_label(bytes([0x03, 0, 0, 0, 0x12, 0])) == \
+        ['[03]: REQUEST SENSE (18 bytes)    [ 0x03 0x00 0x00 0x00 0x12 0x00 ]']
+    assert format_command_label(bytes([0x08, 0, 0, 0x10, 0x02, 0])) == \
+        ['[08]: READ LBA 0x000010, 0x02 BLOCKS    [ 0x08 0x00 0x00 0x10 0x02 0x00 ]']
+    assert format_command_label(bytes([0x02, 0, 0, 0, 0, 0])) == \
+        ['[02]: Unknown command  [ 0x02 0x00 0x00 0x00 0x00 0x00 ]']
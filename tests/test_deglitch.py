@@ -0,0 +1,77 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''The deglitch filter (Deglitcher in scsi.py), and edges still pending when the input ends.'''
+
+import numpy as np
+
+import common
+import tracegen
+from pcfx_scsi.scsi import Deglitcher
+from pcfx_scsi_offline.dsl import DslCapture
+
+from support import pd_decode, offline_decode, offline_annotations, transaction_key, count_class
+
+ACK_RISE = 0b1000
+
+
+def test_glitch_rejected():
+    deglitcher = Deglitcher(3)
+    assert deglitcher.edges(10, ACK_RISE, 'a') == []
+    assert deglitcher.edges(12, ACK_RISE, 'b') == []            # toggled back within 3 samples
+    assert deglitcher.glitches == 1
+    assert deglitcher.finish() == []
+
+
+def test_edge_confirmed_by_a_later_one():
+    deglitcher = Deglitcher(3)
+    assert deglitcher.edges(10, ACK_RISE | 0b1, 'a') == []
+    assert deglitcher.edges(13, 0b10, 'b') == [(10, ACK_RISE | 0b1, 'a')]
+    assert deglitcher.finish() == [(13, 0b10, 'b')]
+    assert deglitcher.finish() == []
+
+
+def _last_ack_edge(words):
+    ack = (words >> 13) & 1
+    return int(np.flatnonzero(ack[1:] != ack[:-1])[-1]) + 1
+
+
+def test_last_byte_at_end_of_input():
+    # TEST UNIT READY, cut off on the ACK edge which ends its Message In byte
+    gen = tracegen.TraceGenerator()
+    gen.transaction([0x00, 0x00, 0x00, 0x00, 0x00, 0x00])
+    words = gen.words()
+    words = words[:_last_ack_edge(words) + 1]
+    for deglitch in (1, 2, 4):
+        (annotations, transactions) = pd_decode(words, deglitch=deglitch, data_detail='per byte')
+        assert count_class(annotations, 30) == 8                 # 6 command bytes, status and message
+        decoder = offline_decode(words, deglitch, data_detail='per byte')
+        assert offline_annotations(decoder) == annotations
+        assert [transaction_key(t) for t in decoder.transactions] == [transaction_key(t) for t in transactions]
+
+
+def test_sample_capture_keeps_its_last_byte():
+    # The capture ends on the last command byte of a READ HEADER, which is
+    # shown (as it was before the deglitch filter)
+    with DslCapture(common.SAMPLE_CAPTURE) as capture:
+        words = capture.read_words()
+    (annotations, transactions) = pd_decode(words, data_detail='per byte')
+    assert count_class(annotations, 30) == 112
+    assert offline_annotations(offline_decode(words, data_detail='per byte')) == annotations
@@ -0,0 +1,45 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''Disc images from the sectors read (image.py).'''
+
+import common
+from pcfx_scsi.scsi import Transaction
+from pcfx_scsi_offline.image import write_image, compare_image, format_stats
+
+
+def read10_msf(m, s, f, blocks, data):
+    # READ(10) with an MSF address (address type 01b in the control byte)
+    cdb = bytes([0x28, 0x00, m, s, f, 0x00, 0x00]) + blocks.to_bytes(2, 'big') + bytes([0x40])
+    return Transaction(0, 1, 0x81, 'LUN 7,0', cdb, memoryview(bytes(data)), None,
+                       0x00, b'\x00', b'', [], 2048)
+
+
+def test_sectors_before_lba_0(tmp_path):
+    # 00:01:74 is LBA -1, so only the second sector has a place in the image
+    transactions = [read10_msf(0, 1, 74, 2, bytes([1]) * 2048 + bytes([2]) * 2048)]
+    path = str(tmp_path / 'disc.iso')
+    stats = write_image(path, transactions)
+    assert (stats.sectors, stats.before_start) == (1, 1)
+    with open(path, 'rb') as image:
+        assert image.read() == bytes([2]) * 2048
+    assert '  1 sectors before LBA 0 skipped' in format_stats(stats, 'written')
+    stats = compare_image(path, transactions)
+    assert (stats.sectors, stats.before_start, stats.mismatches, stats.missing) == (1, 1, [], [])
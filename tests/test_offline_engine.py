@@ -0,0 +1,104 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''The offline engine (engine.py) against pd.py, on traces with glitches.'''
+
+import pytest
+
+import common
+import tracegen
+from pcfx_scsi.scsi import TIMING_DEFAULTS
+from pcfx_scsi_offline.dsl import DslCapture
+from pcfx_scsi_offline.engine import collapse_repeats, decode_dsl, run_dsl
+from pcfx_scsi_offline.stream import dsl_transactions
+
+from support import SAMPLERATE, mixed_trace, pd_decode, offline_decode, offline_annotations, transaction_key, count_class
+
+SEEDS = range(4)
+
+# limits (ns) which the traces break: the bus is free for 60 samples, and ACK is low for 15
+TIMING = {'bus_free': 2000, 'selection': 250000000, 'deskew': 90, 'bus_settle': 400,
+          'ack_width': 400, 'ack_negation': 30}
+
+
+def _compare(words, deglitch=2, pd_options=None, **options):
+    (annotations, transactions) = pd_decode(words, deglitch=deglitch, **dict(options, **(pd_options or {})))
+    decoder = offline_decode(words, deglitch, **options)
+    assert offline_annotations(decoder) == annotations
+    assert [transaction_key(t) for t in decoder.transactions] == [transaction_key(t) for t in transactions]
+    return annotations
+
+
+@pytest.mark.parametrize('deglitch', (1, 2, 4))
+def test_glitches(deglitch):
+    for seed in SEEDS:
+        _compare(mixed_trace(seed), deglitch)
+
+
+@pytest.mark.parametrize('options', ({'data_detail': 'per byte'},
+                                     {'data_detail': 'per N bytes', 'group_bytes': 100}))
+def test_data_detail(options):
+    for seed in SEEDS:
+        _compare(mixed_trace(seed), **options)
+
+
+def test_timing():
+    violations = 0
+    for seed in SEEDS:
+        words = mixed_trace(seed)
+        pd_options = dict({'timing_' + name: limit for (name, limit) in TIMING.items()}, timing='yes')
+        (annotations, transactions) = pd_decode(words, **pd_options)
+        decoder = offline_decode(words, timing=TIMING, samplerate=SAMPLERATE)
+        assert offline_annotations(decoder) == annotations
+        violations += count_class(annotations, 34)
+    assert violations
+
+
+def test_timing_of_dsl_files(tmp_path):
+    # the sample rate is taken from the capture
+    words = mixed_trace(0)
+    path = str(tmp_path / 'trace.dsl')
+    tracegen.write_dsl(path, words, SAMPLERATE)
+    expected = offline_decode(words, timing=TIMING, samplerate=SAMPLERATE)
+    assert count_class(expected.annotations, 34)
+    assert run_dsl(path, timing=dict(TIMING)).annotations == expected.annotations
+    assert decode_dsl(path, timing=dict(TIMING)) == expected.annotations
+    with DslCapture(path) as capture:
+        transactions = list(dsl_transactions(capture, 2, timing=dict(TIMING)))
+    assert [transaction_key(t) for t in transactions] == [transaction_key(t) for t in expected.transactions]
+    assert run_dsl(common.SAMPLE_CAPTURE, timing=dict(TIMING_DEFAULTS)).annotations
+
+
+def test_sector_check():
+    for seed in SEEDS:
+        words = mixed_trace(seed)
+        (annotations, transactions) = pd_decode(words, sector_check='yes')
+        assert offline_annotations(offline_decode(words, sector_check=True)) == annotations
+
+
+def test_collapsed_repeats():
+    repeats = 0
+    for seed in SEEDS:
+        words = mixed_trace(seed)
+        (annotations, transactions) = pd_decode(words, repeats='collapse')
+        decoder = offline_decode(words)
+        assert collapse_repeats(offline_annotations(decoder), decoder.transactions) == annotations
+        repeats += count_class(annotations, 32)
+    assert repeats
@@ -0,0 +1,60 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''The parallel decode (parallel.py) against a serial one, cut at many places.'''
+
+import pytest
+
+from pcfx_scsi_offline.engine import Edges
+from pcfx_scsi_offline.parallel import parallel_decode
+
+from support import mixed_trace, offline_decode, transaction_key
+
+SEEDS = range(4)
+MIN_GAP = 8                          # cut at nearly every free bus
+
+
+def _compare(words, deglitch=2, **options):
+    serial = offline_decode(words, deglitch, **options)
+    parallel = parallel_decode(Edges(words), deglitch, jobs=3, min_gap=MIN_GAP, **options)
+    assert parallel.annotations == serial.annotations
+    assert [transaction_key(t) for t in parallel.transactions] == [transaction_key(t) for t in serial.transactions]
+    assert parallel.carried_state() == serial.carried_state()
+    assert parallel.state == serial.state
+
+
+@pytest.mark.parametrize('options', ({}, {'data_detail': 'per byte'},
+                                     {'data_detail': 'per N bytes', 'group_bytes': 100},
+                                     {'sector_check': True}))
+def test_parallel(options):
+    for seed in SEEDS:
+        _compare(mixed_trace(seed), **options)
+
+
+def test_wide_deglitch():
+    for seed in SEEDS:
+        _compare(mixed_trace(seed), deglitch=4)
+
+
+def test_cut_off_mid_transaction():
+    # the last piece ends in the middle of a transaction
+    for seed in SEEDS:
+        words = mixed_trace(seed)
+        _compare(words[:len(words) * 3 // 5], data_detail='per byte')
@@ -0,0 +1,111 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''The streamed decode (stream.py) against a whole one, fed in chunks of odd sizes.'''
+
+import io
+import random
+
+import pytest
+
+import tracegen
+from pcfx_scsi_offline.stream import StreamDecoder, stream_decode, transaction_text
+
+from support import mixed_trace, offline_decode, transaction_key
+
+SEEDS = range(4)
+CHUNK_SAMPLES = (1, 2, 7, 100, 5000)
+
+
+def _short_trace():
+    # A few transactions, with glitches: small enough to feed one sample at a time
+    gen = tracegen.TraceGenerator(1, {'bus_free': 60, 'seek': 30})
+    gen.transaction([0x00, 0x00, 0x00, 0x00, 0x00, 0x00], status=0x02)
+    gen.transaction([0x03, 0x00, 0x00, 0x00, 0x12, 0x00], data_in=bytes(range(18)))
+    gen.transaction([0x15, 0x10, 0x00, 0x00, 0x0C, 0x00], data_out=bytes([0, 0, 0, 8, 0, 0, 0, 0, 0, 0, 2, 0]))
+    gen.transaction([0x28, 0x00, 0x00, 0x00, 0x00, 0x10, 0x00, 0x00, 0x01, 0x00], data_in=bytes(range(256)) * 2)
+    words = gen.words()
+    tracegen.inject_glitches(words, 20, 1, margin=4)
+    return words
+
+
+def _stream(words, chunk_samples, deglitch=2, **options):
+    # The decoder after feeding 'words' in chunks of the sizes given, in turn
+    decoder = StreamDecoder(deglitch, annotations=True, **options)
+    transactions = []
+    (position, index) = (0, 0)
+    while position < len(words):
+        size = chunk_samples[index % len(chunk_samples)]
+        decoder.feed(words[position:position + size])
+        transactions.extend(decoder.transactions)
+        decoder.transactions.clear()
+        (position, index) = (position + size, index + 1)
+    decoder.finish()
+    transactions.extend(decoder.transactions)
+    return (decoder, transactions)
+
+
+def _compare(words, chunk_samples, **options):
+    whole = offline_decode(words, **options)
+    (decoder, transactions) = _stream(words, chunk_samples, **options)
+    assert list(decoder.annotations) == whole.annotations
+    assert [transaction_key(t) for t in transactions] == [transaction_key(t) for t in whole.transactions]
+    assert decoder.carried_state() == whole.carried_state()
+
+
+@pytest.mark.parametrize('options', ({}, {'data_detail': 'per byte'}))
+def test_fixed_chunks(options):
+    words = _short_trace()
+    for size in CHUNK_SAMPLES:
+        _compare(words, [size], **options)
+
+
+def test_mixed_chunks():
+    for seed in SEEDS:
+        rng = random.Random(seed)
+        _compare(mixed_trace(seed), [rng.choice(CHUNK_SAMPLES) for _ in range(50)], data_detail='per byte')
+
+
+def test_cut_off():
+    # the input ends in the middle of a transaction
+    for seed in SEEDS:
+        words = mixed_trace(seed)
+        _compare(words[:len(words) * 3 // 5], [7, 5000, 100])
+
+
+class TrickleReader(io.BytesIO):
+    '''A file object which reads at most 'size' bytes at a time, as a pipe may.'''
+
+    def __init__(self, data, size):
+        io.BytesIO.__init__(self, data)
+        self.size = size
+
+    def readinto(self, buffer):
+        return io.BytesIO.readinto(self, memoryview(buffer)[:self.size])
+
+
+def test_stream_decode():
+    # odd reads from the byte stream, half a sample at times
+    for seed in SEEDS:
+        words = mixed_trace(seed)
+        out = io.StringIO()
+        stream_decode(TrickleReader(words.astype('<u2').tobytes(), 333), out, 50000000, chunk_samples=1000)
+        expected = ''.join(transaction_text(t) + '\n' for t in offline_decode(words).transactions)
+        assert out.getvalue() == expected
@@ -0,0 +1,46 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Offline (sigrok-free) decoding of PC-FX SCSI captures saved by DSView
+as .dsl files.
+
+The helpers shared with the protocol decoder live in decoders/pcfx-scsi;
+that folder is not an importable package name (it contains a hyphen, and
+its __init__ needs the sigrokdecode runtime), so it is registered here as
+the 'pcfx_scsi' package without running its __init__.
+'''
+
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+DECODER_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                            '..', '..', 'decoders', 'pcfx-scsi'))
+
+
+def _register_decoder_package():
+    if 'pcfx_scsi' in sys.modules:
+        return
+    spec = importlib.machinery.ModuleSpec('pcfx_scsi', None, is_package=True)
+    spec.submodule_search_locations = [DECODER_DIR]
+    sys.modules['pcfx_scsi'] = importlib.util.module_from_spec(spec)
+
+_register_decoder_package()
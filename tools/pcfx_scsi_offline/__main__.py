@@ -0,0 +1,248 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+import argparse
+import sys
+
+from .dsl import DEFAULT_CHUNK_SAMPLES, parse_samplerate
+from .engine import OfflineDecoder, load_edges, add_access_annotations, collapse_repeats
+from .metrics import capture_metrics, format_summary
+from .access import access_report, format_access, write_access_csv
+from .image import DEFAULT_SECTOR_LENGTH, write_image, compare_image, format_stats
+from .export import EXPORT_FORMATS, export_dsl, new_exporter
+from .parallel import parallel_decode
+from .cache import DEFAULT_CACHE_BYTES, DecodeCache, cached_decode, default_cache_dir
+from .boot import classify_library, library_paths, format_results
+from .stream import DEFAULT_STREAM_CHUNK, stream_decode, parse_probe_bits
+from pcfx_scsi.scsi import deglitch_samples, TIMING_DEFAULTS
+from .index import TransactionIndex, IndexFileError, index_path, write_index, row_text
+
+
+def _lba_range(text):
+    first, _, last = text.partition('-')
+    return (int(first, 0), int(last or first, 0))
+
+
+def _timing_limit(text):
+    (name, _, value) = text.partition('=')
+    if name not in TIMING_DEFAULTS or not value:
+        raise argparse.ArgumentTypeError('expected RULE=NS, RULE being one of %s' % ', '.join(TIMING_DEFAULTS))
+    return (name, float(value))
+
+
+def _load_index(path, args):
+    # The capture's sidecar index, (re)built if it is missing or out of date
+    try:
+        return TransactionIndex.open(index_path(path), path)
+    except (FileNotFoundError, IndexFileError):
+        pass
+    (decoder, samplerate) = _decode(path, args)
+    write_index(index_path(path), decoder.transactions, path)
+    return TransactionIndex.open(index_path(path), path)
+
+
+def _decode(path, args):
+    # Returns the decoder (after decoding) and the capture's sample rate
+    options = {'data_detail': args.data_detail, 'group_bytes': args.group_bytes}
+    if args.timing:
+        options['timing'] = dict(args.timing_limit)
+    if args.sector_check:
+        options['sector_check'] = True
+    if args.cache or args.cache_dir:
+        cache = DecodeCache(args.cache_dir, args.cache_size << 20)
+        result = cached_decode(path, cache, chunk_samples=args.chunk_samples, deglitch=args.deglitch,
+                               deglitch_unit=args.deglitch_unit, jobs=args.jobs, **options)
+        sys.stderr.write('cache: %d entries loaded, %d stored\n' % (cache.loaded, cache.stored))
+        return result
+    (edges, width, samplerate) = load_edges(path, chunk_samples=args.chunk_samples,
+                                            deglitch=args.deglitch, deglitch_unit=args.deglitch_unit)
+    if args.timing:
+        options['samplerate'] = samplerate
+    if args.jobs != 1:
+        return (parallel_decode(edges, width, jobs=args.jobs, **options), samplerate)
+    decoder = OfflineDecoder(width, **options)
+    decoder.decode(edges)
+    return (decoder, samplerate)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pcfx_scsi_offline',
+                                     description='Decode PC-FX SCSI captures (.dsl) without sigrok.')
+    parser.add_argument('captures', nargs='+',
+                        help="DSView .dsl capture file(s); with --stream, a FIFO or '-'; with --boot-scenario, "
+                             "folders of them as well")
+    parser.add_argument('--chunk-samples', type=int, default=DEFAULT_CHUNK_SAMPLES,
+                        help='samples inflated at a time (multiple of 8, default %(default)s)')
+    parser.add_argument('--deglitch', type=int, default=2,
+                        help='min. pulse width on CD/IO/MSG/ACK/BSY (default %(default)s)')
+    parser.add_argument('--deglitch-unit', default='samples', choices=('samples', 'ns'),
+                        help='unit of --deglitch (default %(default)s)')
+    parser.add_argument('--data-detail', default='per sector', choices=('per sector', 'per N bytes', 'per byte'),
+                        help='Data In/Out annotations (default %(default)s)')
+    parser.add_argument('--group-bytes', type=int, default=256,
+                        help="bytes per Data In/Out annotation with 'per N bytes' (default %(default)s)")
+    parser.add_argument('--repeats', default='expand', choices=('collapse', 'expand'),
+                        help='show runs of identical transactions once, with a count (default %(default)s)')
+    parser.add_argument('--timing', action='store_true',
+                        help='check the SCSI timing limits (bus free, selection, deskew, bus settle, ACK width and '
+                             'negation); violations are annotated as class 34')
+    parser.add_argument('--timing-limit', type=_timing_limit, action='append', default=[], metavar='RULE=NS',
+                        help='change the limit of a timing rule, in ns (0 turns it off); '
+                             'the rules are %s' % ', '.join(TIMING_DEFAULTS))
+    parser.add_argument('--sector-check', action='store_true',
+                        help='check the sync, header, EDC and ECC of the sectors returned by READ commands (with '
+                             '2352, 2340 or 2336-byte blocks); bad sectors are annotated as class 35')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='decode in this many processes, splitting the capture where the bus is free '
+                             '(0: one per CPU; default %(default)s)')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the decoded spans of each capture in a cache, and take what is already there '
+                             'from it ($XDG_CACHE_HOME or ~/.cache, in pcfx_scsi_offline)')
+    parser.add_argument('--cache-dir', metavar='PATH',
+                        help='cache directory (implies --cache)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_BYTES >> 20, metavar='MB',
+                        help='size limit of the cache; the least recently used entries are removed '
+                             '(default %(default)s)')
+    parser.add_argument('--boot-scenario', action='store_true',
+                        help='print the boot scenario (no disc, lid open, audio CD, data disc) of each capture, '
+                             'from its commands, instead of the annotations; --jobs classifies that many '
+                             'captures at a time')
+    parser.add_argument('--summary', action='store_true',
+                        help='print command timing statistics per opcode instead of the annotations')
+    parser.add_argument('--access', action='store_true',
+                        help='print the disc access pattern (seeks, sequential runs, re-reads, heat map per track) '
+                             'instead of the annotations')
+    parser.add_argument('--access-csv', metavar='PATH',
+                        help="write one row per addressed command to this CSV file ('-' for stdout)")
+    parser.add_argument('--image', metavar='PATH',
+                        help='write the sectors returned by READ commands into a sparse disc image (by LBA)')
+    parser.add_argument('--compare', metavar='IMAGE',
+                        help='compare the sectors returned by READ commands with a disc image (e.g. an ISO build)')
+    parser.add_argument('--sector-length', type=int, default=DEFAULT_SECTOR_LENGTH,
+                        help='bytes per sector of the image for --image/--compare (default %(default)s)')
+    parser.add_argument('--export', choices=tuple(EXPORT_FORMATS),
+                        help="write one record per transaction to '<capture>.csv', '.jsonl' or '.cols' (binary "
+                             "columns) instead of the annotations, decoding one chunk at a time; with --stream, "
+                             "to stdout")
+    parser.add_argument('--index', action='store_true',
+                        help="also write a transaction index next to each capture ('<capture>.idx')")
+    parser.add_argument('--lba', type=_lba_range, metavar='FIRST[-LAST]',
+                        help='list the commands which touched these LBAs, from the index')
+    parser.add_argument('--at-sample', type=int, metavar='N',
+                        help='show the command in progress at sample N, from the index')
+    stream = parser.add_argument_group('live decoding',
+                                       'Decode raw samples from a pipe as they arrive, writing one line per transaction.')
+    stream.add_argument('--stream', action='store_true',
+                        help="read raw samples from a FIFO (or stdin for '-') instead of a .dsl file")
+    stream.add_argument('--samplerate', type=parse_samplerate, metavar='RATE',
+                        help="sample rate of the stream, i.e. '50 MHz' (needed with --stream)")
+    stream.add_argument('--unitsize', type=int, default=2, choices=(2, 4),
+                        help='bytes per sample in the stream (default %(default)s)')
+    stream.add_argument('--probe-bits', type=parse_probe_bits, metavar='BITS',
+                        help='input bit of each channel D0-D7,SEL,BSY,CD,IO,MSG,ACK, comma-separated '
+                             '(default: bits 0-13 in that order)')
+    stream.add_argument('--lag-interval', type=float, default=5.0, metavar='SECONDS',
+                        help='how often to report the decode lag on stderr (0: never; default %(default)s)')
+    args = parser.parse_args(argv)
+
+    out = sys.stdout
+    if args.stream:
+        if not args.samplerate:
+            parser.error('--stream needs --samplerate')
+        width = deglitch_samples(args.deglitch, args.deglitch_unit, args.samplerate)
+        exporter = None
+        if args.export:
+            binary = EXPORT_FORMATS[args.export][3]
+            out = sys.stdout.buffer if binary else sys.stdout
+        for path in args.captures:
+            source = sys.stdin.buffer if path == '-' else open(path, 'rb', buffering=0)
+            if args.export:
+                exporter = new_exporter(out, args.export, args.samplerate)
+            try:
+                stream_decode(source, out, args.samplerate, width, chunk_samples=DEFAULT_STREAM_CHUNK,
+                              unitsize=args.unitsize, probe_bits=args.probe_bits,
+                              report=sys.stderr if args.lag_interval > 0 else None,
+                              report_interval=args.lag_interval, exporter=exporter,
+                              data_detail=args.data_detail, group_bytes=args.group_bytes)
+            finally:
+                if source is not sys.stdin.buffer:
+                    source.close()
+        return
+    if args.boot_scenario:
+        cache_dir = args.cache_dir or (default_cache_dir() if args.cache else None)
+        results = classify_library(library_paths(args.captures), jobs=args.jobs,
+                                   chunk_samples=args.chunk_samples, deglitch=args.deglitch,
+                                   deglitch_unit=args.deglitch_unit, cache_dir=cache_dir,
+                                   cache_bytes=args.cache_size << 20)
+        for line in format_results(results):
+            out.write('%s\n' % line)
+        return
+    for path in args.captures:
+        if len(args.captures) > 1:
+            out.write('# %s\n' % path)
+        if (args.lba is not None) or (args.at_sample is not None):
+            # Queries are answered from the index (built on first use)
+            index = _load_index(path, args)
+            if args.at_sample is not None:
+                row = index.at_sample(args.at_sample)
+                out.write('%s\n' % (row_text(row) if row is not None else 'no command at sample %d' % args.at_sample))
+            if args.lba is not None:
+                for row in index.lba_range(*args.lba):
+                    out.write('%s\n' % row_text(row))
+            continue
+        if args.export:
+            (header, formatter, extension, binary) = EXPORT_FORMATS[args.export]
+            target = path + extension
+            with (open(target, 'wb') if binary else open(target, 'w', newline='')) as export:
+                count = export_dsl(path, export, args.export, chunk_samples=args.chunk_samples,
+                                   deglitch=args.deglitch, deglitch_unit=args.deglitch_unit,
+                                   data_detail=args.data_detail, group_bytes=args.group_bytes)
+            sys.stderr.write('%d transactions exported to %s\n' % (count, target))
+            continue
+        (decoder, samplerate) = _decode(path, args)
+        if args.access or args.access_csv:
+            report = access_report(decoder.transactions)
+            if args.access_csv == '-':
+                write_access_csv(out, report.accesses)
+            elif args.access_csv:
+                with open(args.access_csv, 'w', newline='') as table:
+                    write_access_csv(table, report.accesses)
+        if args.summary:
+            for line in format_summary(capture_metrics(decoder.transactions, samplerate)):
+                out.write('%s\n' % line)
+        elif args.access:
+            for line in format_access(report):
+                out.write('%s\n' % line)
+        elif args.access_csv != '-':
+            annotations = add_access_annotations(decoder.annotations, decoder.transactions)
+            if args.repeats == 'collapse':
+                annotations = collapse_repeats(annotations, decoder.transactions)
+            for ss, es, ann, texts in annotations:
+                out.write('%d-%d %d: %s\n' % (ss, es, ann, texts[0]))
+        if args.image:
+            for line in format_stats(write_image(args.image, decoder.transactions, args.sector_length), 'written'):
+                sys.stderr.write('%s\n' % line)
+        if args.compare:
+            for line in format_stats(compare_image(args.compare, decoder.transactions, args.sector_length), 'compared'):
+                sys.stderr.write('%s\n' % line)
+        if args.index:
+            write_index(index_path(path), decoder.transactions, path)
+
+if __name__ == '__main__':
+    main()
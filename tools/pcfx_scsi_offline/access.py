@@ -0,0 +1,162 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Disc access report
+#
+# The Access of every addressed command (see AccessPattern in scsi.py),
+# summarised for laying out files on a disc: how far the head seeks, how
+# long the sequential runs are, which blocks are read more than once, and
+# how the reads are spread over each track (a heat map).  The accesses can
+# also be written out as a CSV table.
+#
+
+from bisect import bisect_right
+import csv
+
+from pcfx_scsi.scsi import COMMANDS, AccessPattern, LEAD_OUT
+
+HEAT_COLUMNS = 64                    # characters of the heat map of one track
+HEAT_SHADES = ' .:-=+*#%@'           # from no reads to the most read column
+TOP_REREADS = 10                     # re-read ranges listed
+
+CSV_COLUMNS = ('startsample', 'endsample', 'opcode', 'command', 'lba', 'blocks', 'kind', 'seek',
+               'rereads', 'run', 'track')
+
+
+class AccessReport:
+    '''Accesses of a capture, with the sequential runs and per-LBA read counts.'''
+
+    def __init__(self):
+        self.pattern = AccessPattern()
+        self.accesses = []
+        self.runs = []               # [first lba, blocks, commands] of each sequential run
+
+    def add(self, transaction):
+        access = self.pattern.add(transaction)
+        if access is None:
+            return
+        self.accesses.append(access)
+        if access.kind == 'sequential' and self.runs:
+            self.runs[-1][1] += access.blocks
+            self.runs[-1][2] += 1
+        else:
+            self.runs.append([access.lba, access.blocks, 1])
+
+    def regions(self):
+        # (name, first lba, end lba) of each track from the TOC, or of all blocks read without one;
+        # the end is None for the last track if the lead-out was not seen
+        toc = self.pattern.toc
+        starts = sorted((lba, track) for (track, lba) in toc.items() if track != LEAD_OUT)
+        if not starts:
+            if not self.pattern.reads:
+                return []
+            return [('all blocks read', min(self.pattern.reads), max(self.pattern.reads) + 1)]
+        ends = [lba for (lba, track) in starts[1:]]
+        ends.append(toc.get(LEAD_OUT))
+        return [('track %d' % track, lba, end) for ((lba, track), end) in zip(starts, ends)]
+
+    def rereads(self):
+        # Ranges of consecutive blocks read more than once: (first lba, blocks, most reads)
+        ranges = []
+        for lba in sorted(lba for (lba, count) in self.pattern.reads.items() if count > 1):
+            count = self.pattern.reads[lba]
+            if ranges and ranges[-1][0] + ranges[-1][1] == lba:
+                ranges[-1][1] += 1
+                ranges[-1][2] = max(ranges[-1][2], count)
+            else:
+                ranges.append([lba, 1, count])
+        return ranges
+
+
+def access_report(transactions):
+    report = AccessReport()
+    for transaction in transactions:
+        report.add(transaction)
+    return report
+
+
+def _heat_strip(reads, first, end):
+    # One character per column of blocks first..end-1, shaded by the reads in it
+    span = max(end - first, 1)
+    width = min(HEAT_COLUMNS, span)
+    columns = [0] * width
+    for (lba, count) in reads:
+        columns[min((lba - first) * width // span, width - 1)] += count
+    hottest = max(columns) or 1
+    return ''.join(HEAT_SHADES[0 if not value else 1 + (len(HEAT_SHADES) - 2) * value // hottest]
+                   for value in columns)
+
+
+def format_access(report):
+    '''The report as lines of text.'''
+    accesses = report.accesses
+    reads = report.pattern.reads
+    seeks = [abs(access.seek) for access in accesses if access.kind in ('seek', 're-read') and access.seek]
+    blocks = sum(access.blocks for access in accesses)
+    lines = ['Addressed commands: %d, blocks read: %d (%d different, %d read again)'
+             % (len(accesses), blocks, len(reads), blocks - len(reads))]
+    kinds = {}
+    for access in accesses:
+        kinds[access.kind] = kinds.get(access.kind, 0) + 1
+    lines.append('  ' + ', '.join('%s: %d' % (kind, kinds[kind]) for kind in ('first', 'sequential', 'seek', 're-read')
+                                  if kind in kinds))
+    if seeks:
+        lines.append('  seek distance: mean %d, max %d blocks (total %d)' % (sum(seeks) // len(seeks), max(seeks), sum(seeks)))
+    runs = [run for run in report.runs if run[1]]
+    if runs:
+        longest = max(runs, key=lambda run: run[1])
+        lines.append('  sequential runs: %d, mean %.1f blocks, longest %d blocks (%d commands from LBA 0x%06X)'
+                     % (len(runs), sum(run[1] for run in runs) / len(runs), longest[1], longest[2], longest[0]))
+
+    regions = report.regions()
+    if regions:
+        lines.append('')
+        lines.append('Heat map (blocks read, by position in the track):')
+        ordered = sorted(reads.items())
+        keys = [lba for (lba, count) in ordered]
+        for (name, first, end) in regions:
+            part = ordered[bisect_right(keys, first - 1):(len(keys) if end is None else bisect_right(keys, end - 1))]
+            where = 'LBA 0x%06X-%s' % (first, '' if end is None else '0x%06X' % (end - 1))
+            if not part:
+                lines.append('  %-15s %-21s not read' % (name, where))
+                continue
+            if end is None:
+                end = part[-1][0] + 1
+            total = sum(count for (lba, count) in part)
+            lines.append('  %-15s %-21s %d blocks read (%d different)' % (name, where, total, len(part)))
+            lines.append('    |%s|' % _heat_strip(part, first, end))
+
+    rereads = report.rereads()
+    if rereads:
+        lines.append('')
+        lines.append('Blocks read more than once:')
+        for (lba, count, most) in sorted(rereads, key=lambda r: (-r[1] * r[2], r[0]))[:TOP_REREADS]:
+            lines.append('  LBA 0x%06X-0x%06X  %d blocks, up to %d times' % (lba, lba + count - 1, count, most))
+    return lines
+
+
+def write_access_csv(out, accesses):
+    '''Write one CSV row per Access (CSV_COLUMNS) to the text file 'out'.'''
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+    for a in accesses:
+        writer.writerow((a.startsample, a.endsample, '0x%02X' % a.opcode,
+                         COMMANDS[a.opcode][0] if a.opcode in COMMANDS else '', a.lba, a.blocks, a.kind,
+                         '' if a.seek is None else a.seek, a.rereads, a.run, '' if a.track is None else a.track))
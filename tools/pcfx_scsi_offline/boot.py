@@ -0,0 +1,264 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Boot scenario classifier
+#
+# At power-on, the BIOS probes the drive to find out what kind of disc is
+# in it (see samples/Boot_Scenarios/README.md): TEST UNIT READY and REQUEST
+# SENSE, retried some 75 times if the drive is closed but empty, and not at
+# all if the lid is open; with a disc, READ TOC over all the tracks, and on
+# a data disc the block length and a sector read.
+#
+# A capture is reduced to one token per command: its opcode and the class
+# of its status (none, GOOD, CHECK CONDITION or any other).  SIGNATURES are
+# short runs of tokens, which are all counted in a single pass over the
+# capture's tokens by an Aho-Corasick automaton, and each of the SCENARIOS
+# gives the range of counts of some signatures; the first scenario which
+# fits is the capture's.  Only the commands are looked at, not the data,
+# so a PhotoCD and a PC-FX disc (told apart by the contents of the sector
+# read) are both a 'data disc'.
+#
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import os
+import zipfile
+
+from pcfx_scsi.scsi import deglitch_samples
+
+from .dsl import DEFAULT_CHUNK_SAMPLES, DslCapture, DslError
+from .stream import dsl_transactions
+from .cache import DEFAULT_CACHE_BYTES, DecodeCache, cached_decode
+
+# Status classes
+NO_STATUS, GOOD, CHECK, OTHER = range(4)
+ANY = (NO_STATUS, GOOD, CHECK, OTHER)
+
+TEST_UNIT_READY = 0x00
+REQUEST_SENSE = 0x03
+MODE = (0x15, 0x1A)                  # MODE SELECT, MODE SENSE
+READ_TOC = (0x43, 0xDE)
+READ = (0x08, 0x28)
+
+# name: the (opcode(s), status class(es)) of each command of the run
+SIGNATURES = {
+    'not ready': ((TEST_UNIT_READY, CHECK), (REQUEST_SENSE, ANY)),
+    'ready':     ((TEST_UNIT_READY, GOOD),),
+    'toc':       ((READ_TOC, GOOD),),
+    'mode':      ((MODE, GOOD),),
+    'read':      ((READ, GOOD),),
+}
+
+# (name, description, {signature: (least, most or None)}), tried in order
+SCENARIOS = (
+    ('data disc', 'TOC read, then the block length and a sector',
+     {'toc': (1, None), 'mode': (1, None), 'read': (1, None)}),
+    ('audio CD',  'TOC read, but no data sector (or the capture ends first)',
+     {'toc': (1, None), 'read': (0, 0)}),
+    ('no disc',   'TEST UNIT READY / REQUEST SENSE retried, drive closed but empty',
+     {'not ready': (2, None), 'ready': (0, 0), 'toc': (0, 0)}),
+    ('lid open',  'TEST UNIT READY / REQUEST SENSE once, not retried',
+     {'not ready': (1, 1), 'ready': (0, 0), 'toc': (0, 0)}),
+)
+UNRECOGNIZED = 'unrecognized'
+
+
+def status_class(status):
+    if status is None:
+        return NO_STATUS
+    return GOOD if status == 0x00 else CHECK if status == 0x02 else OTHER
+
+
+def token(opcode, status):
+    return (opcode << 2) | status_class(status)
+
+
+def transaction_tokens(transactions):
+    '''The token of each transaction which sent a command.'''
+    for t in transactions:
+        if t.cdb:
+            yield token(t.cdb[0], t.status)
+
+
+def _expand(pattern):
+    # All the token runs a signature stands for
+    choices = []
+    for (opcodes, statuses) in pattern:
+        opcodes = opcodes if isinstance(opcodes, tuple) else (opcodes,)
+        statuses = statuses if isinstance(statuses, tuple) else (statuses,)
+        choices.append([(opcode << 2) | status for opcode in opcodes for status in statuses])
+    return product(*choices)
+
+
+class SignatureMatcher:
+    '''An Aho-Corasick automaton counting all the signatures in one pass.'''
+
+    def __init__(self, signatures=SIGNATURES):
+        self.names = tuple(signatures)
+        goto = [{}]
+        outputs = [set()]
+        for (index, pattern) in enumerate(signatures.values()):
+            for run in _expand(pattern):
+                state = 0
+                for t in run:
+                    if t not in goto[state]:
+                        goto[state][t] = len(goto)
+                        goto.append({})
+                        outputs.append(set())
+                    state = goto[state][t]
+                outputs[state].add(index)
+
+        # Failure links, breadth first: the longest proper suffix which is also
+        # a prefix of some run; a state also outputs what its suffix does
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for (t, next_state) in goto[state].items():
+                f = fail[state]
+                while f and t not in goto[f]:
+                    f = fail[f]
+                fail[next_state] = goto[f].get(t, 0)
+                outputs[next_state] |= outputs[fail[next_state]]
+                queue.append(next_state)
+        self.goto = goto
+        self.fail = fail
+        self.outputs = [tuple(sorted(output)) for output in outputs]
+
+    def count(self, tokens):
+        '''{signature: occurrences} in 'tokens' (overlapping ones included).'''
+        (goto, fail, outputs) = (self.goto, self.fail, self.outputs)
+        counts = [0] * len(self.names)
+        state = 0
+        for t in tokens:
+            while state and t not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(t, 0)
+            for index in outputs[state]:
+                counts[index] += 1
+        return dict(zip(self.names, counts))
+
+
+def scenario(counts, scenarios=SCENARIOS):
+    '''The name of the first scenario which 'counts' fit, or UNRECOGNIZED.'''
+    for (name, description, ranges) in scenarios:
+        if all(least <= counts[signature] and (most is None or counts[signature] <= most)
+               for (signature, (least, most)) in ranges.items()):
+            return name
+    return UNRECOGNIZED
+
+
+class BootResult:
+    '''The scenario of one capture, or the error which stopped its decode.'''
+
+    def __init__(self, path, scenario=None, counts=None, commands=0, error=None):
+        self.path = path
+        self.scenario = scenario
+        self.counts = counts         # {signature: occurrences}
+        self.commands = commands
+        self.error = error
+
+
+_matcher = None                      # built once per process
+
+
+def classify_capture(task):
+    '''
+    Decode the .dsl file of 'task' (path, settings) and classify it; the
+    settings are those of classify_library().  Returns a BootResult.
+    '''
+    global _matcher
+    (path, settings) = task
+    (chunk_samples, deglitch, deglitch_unit, cache_dir, cache_bytes) = settings
+    if _matcher is None:
+        _matcher = SignatureMatcher()
+    try:
+        if cache_dir:
+            (decoder, samplerate) = cached_decode(path, DecodeCache(cache_dir, cache_bytes),
+                                                  chunk_samples=chunk_samples, deglitch=deglitch,
+                                                  deglitch_unit=deglitch_unit)
+            tokens = list(transaction_tokens(decoder.transactions))
+        else:
+            # nothing but the commands is needed: no annotations, and no capture-long decoder
+            with DslCapture(path) as capture:
+                width = deglitch_samples(deglitch, deglitch_unit, capture.samplerate)
+                tokens = list(transaction_tokens(dsl_transactions(capture, width, chunk_samples)))
+    except (OSError, DslError, zipfile.BadZipFile, ValueError) as error:
+        return BootResult(path, error=str(error))
+    counts = _matcher.count(tokens)
+    return BootResult(path, scenario(counts), counts, len(tokens))
+
+
+def library_paths(paths):
+    '''The .dsl files given, and those in (or below) the folders given, in order.'''
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for (folder, folders, files) in os.walk(path):
+            folders.sort()
+            for name in sorted(files):
+                if name.endswith('.dsl'):
+                    yield os.path.join(folder, name)
+
+
+def classify_library(paths, jobs=None, chunk_samples=DEFAULT_CHUNK_SAMPLES, deglitch=2,
+                     deglitch_unit='samples', cache_dir=None, cache_bytes=DEFAULT_CACHE_BYTES):
+    '''
+    Classify each of the .dsl files 'paths', in a pool of 'jobs' processes
+    (default: one per CPU), one capture per process at a time.  With
+    'cache_dir', the decodes are kept in (and taken from) a DecodeCache
+    there.  Yields a BootResult per capture, in the order of 'paths'.
+    '''
+    jobs = jobs or os.cpu_count() or 1
+    settings = (chunk_samples, deglitch, deglitch_unit, cache_dir, cache_bytes)
+    tasks = ((path, settings) for path in paths)
+    if jobs <= 1:
+        yield from map(classify_capture, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(classify_capture, tasks)
+
+
+def format_results(results):
+    '''
+    One line per capture (its scenario, commands and signature counts),
+    then the number of captures of each scenario, as lines of text.
+    '''
+    lines = []
+    totals = dict((name, [0, description]) for (name, description, ranges) in SCENARIOS)
+    totals[UNRECOGNIZED] = [0, 'none of the above']
+    totals['error'] = [0, 'could not be decoded']
+    for result in results:
+        if result.error is not None:
+            lines.append('%-12s %s: %s' % ('error', result.path, result.error))
+            totals['error'][0] += 1
+            continue
+        counts = ', '.join('%s %d' % item for item in result.counts.items() if item[1])
+        lines.append('%-12s %s (%d commands%s)' % (result.scenario, result.path, result.commands,
+                                                   ': ' + counts if counts else ''))
+        totals[result.scenario][0] += 1
+    lines.append('')
+    lines.append('Scenarios:')
+    for (name, (count, description)) in totals.items():
+        if count or name != 'error':
+            lines.append('  %-12s %6d  %s' % (name, count, description))
+    return lines
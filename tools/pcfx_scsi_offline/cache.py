@@ -0,0 +1,310 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Persistent decode cache
+#
+# Decoding a capture again after changing an option, or from another
+# script, repeats work whose result is already known.  The decoded spans of
+# a capture are therefore kept on disk, keyed on everything they depend on:
+#
+#  - the sample blocks they cover: DSView stores each probe's samples in
+#    zip members of a fixed size ('L-n/b', see dsl.py), and the zip
+#    directory holds the CRC-32 and size of each, so the blocks are hashed
+#    without inflating anything;
+#  - the decoder options, deglitch width and sample rate, and a digest of
+#    the decoder's own source, so that a changed decoder never gets stale
+#    results;
+#  - the span's first and last sample, and the block length it starts with
+#    (see parallel.py).
+#
+# A capture is cut in the middle of the first free gap after every
+# SPAN_SAMPLES samples, so a cut only moves if the bus activity near it
+# changes.  Each span is decoded as a piece of a parallel decode and joined
+# the same way, whether it came from the cache or not; only the spans whose
+# blocks or options changed are decoded again.  A manifest, keyed on all
+# the blocks, lists the spans of the whole capture: when it is found, the
+# capture is not inflated at all.
+#
+# Entries are pickle files in one directory.  Once it grows past its size
+# limit, the least recently used entries are removed.
+#
+
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import pickle
+import struct
+
+import numpy as np
+
+from pcfx_scsi import cdrom, lists, scsi
+from pcfx_scsi.scsi import DEFAULT_BLOCK_LENGTH, deglitch_samples
+
+from . import engine, parallel
+from .dsl import DslCapture, DslError, DEFAULT_CHUNK_SAMPLES
+from .engine import Edges, OfflineDecoder
+from .parallel import piece_min_gap, free_gap_middles, span_arrays, decode_span, join_pieces
+
+CACHE_VERSION = 1
+SPAN_SAMPLES = 1 << 22               # samples between cuts (at least)
+DEFAULT_CACHE_BYTES = 1 << 30
+ENTRY_SUFFIX = '.pkl'
+
+_source_digest = None
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pcfx_scsi_offline')
+
+
+def source_digest():
+    # Digest of the code which produces the cached results
+    global _source_digest
+    if _source_digest is None:
+        digest = hashlib.blake2b(digest_size=16)
+        for module in (scsi, lists, cdrom, engine, parallel):
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        _source_digest = digest.digest()
+    return _source_digest
+
+
+def _key(*parts):
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class DecodeCache:
+    '''
+    A directory of cached decode results, of at most 'max_bytes' (the least
+    recently used entries are removed by evict()).
+    '''
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.loaded = 0              # entries found
+        self.stored = 0              # entries written
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError):
+            return None                          # damaged; overwritten when stored again
+        try:
+            os.utime(path)                       # recently used
+        except FileNotFoundError:
+            pass                                 # evicted by another process meanwhile
+        self.loaded += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())     # other processes may store the same entry
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.stored += 1
+
+    def evict(self):
+        '''Remove the least recently used entries until the directory is within its size limit.'''
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        total = sum(size for (mtime, size, path) in entries)
+        for (mtime, size, path) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class CaptureBlocks:
+    '''First sample and digest of each of a capture's DSView blocks, from the zip directory.'''
+
+    def __init__(self, capture):
+        self.starts = []
+        self.digests = []
+        start = 0
+        names = [capture.block_names(probe) for probe in capture.channel_probes]
+        for block in range(capture.num_blocks):
+            digest = hashlib.blake2b(digest_size=16)
+            for (bit, probe_names) in enumerate(names):
+                try:
+                    info = capture.zip.getinfo(probe_names[block])
+                except KeyError:
+                    raise DslError('Capture data for channel %s is missing' % bit)
+                digest.update(struct.pack('<IQ', info.CRC, info.file_size))
+            self.starts.append(start)
+            self.digests.append(digest.digest())
+            start += info.file_size * 8
+
+    def between(self, start, end):
+        '''Digests of the blocks holding samples start..end-1.'''
+        return self.digests[max(bisect_right(self.starts, start) - 1, 0):bisect_left(self.starts, end)]
+
+
+def span_cuts(edges, min_gap, span_samples=SPAN_SAMPLES):
+    '''
+    Sample numbers to cut the capture at: for every multiple of
+    'span_samples', the middle of the first free gap (see
+    free_gap_middles()) from there on.
+    '''
+    points = free_gap_middles(edges, min_gap)
+    chosen = np.searchsorted(points, np.arange(span_samples, edges.num_samples, span_samples))
+    return np.unique(points[chosen[chosen < len(points)]]).tolist()
+
+
+def cached_decode(path, cache, channel_map=None, chunk_samples=DEFAULT_CHUNK_SAMPLES,
+                  deglitch=2, deglitch_unit='samples', jobs=1, **options):
+    '''
+    Decode a .dsl file as run_dsl() does (in 'jobs' processes, as
+    parallel_decode()), taking all it can from 'cache' (a DecodeCache) and
+    storing the rest there.  'options' are passed on to OfflineDecoder; the
+    capture's sample rate is used for the timing checks.  Returns the
+    OfflineDecoder and the sample rate.
+    '''
+    with DslCapture(path, channel_map) as capture:
+        samplerate = capture.samplerate
+        width = deglitch_samples(deglitch, deglitch_unit, samplerate)
+        if options.get('timing') is not None:
+            options.setdefault('samplerate', samplerate)
+        blocks = CaptureBlocks(capture)
+        settings = json.dumps((CACHE_VERSION, source_digest().hex(), width, samplerate, options),
+                              sort_keys=True).encode()
+        manifest_key = _key(b'capture', settings, struct.pack('<q', capture.num_samples), *blocks.digests)
+        manifest = cache.get(manifest_key)
+        decoder = _load_manifest(cache, manifest, width, options) if manifest else None
+        if decoder is None:
+            edges = Edges.from_chunks(capture.iter_chunks(chunk_samples))
+            decoder = _decode_spans(cache, None if manifest else manifest_key, edges, blocks, settings,
+                                    width, jobs, options)
+    cache.evict()
+    return (decoder, samplerate)
+
+
+def _load_manifest(cache, manifest, deglitch, options):
+    # The whole decode from the cache, or None if any of its spans is missing
+    (bounds, keys, incoming, carried) = manifest
+    results = []
+    for key in keys:
+        result = cache.get(key)
+        if result is None:
+            return None
+        results.append(result)
+    decoder = OfflineDecoder(deglitch, **options)
+    join_pieces(decoder, bounds, results, incoming)
+    decoder.set_carried_state(carried)
+    return decoder
+
+
+def _decode_spans(cache, manifest_key, edges, blocks, settings, deglitch, jobs, options):
+    # As parallel_decode(), with the spans between stable cuts, each taken from
+    # the cache if it is there.  Only what is decoded here is put in the cache:
+    # the spans which were missing, and the manifest unless it was found (then
+    # 'manifest_key' is None; it only depends on what its key does).  The pool
+    # is only started once more than one span has to be decoded at a time.
+    decoder = OfflineDecoder(deglitch, **options)
+    bounds = [0] + span_cuts(edges, piece_min_gap(deglitch, options)) + [edges.num_samples]
+    # only 'per sector' grouping and the sector checks depend on the block length at the start
+    by_length = decoder.data_detail == 'per sector' or bool(decoder.sectors)
+
+    def span_key(index, block_length):
+        (start, end) = (bounds[index], bounds[index + 1])
+        return _key(b'span', settings, struct.pack('<qqI', start, end, block_length if by_length else 0),
+                    *blocks.between(start, end))
+
+    def fetch(indexes, block_lengths):
+        # (results, keys) of these spans, decoding those not in the cache
+        nonlocal pool
+        keys = [span_key(index, length) for (index, length) in zip(indexes, block_lengths)]
+        results = [cache.get(key) for key in keys]
+        missing = [n for (n, result) in enumerate(results) if result is None]
+        tasks = [(bounds[indexes[n]], bounds[indexes[n] + 1], span_arrays(edges, bounds[indexes[n]], bounds[indexes[n] + 1]),
+                  block_lengths[n], deglitch, options, bounds[indexes[n] + 1] == edges.num_samples)
+                 for n in missing]
+        if len(tasks) > 1 and jobs > 1:
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=jobs)
+            decoded = pool.map(decode_span, tasks)
+        else:
+            decoded = map(decode_span, tasks)
+        for (n, result) in zip(missing, decoded):
+            cache.put(keys[n], result)
+            results[n] = result
+        return (results, keys)
+
+    jobs = jobs or os.cpu_count() or 1
+    pool = None                      # started by fetch() if needed
+    try:
+        (results, keys) = fetch(range(len(bounds) - 1), [DEFAULT_BLOCK_LENGTH] * (len(bounds) - 1))
+        decoded_with = [DEFAULT_BLOCK_LENGTH] * len(results)
+
+        # Pass the carried state along, as parallel_decode() does
+        carried = decoder.carried_state()
+        incoming = []
+        index = 0
+        while index < len(results):
+            (annotations, transactions, state, leaves) = results[index]
+            if state != 'BUS FREE' and index + 1 < len(results):
+                # still in a transaction at the cut: join the next span to this one
+                del bounds[index + 1], results[index + 1], keys[index + 1], decoded_with[index + 1]
+                ((results[index],), (keys[index],)) = fetch([index], [carried[2]])
+                decoded_with[index] = carried[2]
+                continue
+            incoming.append(carried)
+            carried = tuple(carried[part] if leaves[part] is None else leaves[part] for part in range(3))
+            index += 1
+
+        if by_length:
+            redo = [i for i in range(len(results)) if decoded_with[i] != incoming[i][2]]
+            (redone, redone_keys) = fetch(redo, [incoming[i][2] for i in redo])
+            for (i, result, key) in zip(redo, redone, redone_keys):
+                (results[i], keys[i]) = (result, key)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    if manifest_key is not None:
+        cache.put(manifest_key, (bounds, keys, incoming, carried))
+    join_pieces(decoder, bounds, results, incoming)
+    decoder.set_carried_state(carried)
+    return decoder
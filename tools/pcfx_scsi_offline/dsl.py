@@ -0,0 +1,196 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Reader for DSView session files (.dsl)
+#
+# A .dsl file is a zip archive holding:
+#   header    - ini-style capture description (samplerate, probe names, ...)
+#   decoders  - JSON list of the protocol decoders stacked in the session,
+#               including the probe assigned to each decoder channel
+#   L-n/b     - logic data for probe 'n', block 'b'; one bit per sample,
+#               least significant bit first
+#
+
+import configparser
+import json
+import zipfile
+
+import numpy as np
+
+# Same order (and therefore the same bit positions) as Decoder.channels in pd.py
+CHANNEL_IDS = (
+    'scsi_d0', 'scsi_d1', 'scsi_d2', 'scsi_d3',
+    'scsi_d4', 'scsi_d5', 'scsi_d6', 'scsi_d7',
+    'scsi_sel', 'scsi_bsy', 'scsi_cd', 'scsi_io', 'scsi_msg', 'scsi_ack',
+)
+
+# Samples per chunk handed out by DslCapture.iter_chunks (2 MiB of words)
+DEFAULT_CHUNK_SAMPLES = 1 << 20
+
+# For each channel, the (shifted) sample values of the 8 bits of a data byte
+_BIT_TABLES = [((np.arange(256)[:, None] >> np.arange(8)) & 1).astype(np.uint16) << bit
+               for bit in range(len(CHANNEL_IDS))]
+
+_UNITS = {'hz': 1, 'khz': 1000, 'mhz': 1000000, 'ghz': 1000000000}
+
+
+class DslError(Exception):
+    pass
+
+
+def parse_samplerate(text):
+    parts = text.split()
+    if len(parts) == 1:
+        return int(float(parts[0]))
+    return int(float(parts[0]) * _UNITS[parts[1].lower()])
+
+
+class DslCapture:
+    '''An open .dsl file; channel data is only inflated on request.'''
+
+    def __init__(self, path, channel_map=None):
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        header = configparser.ConfigParser()
+        header.read_string(self.zip.read('header').decode('utf-8', 'replace'))
+        hdr = header['header']
+        self.samplerate = parse_samplerate(hdr['samplerate'])
+        self.num_samples = int(hdr['total samples'])
+        self.num_blocks = int(hdr.get('total blocks', '1'))
+        self.probes = [hdr.get('probe%d' % i, '') for i in range(int(hdr['total probes']))]
+        if channel_map is None:
+            channel_map = self._session_channel_map() or self._named_channel_map()
+        missing = [c for c in CHANNEL_IDS if c not in channel_map]
+        if missing:
+            raise DslError('No probe assigned to channel(s): ' + ', '.join(missing))
+        # probe index for each decoder channel, in CHANNEL_IDS order
+        self.channel_probes = tuple(int(channel_map[c]) for c in CHANNEL_IDS)
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _session_channel_map(self):
+        # Use the assignment saved with the PCFX SCSI decoder in the session, if any
+        try:
+            decoders = json.loads(self.zip.read('decoders'))
+        except (KeyError, ValueError):
+            return None
+        for dec in decoders:
+            if dec.get('id') == 'pcfx_scsi':
+                mapping = {}
+                for entry in dec.get('channel', []):
+                    mapping.update(entry)
+                return mapping
+        return None
+
+    def _named_channel_map(self):
+        # Fall back to probe names such as 'SCSI_D0' or '/SCSI_ACK'
+        mapping = {}
+        for index, name in enumerate(self.probes):
+            key = 'scsi_' + name.lstrip('/').lower().replace('scsi_', '')
+            if key in CHANNEL_IDS and key not in mapping:
+                mapping[key] = index
+        return mapping
+
+    def block_names(self, probe):
+        return ['L-%d/%d' % (probe, block) for block in range(self.num_blocks)]
+
+    def iter_chunks(self, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+        '''
+        Yield (first_sample, words) for consecutive, aligned pieces of the
+        capture; words holds one uint16 per sample, bit 'n' being decoder
+        channel 'n' (see CHANNEL_IDS).
+
+        Channel data is inflated straight from the zip members into buffers
+        which are allocated once and reused for every chunk, so memory use
+        only depends on chunk_samples, never on the length of the capture.
+        The yielded array is overwritten by the next chunk: copy it to keep it.
+        '''
+        if chunk_samples <= 0 or chunk_samples % 8:
+            raise ValueError('chunk_samples must be a positive multiple of 8')
+        streams = [_ChannelStream(self.zip, self.block_names(probe)) for probe in self.channel_probes]
+        raw = bytearray(chunk_samples // 8)
+        raw_array = np.frombuffer(raw, dtype=np.uint8)
+        bits = np.empty((chunk_samples // 8, 8), dtype=np.uint16)
+        words = np.empty(chunk_samples, dtype=np.uint16)
+        try:
+            offset = 0
+            while offset < self.num_samples:
+                count = min(chunk_samples, self.num_samples - offset)
+                nbytes = (count + 7) // 8
+                words[:count] = 0
+                for bit, stream in enumerate(streams):
+                    if stream.readinto(memoryview(raw)[:nbytes]) < nbytes:
+                        raise DslError('Capture data for channel %s is truncated' % CHANNEL_IDS[bit])
+                    np.take(_BIT_TABLES[bit], raw_array[:nbytes], axis=0, out=bits[:nbytes])
+                    words[:count] |= bits.reshape(-1)[:count]
+                yield offset, words[:count]
+                offset += count
+        finally:
+            for stream in streams:
+                stream.close()
+
+    def read_words(self, scratch=None, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+        '''
+        Inflate the whole capture into one uint16 per sample (see iter_chunks).
+        If 'scratch' names a file, the samples are written into it as a
+        memory-mapped array instead of being held in memory.
+        '''
+        if scratch is None:
+            words = np.empty(self.num_samples, dtype=np.uint16)
+        else:
+            words = np.memmap(scratch, dtype=np.uint16, mode='w+', shape=(self.num_samples,))
+        for offset, chunk in self.iter_chunks(chunk_samples):
+            words[offset:offset + len(chunk)] = chunk
+        return words
+
+
+class _ChannelStream:
+    '''Reads one probe's L-n/b blocks back to back, one block inflated at a time.'''
+
+    def __init__(self, archive, names):
+        self.archive = archive
+        self.names = list(names)
+        self.member = None
+
+    def readinto(self, buffer):
+        filled = 0
+        while filled < len(buffer):
+            if self.member is None:
+                if not self.names:
+                    break
+                self.member = self.archive.open(self.names.pop(0))
+            count = self.member.readinto(buffer[filled:])
+            if count == 0:
+                self.member.close()
+                self.member = None
+            filled += count
+        return filled
+
+    def close(self):
+        if self.member is not None:
+            self.member.close()
+            self.member = None
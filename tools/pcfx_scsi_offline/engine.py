@@ -0,0 +1,499 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Vectorized offline decode engine
+#
+# Decoder.decode() in pd.py lets the sigrok runtime scan every sample for
+# the next edge.  Here, the capture is packed into one uint16 word per sample
+# and all edges are found up front with NumPy.  The state machine from pd.py
+# is then replayed over the edges only, reproducing its wait() semantics
+# (including the deglitch filter in INFO XFER) so that both produce the same
+# annotations.
+#
+
+from bisect import bisect_left
+import gc
+
+import numpy as np
+
+from pcfx_scsi.scsi import subphase_label, command_annotation, command_label, \
+                           deglitch_samples, Deglitcher, data_group_texts, GROUP_PREVIEW_BYTES, \
+                           TransactionBuilder, TransactionStore, RepeatCollapser, repeat_texts, \
+                           AccessPattern, access_texts, TimingChecker
+from pcfx_scsi.cdrom import SectorValidator
+from pcfx_scsi.lists import BYTE_VALUE, LUN_LABEL, HEX_TEXT, byte_number_text
+
+from .dsl import DslCapture, DEFAULT_CHUNK_SAMPLES
+
+SEL = 1 << 8
+BSY = 1 << 9
+CD  = 1 << 10
+IO  = 1 << 11
+MSG = 1 << 12
+ACK = 1 << 13
+
+# INFO XFER waits on edges of CD, IO, MSG, ACK (match bits 0-3) and BSY (bit 4)
+INFO_LINES = CD | IO | MSG | ACK | BSY
+
+
+class Edges:
+    '''
+    Change points of a capture.  'samples' are the sample numbers where any
+    channel differs from the previous sample, 'words' the value at each of
+    them.  Only the edges each state can wait for are kept as lists, since
+    the state machine walks them one at a time.
+    '''
+
+    def __init__(self, words):
+        words = np.asarray(words, dtype=np.uint16)
+        samples = np.flatnonzero(words[1:] != words[:-1]) + 1
+        self._setup(len(words), int(words[0]) if len(words) else 0,
+                    samples, words[samples], words[samples - 1])
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        '''
+        Build the edges from (first_sample, words) chunks as produced by
+        DslCapture.iter_chunks, so the capture never has to be held in memory
+        at once; only its change points are kept.
+        '''
+        edges = cls.__new__(cls)
+        found = ([], [], [])
+        first_word = 0
+        previous = None
+        num_samples = 0
+        for offset, words in chunks:
+            if not len(words):
+                continue
+            if previous is None:
+                first_word = int(words[0])
+                previous = words[:1]
+            joined = np.concatenate((previous, words))
+            changed = np.flatnonzero(joined[1:] != joined[:-1])
+            found[0].append(changed + offset)
+            found[1].append(joined[changed + 1])
+            found[2].append(joined[changed])
+            previous = words[-1:].copy()
+            num_samples = offset + len(words)
+        if not found[0]:
+            found = ([np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.uint16)], [np.zeros(0, dtype=np.uint16)])
+        edges._setup(num_samples, first_word, *(np.concatenate(part) for part in found))
+        return edges
+
+    @classmethod
+    def from_arrays(cls, num_samples, first_word, samples, now, before):
+        '''Build the edges from change point arrays, as kept in 'arrays'.'''
+        edges = cls.__new__(cls)
+        edges._setup(num_samples, first_word, samples, now, before)
+        return edges
+
+    def _setup(self, num_samples, first_word, samples, now, before):
+        self.num_samples = num_samples
+        self.first_word = first_word
+        self.arrays = (samples, now, before)
+        fell = before & ~now
+        rose = now & ~before
+        self.samples = samples.tolist()
+        self.words = now.tolist()
+        self.sel_fall = samples[(fell & SEL) != 0].tolist()
+        self.sel_rise = samples[(rose & SEL) != 0].tolist()
+        self.bsy_fall = samples[(fell & BSY) != 0].tolist()
+
+        # Events seen by the INFO XFER waits, with the match bits they raise
+        changed = now ^ before
+        info = (changed & INFO_LINES) != 0
+        self.info_samples = samples[info].tolist()
+        self.info_words = now[info].tolist()
+        self.info_match = (((changed[info] >> 10) & 0xF) | (((changed[info] >> 9) & 1) << 4)).tolist()
+
+    def word_at(self, samplenum):
+        index = bisect_left(self.samples, samplenum + 1) - 1
+        return self.words[index] if index >= 0 else self.first_word
+
+
+class EndOfCapture(Exception):
+    pass
+
+
+class OfflineDecoder:
+    '''Replays the Decoder.decode() state machine over precomputed edges.'''
+
+    def __init__(self, deglitch=2, data_detail='per sector', group_bytes=256, timing=None, samplerate=None,
+                 sector_check=False):
+        self.deglitch = deglitch     # min. pulse width in samples, as Decoder's 'deglitch' option
+        self.data_detail = data_detail
+        self.group_bytes = max(int(group_bytes), 1)
+        self.reset()
+        if sector_check:
+            # as Decoder's 'sector_check' option
+            self.sectors = SectorValidator()
+        if timing is not None:
+            # limits by rule name in ns, as Decoder's 'timing_*' options
+            self.check_timing(timing, samplerate)
+
+    def reset(self):
+        self.state = 'BUS FREE'      # starting state for state machine
+        self.startsamplenum = 0      # detect start sample of overall phase
+        self.phasestartsample = 0    # detect start sample of suphasephase
+        self.datastartsample = 0     # detect start sample of data
+        self.datafound = 0           # Do not display subphases unless data was actually transferred within them
+        self.cmd_type = [ 100, 101 ]
+        self.dataval = 0
+        self.command_annote = 28
+        self.subphase = 0
+        self.deglitcher = Deglitcher(self.deglitch)
+        self.transaction = TransactionBuilder()
+        self.group_size = 0
+        self.group_count = 0
+        self.group_first = 0
+        self.group_preview = []
+        self.groupstartsample = 0
+        self.annotations = []
+        self.transactions = TransactionStore()     # Transaction records, as Decoder's OUTPUT_PYTHON
+        self.timing = None
+        self.sectors = None
+
+    def put(self, ss, es, ann, texts):
+        self.annotations.append((ss, es, ann, texts))
+
+    def decode(self, edges, start=0, final=True):
+        '''
+        Decode all edges (from sample 'start' onwards); returns the list of
+        (ss, es, ann, texts) annotations.  'final' is False if more samples
+        follow these (see finish()).
+        '''
+        self.edges = edges
+        self.pos = start             # first sample the next wait() may match
+        self.info_index = 0
+        # Annotations are millions of small, acyclic lists; keep the cyclic
+        # garbage collector from rescanning them while they are built.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            while True:
+                self.step()
+        except EndOfCapture:
+            if final:
+                self.finish()
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return self.annotations
+
+    def finish(self):
+        # End of the input, as in Decoder.decode(): the edges still pending in
+        # the deglitch filter take effect
+        if self.state == 'INFO XFER':
+            for (edgesample, lines, edgepins) in self.deglitcher.finish():
+                self._edge(edgesample, lines, edgepins)
+                if self.state != 'INFO XFER':
+                    break
+        self.deglitcher.reset()
+
+    def check_timing(self, limits, samplerate):
+        # As Decoder.check_timing(): from here on, _edge() also checks the edges
+        self.timing = TimingChecker(limits, samplerate)
+
+    def put_timing(self, violations):
+        for (ss, es, texts) in violations:
+            self.put(ss, es, 34, texts)
+
+    def put_bad_sectors(self, transaction):
+        annotation = self.sectors.annotation(transaction)
+        if annotation:
+            (ss, es, texts) = annotation
+            self.put(ss, es, 35, texts)
+
+    def carried_state(self):
+        # What the state machine keeps from one transaction to the next
+        return (self.startsamplenum, list(self.cmd_type), self.transaction.block_length)
+
+    def set_carried_state(self, carried):
+        (self.startsamplenum, cmd_type, self.transaction.block_length) = carried
+        self.cmd_type = list(cmd_type)
+
+    def _next(self, edge_list):
+        # wait() for a single edge condition; edges never match on sample 0
+        index = bisect_left(edge_list, max(self.pos, 1))
+        if index == len(edge_list):
+            raise EndOfCapture()
+        samplenum = edge_list[index]
+        self.pos = samplenum + 1
+        return samplenum
+
+    def step(self):
+        edges = self.edges
+
+        if self.state == 'BUS FREE':
+            samplenum = self._next(edges.sel_fall)
+            self.put(self.startsamplenum, samplenum, 0, ['Bus Free', 'Free', 'F'])
+            if self.timing:
+                self.put_timing(self.timing.selection_start(samplenum))
+            self.state = 'ARBITRATION'
+            self.startsamplenum = samplenum
+
+        if self.state == 'ARBITRATION':
+            samplenum = self._next(edges.bsy_fall)
+            word = edges.word_at(samplenum)
+            self.luns = LUN_LABEL[word & 0xFF]
+            self.transaction.start(self.startsamplenum, BYTE_VALUE[word & 0xFF], self.luns)
+            self.put(self.startsamplenum, samplenum, 1, ['Arbitration', 'Arb', 'A'])
+            self.put(self.startsamplenum, samplenum, 11, [self.luns])
+            if self.timing:
+                self.put_timing(self.timing.target_busy(samplenum))
+            self.state = 'SELECT'
+            self.startsamplenum = samplenum
+
+        if self.state == 'SELECT':
+            # pd.py reports the LUNs latched during arbitration here as well
+            samplenum = self._next(edges.sel_rise)
+            word = edges.word_at(samplenum)
+            self.put(self.startsamplenum, samplenum, 2, ['Selection', 'Sel', 'Se'])
+            self.put(self.startsamplenum, samplenum, 11, [self.luns])
+            if self.timing:
+                self.put_timing(self.timing.selection_end(samplenum))
+            self.state = 'INFO XFER'
+            self.startsamplenum = samplenum
+            self.datafound = 0
+            self.datastartsample = samplenum
+            self.subphase = _subphase(word)
+            self.group_size = self.data_group_size(self.subphase)
+            self.phasestartsample = samplenum
+            self.info_index = bisect_left(edges.info_samples, self.pos)
+            self.deglitcher.reset()
+            if word & BSY:
+                self.deglitcher.hold(4, samplenum, word)
+
+        if self.state == 'INFO XFER':
+            self._info_xfer()
+
+    def _info_xfer(self):
+        # Same waits as pd.py: any edge on CD/IO/MSG/ACK/BSY, plus the deadline
+        # of a pending BSY edge; edges take effect once deglitched
+        edges = self.edges
+        num_samples = edges.num_samples
+        info_samples = edges.info_samples
+        info_words = edges.info_words
+        info_match = edges.info_match
+        count = len(info_samples)
+        index = self.info_index
+        deglitcher = self.deglitcher
+
+        while self.state == 'INFO XFER':
+            bsy_deadline = deglitcher.deadline(4)
+            if index < count and (bsy_deadline is None or info_samples[index] <= bsy_deadline):
+                samplenum = info_samples[index]
+                toggled = info_match[index]
+                pins = info_words[index]
+                index += 1
+            elif bsy_deadline is not None and bsy_deadline < num_samples:
+                samplenum = bsy_deadline
+                toggled = 0
+                pins = None
+            else:
+                raise EndOfCapture()
+            self.pos = samplenum + 1
+            self.info_index = index
+
+            for (edgesample, lines, edgepins) in deglitcher.edges(samplenum, toggled, pins):
+                self._edge(edgesample, lines, edgepins)
+                if self.state != 'INFO XFER':
+                    deglitcher.reset()
+                    break
+
+    def _edge(self, samplenum, lines, pins):
+        # Decoder.info_edge(), with 'pins' as a packed word
+        if self.timing:
+            violations = self.timing.info_edge(samplenum, lines, pins & ACK, pins & BSY)
+            if violations:
+                self.put_timing(violations)
+
+        end_subphase = lines & 0b111
+
+        if lines & 0b1000:
+            if not (pins & ACK):                     # sample data on falling ACK
+                self.dataval = BYTE_VALUE[pins & 0xFF]
+            elif self.group_size:                    # rising ACK, grouped Data In/Out
+                self.transaction.byte(self.subphase, self.dataval)
+                if (self.group_count == 0):
+                    self.group_first = self.datafound
+                    self.groupstartsample = self.datastartsample
+                    self.group_preview = []
+                if (self.group_count < GROUP_PREVIEW_BYTES):
+                    self.group_preview.append(self.dataval)
+                self.group_count += 1
+                if (self.group_count == self.group_size):
+                    self.put_group(samplenum)
+                self.datafound += 1
+                self.datastartsample = samplenum
+            else:                                    # rising ACK means end of data pulse
+                self.transaction.byte(self.subphase, self.dataval)
+                if (self.subphase == 5):             # COMMAND
+                    if (self.datafound == 0):        # first byte of command
+                        self.command_annote = command_annotation(self.dataval)
+                        self.cmd_type.clear()
+                    self.cmd_type.append(self.dataval)
+                else:
+                    self.command_annote = 20
+
+                if (self.subphase & 1):
+                    self.put(self.datastartsample, samplenum, self.command_annote, HEX_TEXT[self.dataval])
+                else:
+                    self.put(self.datastartsample, samplenum, 29, HEX_TEXT[self.dataval])
+                self.put(self.datastartsample, samplenum, 30, byte_number_text(self.datafound))
+                self.datafound = self.datafound + 1
+                self.datastartsample = samplenum
+
+        if (lines & 0b10000) and (pins & BSY):       # High BSY means end of Information Transfer phase
+            self.put(self.startsamplenum, samplenum, 4, ['Information Transfer', 'Info Xfer', 'Inf'])
+            self.state = 'BUS FREE'
+            self.startsamplenum = samplenum
+            end_subphase = 1
+
+        if end_subphase:
+            if self.group_count > 0:
+                self.put_group(self.datastartsample)
+            if self.datafound > 0:
+                self.transaction.phase(self.subphase, self.phasestartsample, samplenum)
+                self.put(self.phasestartsample, samplenum, 12 + self.subphase, subphase_label(self.subphase))
+                if (self.subphase == 5):
+                    self.put(self.phasestartsample, samplenum, 31, command_label(self.cmd_type))
+            if self.state == 'BUS FREE':
+                transaction = self.transaction.finish(samplenum)
+                self.transactions.append(transaction)
+                if self.sectors:
+                    self.put_bad_sectors(transaction)
+            self.phasestartsample = samplenum
+            self.subphase = _subphase(pins)
+            self.group_size = self.data_group_size(self.subphase)
+            self.datafound = 0
+            self.datastartsample = samplenum
+
+    def data_group_size(self, subphase):
+        # Decoder.data_group_size()
+        if ((subphase & 0b110) != 0b110) or (self.data_detail == 'per byte'):
+            return 0
+        if (self.data_detail == 'per sector'):
+            return self.transaction.block_length
+        return self.group_bytes
+
+    def put_group(self, endsample):
+        (data_texts, range_texts) = data_group_texts(self.group_first, self.group_count, self.group_preview)
+        self.put(self.groupstartsample, endsample, 20 if (self.subphase & 1) else 29, data_texts)
+        self.put(self.groupstartsample, endsample, 30, range_texts)
+        self.group_count = 0
+
+
+def _subphase(word):
+    # (scsi_msg << 2) + (scsi_cd << 1) + scsi_io
+    return (((word >> 12) & 1) << 2) | (((word >> 10) & 1) << 1) | ((word >> 11) & 1)
+
+
+def transaction_units(annotations, transactions):
+    '''
+    Split the annotations of a decode by transaction: yields (transaction,
+    annotations) from each Bus Free annotation to the next, with None for
+    a transaction which was still in progress at the end of the capture.
+    '''
+    unit = []
+    index = 0
+    for annotation in annotations:
+        if annotation[2] == 0 and unit:
+            yield (transactions[index], unit)
+            index += 1
+            unit = []
+        unit.append(annotation)
+    if unit:
+        yield (transactions[index] if index < len(transactions) else None, unit)
+
+
+def add_access_annotations(annotations, transactions):
+    '''
+    The annotations with Decoder.decode()'s Access row (class 33, see
+    AccessPattern) added, which an OfflineDecoder leaves out: the access of
+    a command depends on all commands before it, so pieces of a capture
+    could not be decoded on their own.
+    '''
+    pattern = AccessPattern()
+    out = []
+    for (transaction, unit) in transaction_units(annotations, transactions):
+        out.extend(unit)
+        access = pattern.add(transaction) if transaction is not None else None
+        if access:
+            out.append((access.startsample, access.endsample, 33, access_texts(access)))
+    return out
+
+
+def collapse_repeats(annotations, transactions):
+    '''
+    The annotations of Decoder.decode() with the 'repeats' option set to
+    'collapse', from those of an OfflineDecoder (which are always expanded).
+    Each transaction's annotations start at the Bus Free annotation before it.
+    Timing violations (class 34) are never held back.
+    '''
+    collapser = RepeatCollapser(lambda ss, es, count, transactions: (ss, es, 32, repeat_texts(count, transactions)))
+    out = []
+    trailing = []
+    for (transaction, unit) in transaction_units(annotations, transactions):
+        out.extend(annotation for annotation in unit if annotation[2] == 34)
+        unit = [annotation for annotation in unit if annotation[2] != 34]
+        if transaction is None:
+            trailing = unit
+        else:
+            out.extend(collapser.add(transaction, unit))
+    out.extend(collapser.finish())
+    out.extend(trailing)
+    return out
+
+
+def decode_words(words, deglitch=2, **options):
+    '''
+    Decode a packed capture (see DslCapture.read_words) into annotations.
+    'options' are passed on to OfflineDecoder (data_detail, group_bytes).
+    '''
+    return OfflineDecoder(deglitch, **options).decode(Edges(words))
+
+
+def decode_dsl(path, channel_map=None, chunk_samples=DEFAULT_CHUNK_SAMPLES,
+               deglitch=2, deglitch_unit='samples', **options):
+    '''Decode a .dsl file, streaming its sample blocks (see DslCapture.iter_chunks).'''
+    return run_dsl(path, channel_map, chunk_samples, deglitch, deglitch_unit, **options).annotations
+
+
+def run_dsl(path, channel_map=None, chunk_samples=DEFAULT_CHUNK_SAMPLES,
+            deglitch=2, deglitch_unit='samples', **options):
+    '''
+    As decode_dsl(), but returns the OfflineDecoder (annotations and
+    transactions).  The capture's sample rate is used for the timing checks.
+    '''
+    (edges, width, samplerate) = load_edges(path, channel_map, chunk_samples, deglitch, deglitch_unit)
+    if options.get('timing') is not None:
+        options.setdefault('samplerate', samplerate)
+    decoder = OfflineDecoder(width, **options)
+    decoder.decode(edges)
+    return decoder
+
+
+def load_edges(path, channel_map=None, chunk_samples=DEFAULT_CHUNK_SAMPLES, deglitch=2, deglitch_unit='samples'):
+    '''The Edges of a .dsl file, the deglitch width in samples, and the sample rate.'''
+    with DslCapture(path, channel_map) as capture:
+        width = deglitch_samples(deglitch, deglitch_unit, capture.samplerate)
+        edges = Edges.from_chunks(capture.iter_chunks(chunk_samples))
+    return (edges, width, capture.samplerate)
@@ -0,0 +1,320 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Transaction export (CSV, JSON Lines, binary columns)
+#
+# One record per transaction (see FIELDS): the command and its fields as
+# in the command label, disc address, status, the CRC-32 of the Data In and
+# Data Out bytes, the phases and the timings of transaction_metrics().  Two
+# boot sequences can then be compared with an ordinary diff.
+#
+# An exporter takes transactions one at a time and writes them out in
+# batches of BATCH_ROWS, so only one batch is held at a time.  The host gap
+# of a transaction is only known once the next one starts, so each record
+# is written one transaction late.  export_dsl() decodes a capture one
+# chunk at a time with StreamDecoder, so memory use stays the same however
+# long the capture is.
+#
+# The binary format holds the numeric fields only, in fixed-width columns:
+#   header    - COLUMNS_HEADER: magic, version and the length of a JSON
+#               description (sample rate, and the name, dtype and shape of
+#               every column)
+#   batches   - the number of rows (uint32), then the values of each column
+#               for those rows, one column after another
+# read_columns() loads it back into one NumPy array per column.
+#
+
+import csv
+import io
+import json
+import struct
+import zlib
+
+import numpy as np
+
+from pcfx_scsi.scsi import COMMANDS, command_text, command_address, subphase_label, \
+                           transaction_metrics, host_gap, deglitch_samples
+
+from .dsl import DslCapture, DEFAULT_CHUNK_SAMPLES
+from .index import PHASE_SLOTS
+from .stream import dsl_transactions
+
+BATCH_ROWS = 4096                    # records written at a time
+
+FIELDS = ('startsample', 'endsample', 'ids', 'luns', 'opcode', 'command', 'fields', 'cdb', 'lba', 'blocks',
+          'status', 'block_length', 'data_in_length', 'data_in_crc32', 'data_out_length', 'data_out_crc32',
+          'msg_in', 'msg_out', 'phases', 'latency', 'data_time', 'data_rate', 'ack_cycle', 'host_gap')
+
+COLUMNS_MAGIC = b'PCFXSCOL'
+COLUMNS_VERSION = 1
+COLUMNS_HEADER = struct.Struct('<8sII')
+BATCH_HEADER = struct.Struct('<I')
+MAX_CDB = 12                         # command bytes kept in the binary format
+
+# (name, dtype, shape) of the binary columns; -1 (or NaN) where FIELDS has None, except that
+# 'lba' is only valid where 'blocks' is not -1
+COLUMNS = (
+    ('startsample',     '<i8', ()),
+    ('endsample',       '<i8', ()),
+    ('ids',             'u1',  ()),
+    ('opcode',          '<i2', ()),
+    ('cdb_length',      'u1',  ()),
+    ('cdb',             'u1',  (MAX_CDB,)),
+    ('lba',             '<i8', ()),
+    ('blocks',          '<i8', ()),
+    ('status',          '<i2', ()),
+    ('block_length',    '<u4', ()),
+    ('data_in_length',  '<i8', ()),
+    ('data_in_crc32',   '<u4', ()),
+    ('data_out_length', '<i8', ()),
+    ('data_out_crc32',  '<u4', ()),
+    ('phase_start',     '<i8', (len(PHASE_SLOTS),)),    # of each subphase in PHASE_SLOTS order
+    ('phase_end',       '<i8', (len(PHASE_SLOTS),)),
+    ('latency',         '<f8', ()),
+    ('data_time',       '<f8', ()),
+    ('data_rate',       '<f8', ()),
+    ('ack_cycle',       '<f8', ()),
+    ('host_gap',        '<f8', ()),
+)
+
+
+class ExportFileError(Exception):
+    pass
+
+
+_SLOT = {subphase: slot for (slot, subphase) in enumerate(PHASE_SLOTS)}
+
+
+def _phase_label(subphase):
+    return subphase_label(subphase)[2]
+
+
+def _crc(data):
+    return None if data is None else zlib.crc32(data)
+
+
+def transaction_record(t, samplerate=None):
+    '''
+    The FIELDS of a Transaction as a dict; 'host_gap' is None (see
+    TransactionExporter), as are the timings if 'samplerate' is not known.
+    '''
+    address = command_address(t.cdb)
+    record = {
+        'startsample': t.startsample,
+        'endsample': t.endsample,
+        'ids': t.ids,
+        'luns': t.luns,
+        'opcode': t.cdb[0] if t.cdb else None,
+        'command': COMMANDS[t.cdb[0]][0] if t.cdb and t.cdb[0] in COMMANDS else None,
+        'fields': command_text(t.cdb) if t.cdb else None,
+        'cdb': bytes(t.cdb).hex(),
+        'lba': address[0] if address else None,
+        'blocks': address[1] if address else None,
+        'status': t.status,
+        'block_length': t.block_length,
+        'data_in_length': None if t.data_in is None else len(t.data_in),
+        'data_in_crc32': _crc(t.data_in),
+        'data_out_length': None if t.data_out is None else len(t.data_out),
+        'data_out_crc32': _crc(t.data_out),
+        'msg_in': bytes(t.msg_in).hex(),
+        'msg_out': bytes(t.msg_out).hex(),
+        'phases': list(t.phases),
+        'host_gap': None,
+    }
+    if samplerate:
+        record.update(transaction_metrics(t, samplerate))
+    else:
+        record.update(dict.fromkeys(('latency', 'data_time', 'data_rate', 'ack_cycle')))
+    return record
+
+
+class TransactionExporter:
+    '''
+    Writes the record of each transaction given to add() to 'out', a batch
+    at a time: 'formatter(records, out)' writes a list of records, after
+    'header' (if any) at the start.  close() writes the last record and any
+    batch still held.  See EXPORT_FORMATS and new_exporter().
+    '''
+
+    def __init__(self, out, formatter, header=None, samplerate=None):
+        self.out = out
+        self.formatter = formatter
+        self.samplerate = samplerate
+        self.records = []            # the batch held
+        self.last = None             # transaction of 'pending'
+        self.pending = None          # record waiting for its host gap
+        self.count = 0
+        if header:
+            out.write(header)
+
+    def add(self, t):
+        if self.pending is not None:
+            if self.samplerate:
+                self.pending['host_gap'] = host_gap(self.last, t.startsample, self.samplerate)
+            self._write_record()
+        self.last = t
+        self.pending = transaction_record(t, self.samplerate)
+
+    def close(self):
+        if self.pending is not None:
+            self._write_record()
+            self.pending = self.last = None
+        self.flush()
+
+    def flush(self):
+        if self.records:
+            self.formatter(self.records, self.out)
+            self.records = []
+
+    def _write_record(self):
+        self.records.append(self.pending)
+        self.count += 1
+        if len(self.records) == BATCH_ROWS:
+            self.flush()
+
+
+def csv_header(samplerate):
+    return ','.join(FIELDS) + '\n'
+
+
+def write_csv(records, out):
+    '''FIELDS as CSV columns; the phases as 'C:ss-es DI:ss-es ...', hex CRCs.'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for record in records:
+        record['phases'] = ' '.join('%s:%d-%d' % (_phase_label(subphase), ss, es)
+                                    for (subphase, ss, es) in record['phases'])
+        for name in ('data_in_crc32', 'data_out_crc32'):
+            if record[name] is not None:
+                record[name] = '%08x' % record[name]
+        writer.writerow(['' if record[name] is None else record[name] for name in FIELDS])
+    out.write(buffer.getvalue())
+
+
+def write_json_lines(records, out):
+    '''One JSON object per line, with the FIELDS in order; the phases as [label, ss, es], null for None.'''
+    lines = []
+    for record in records:
+        record['phases'] = [(_phase_label(subphase), ss, es) for (subphase, ss, es) in record['phases']]
+        lines.append(json.dumps({name: record[name] for name in FIELDS}, separators=(',', ':')))
+    lines.append('')
+    out.write('\n'.join(lines))
+
+
+def columns_header(samplerate):
+    description = json.dumps({'samplerate': samplerate,
+                              'columns': [[name, dtype, list(shape)] for (name, dtype, shape) in COLUMNS]})
+    description = description.encode('utf-8')
+    return COLUMNS_HEADER.pack(COLUMNS_MAGIC, COLUMNS_VERSION, len(description)) + description
+
+
+def write_columns(records, out):
+    '''The COLUMNS of a batch of records (see read_columns).'''
+    rows = len(records)
+    columns = {name: np.empty((rows,) + shape, dtype=dtype) for (name, dtype, shape) in COLUMNS}
+    for (row, record) in enumerate(records):
+        for name in ('startsample', 'endsample', 'ids', 'block_length'):
+            columns[name][row] = record[name]
+        for name in ('opcode', 'lba', 'blocks', 'status', 'data_in_length', 'data_out_length'):
+            columns[name][row] = -1 if record[name] is None else record[name]
+        for name in ('data_in_crc32', 'data_out_crc32'):
+            columns[name][row] = record[name] or 0
+        for name in ('latency', 'data_time', 'data_rate', 'ack_cycle', 'host_gap'):
+            columns[name][row] = np.nan if record[name] is None else record[name]
+        cdb = bytes.fromhex(record['cdb'])[:MAX_CDB]
+        columns['cdb_length'][row] = len(cdb)
+        columns['cdb'][row] = 0
+        columns['cdb'][row, :len(cdb)] = np.frombuffer(cdb, dtype=np.uint8)
+        columns['phase_start'][row] = -1
+        columns['phase_end'][row] = -1
+        for (subphase, ss, es) in record['phases']:
+            slot = _SLOT[subphase]
+            if columns['phase_start'][row, slot] < 0:
+                columns['phase_start'][row, slot] = ss
+            columns['phase_end'][row, slot] = es
+    out.write(BATCH_HEADER.pack(rows))
+    for (name, dtype, shape) in COLUMNS:
+        out.write(columns[name].tobytes())
+
+
+# format name -> (header (of the sample rate) or None, formatter, file name extension, binary file)
+EXPORT_FORMATS = {
+    'csv': (csv_header, write_csv, '.csv', False),
+    'jsonl': (None, write_json_lines, '.jsonl', False),
+    'columns': (columns_header, write_columns, '.cols', True),
+}
+
+
+def new_exporter(out, export_format='csv', samplerate=None):
+    '''A TransactionExporter of 'export_format' to the file 'out'.'''
+    (header, formatter, extension, binary) = EXPORT_FORMATS[export_format]
+    return TransactionExporter(out, formatter, header(samplerate) if header else None, samplerate)
+
+
+def export_transactions(transactions, out, export_format='csv', samplerate=None):
+    '''Write the records of 'transactions' to the file 'out'; returns their number.'''
+    exporter = new_exporter(out, export_format, samplerate)
+    for t in transactions:
+        exporter.add(t)
+    exporter.close()
+    return exporter.count
+
+
+def export_dsl(path, out, export_format='csv', channel_map=None, chunk_samples=DEFAULT_CHUNK_SAMPLES,
+               deglitch=2, deglitch_unit='samples', **options):
+    '''Decode the .dsl file at 'path' and export its transactions to 'out'; returns their number.'''
+    with DslCapture(path, channel_map) as capture:
+        width = deglitch_samples(deglitch, deglitch_unit, capture.samplerate)
+        return export_transactions(dsl_transactions(capture, width, chunk_samples, **options),
+                                   out, export_format, capture.samplerate)
+
+
+def read_columns(path):
+    '''
+    Load a binary export: returns (sample rate, {column name: NumPy array}),
+    the columns as in COLUMNS.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < COLUMNS_HEADER.size:
+        raise ExportFileError('%s: too short for a transaction export' % path)
+    (magic, version, length) = COLUMNS_HEADER.unpack_from(data)
+    if magic != COLUMNS_MAGIC:
+        raise ExportFileError('%s: not a transaction export' % path)
+    if version != COLUMNS_VERSION:
+        raise ExportFileError('%s: unsupported version %d' % (path, version))
+    position = COLUMNS_HEADER.size + length
+    description = json.loads(data[COLUMNS_HEADER.size:position].decode('utf-8'))
+    columns = [(name, np.dtype(dtype), tuple(shape)) for (name, dtype, shape) in description['columns']]
+    parts = {name: [] for (name, dtype, shape) in columns}
+    try:
+        while position < len(data):
+            (rows,) = BATCH_HEADER.unpack_from(data, position)
+            position += BATCH_HEADER.size
+            for (name, dtype, shape) in columns:
+                count = rows * int(np.prod(shape, dtype=np.int64))
+                parts[name].append(np.frombuffer(data, dtype=dtype, count=count, offset=position)
+                                   .reshape((rows,) + shape))
+                position += count * dtype.itemsize
+    except (struct.error, ValueError):
+        raise ExportFileError('%s: truncated' % path)
+    return (description['samplerate'],
+            {name: (np.concatenate(parts[name]) if parts[name] else np.empty((0,) + shape, dtype=dtype))
+             for (name, dtype, shape) in columns})
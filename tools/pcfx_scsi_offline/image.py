@@ -0,0 +1,155 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Disc image from the sectors read
+#
+# Every block of Data In returned for a READ command (see read_sectors in
+# scsi.py) is written to a file at lba * sector length, so the file is a
+# sparse image of the disc holding just the sectors the capture saw.  Runs
+# of consecutive sectors are gathered into one preallocated buffer and
+# written with a single call.  The same sectors can instead be compared with
+# an existing image (an ISO build, for example).
+#
+
+import os
+import zlib
+
+from pcfx_scsi.scsi import read_sectors
+
+DEFAULT_SECTOR_LENGTH = 2048
+BATCH_SECTORS = 64                   # sectors gathered before a write
+
+
+class SectorStats:
+    '''Counts of an export or a comparison.'''
+
+    def __init__(self):
+        self.sectors = 0             # sectors written or compared
+        self.skipped = 0             # of another length than the image's (a different MODE SELECT)
+        self.before_start = 0        # before LBA 0 (MSF addresses under 00:02:00), not in the image
+        self.conflicts = []          # LBAs read again with different contents
+        self.mismatches = []         # LBAs which differ from the image compared with
+        self.missing = []            # LBAs beyond the end of the image compared with
+
+
+class _Batch:
+    # Consecutive sectors waiting to be written
+    def __init__(self, image, sector_length):
+        self.image = image
+        self.sector_length = sector_length
+        self.buffer = bytearray(BATCH_SECTORS * sector_length)
+        self.view = memoryview(self.buffer)
+        self.first = None
+        self.count = 0
+
+    def add(self, lba, sector):
+        if self.count and (lba != self.first + self.count or self.count == BATCH_SECTORS):
+            self.flush()
+        if not self.count:
+            self.first = lba
+        offset = self.count * self.sector_length
+        self.view[offset:offset + self.sector_length] = sector
+        self.count += 1
+
+    def flush(self):
+        if self.count:
+            self.image.seek(self.first * self.sector_length)
+            self.image.write(self.view[:self.count * self.sector_length])
+            self.count = 0
+
+
+def _sectors(transactions, sector_length, stats):
+    # (lba, sector) of each complete sector of the image's length from LBA 0 on, in
+    # capture order; a sector read again with other contents is counted as a conflict
+    crcs = {}
+    for transaction in transactions:
+        for (lba, sector) in read_sectors(transaction):
+            if len(sector) != sector_length:
+                stats.skipped += 1
+                continue
+            if lba < 0:
+                stats.before_start += 1
+                continue
+            crc = zlib.crc32(sector)
+            if crcs.setdefault(lba, crc) != crc:
+                stats.conflicts.append(lba)
+                crcs[lba] = crc
+            yield (lba, sector)
+
+
+def write_image(path, transactions, sector_length=DEFAULT_SECTOR_LENGTH):
+    '''
+    Write the sectors read by 'transactions' to a sparse image at 'path'
+    (created, or updated if it exists); a sector read more than once keeps
+    its last contents.  Returns a SectorStats.
+    '''
+    stats = SectorStats()
+    mode = 'r+b' if os.path.exists(path) else 'wb'
+    with open(path, mode) as image:
+        batch = _Batch(image, sector_length)
+        end = 0
+        for (lba, sector) in _sectors(transactions, sector_length, stats):
+            batch.add(lba, sector)
+            stats.sectors += 1
+            end = max(end, (lba + 1) * sector_length)
+        batch.flush()
+        # unread sectors after the last one written are left as a hole, too
+        image.seek(0, os.SEEK_END)
+        if image.tell() < end:
+            image.truncate(end)
+    return stats
+
+
+def compare_image(path, transactions, sector_length=DEFAULT_SECTOR_LENGTH):
+    '''Compare the sectors read by 'transactions' with the image at 'path'; returns a SectorStats.'''
+    stats = SectorStats()
+    expected = bytearray(sector_length)
+    with open(path, 'rb') as image:
+        size = os.fstat(image.fileno()).st_size
+        for (lba, sector) in _sectors(transactions, sector_length, stats):
+            stats.sectors += 1
+            if (lba + 1) * sector_length > size:
+                stats.missing.append(lba)
+                continue
+            image.seek(lba * sector_length)
+            image.readinto(expected)
+            if expected != sector:
+                stats.mismatches.append(lba)
+    return stats
+
+
+def _lba_list(lbas, limit=8):
+    text = ', '.join('0x%06X' % lba for lba in lbas[:limit])
+    return text + (', ...' if len(lbas) > limit else '')
+
+
+def format_stats(stats, action):
+    lines = ['%d sectors %s' % (stats.sectors, action)]
+    if stats.skipped:
+        lines.append('  %d sectors of another length skipped' % stats.skipped)
+    if stats.before_start:
+        lines.append('  %d sectors before LBA 0 skipped' % stats.before_start)
+    if stats.conflicts:
+        lines.append('  %d re-read with different contents: %s' % (len(stats.conflicts), _lba_list(stats.conflicts)))
+    if stats.missing:
+        lines.append('  %d beyond the end of the image: %s' % (len(stats.missing), _lba_list(stats.missing)))
+    if stats.mismatches:
+        lines.append('  %d differ from the image: %s' % (len(stats.mismatches), _lba_list(stats.mismatches)))
+    return lines
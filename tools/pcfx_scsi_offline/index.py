@@ -0,0 +1,235 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Transaction index sidecar (.idx)
+#
+# One fixed-width row per decoded transaction (see INDEX_DTYPE), sorted by
+# start sample, followed by the row numbers of the transactions which have a
+# disc address, sorted by LBA.  The file is memory-mapped when opened, so
+# "which command was active at sample N" and "which commands touched LBAs
+# X-Y" are answered by binary search without decoding the capture again.
+#
+# File layout (little-endian):
+#   header    - INDEX_HEADER: magic, version, number of rows, number of
+#               LBA-sorted rows, largest block count, and the size and
+#               modification time of the capture it was made from
+#   rows      - INDEX_DTYPE * rows
+#   by_lba    - int32 * LBA-sorted rows
+#
+
+import os
+import struct
+
+import numpy as np
+
+from pcfx_scsi.scsi import command_address, command_label
+
+INDEX_MAGIC = b'PCFXSIDX'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<8sIIIIqq')
+
+# Subphases in the order of the phase_start/phase_end columns:
+# Command, Data In, Data Out, Status, Message In, Message Out
+PHASE_SLOTS = (5, 6, 7, 4, 0, 1)
+_SLOT = {subphase: slot for (slot, subphase) in enumerate(PHASE_SLOTS)}
+
+# flags
+HAS_STATUS = 0x01
+HAS_ADDRESS = 0x02
+
+INDEX_DTYPE = np.dtype([
+    ('startsample', '<i8'),
+    ('endsample',   '<i8'),
+    ('lba',         '<i4'),          # see command_address(); 0 without HAS_ADDRESS
+    ('blocks',      '<u4'),
+    ('data_length', '<u4'),          # Data In + Data Out bytes transferred
+    ('opcode',      'u1'),
+    ('status',      'u1'),
+    ('flags',       'u1'),
+    ('ids',         'u1'),
+    ('cdb_length',  'u1'),           # command bytes received (up to 12 are kept)
+    ('cdb',         'u1', (12,)),
+    ('phase_start', '<i8', (len(PHASE_SLOTS),)),     # -1 if the phase did not occur
+    ('phase_end',   '<i8', (len(PHASE_SLOTS),)),
+])
+
+
+class IndexFileError(Exception):
+    pass
+
+
+def index_path(capture_path):
+    return capture_path + '.idx'
+
+
+def _capture_stamp(capture_path):
+    if capture_path is None:
+        return (0, 0)
+    st = os.stat(capture_path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def build_rows(transactions):
+    '''Index rows (sorted by start sample) for a list of Transaction records.'''
+    rows = np.zeros(len(transactions), dtype=INDEX_DTYPE)
+    rows['phase_start'] = -1
+    rows['phase_end'] = -1
+    for (row, t) in zip(rows, transactions):
+        row['startsample'] = t.startsample
+        row['endsample'] = t.endsample
+        row['ids'] = t.ids
+        flags = 0
+        if t.cdb:
+            row['opcode'] = t.cdb[0]
+            cdb = t.cdb[:12]
+            row['cdb_length'] = len(cdb)
+            row['cdb'][:len(cdb)] = np.frombuffer(cdb, dtype=np.uint8)
+            address = command_address(t.cdb)
+            if address is not None and 0 <= address[0] < (1 << 31):
+                row['lba'], row['blocks'] = address
+                flags |= HAS_ADDRESS
+        if t.status is not None:
+            row['status'] = t.status
+            flags |= HAS_STATUS
+        row['flags'] = flags
+        row['data_length'] = (len(t.data_in) if t.data_in is not None else 0) + \
+                             (len(t.data_out) if t.data_out is not None else 0)
+        for (subphase, ss, es) in t.phases:
+            slot = _SLOT[subphase]
+            if row['phase_start'][slot] < 0:
+                row['phase_start'][slot] = ss
+            row['phase_end'][slot] = es
+    order = np.argsort(rows['startsample'], kind='stable')
+    return rows[order]
+
+
+def _lba_order(rows):
+    with_address = np.flatnonzero(rows['flags'] & HAS_ADDRESS)
+    return with_address[np.argsort(rows['lba'][with_address], kind='stable')].astype('<i4')
+
+
+def write_index(path, transactions, capture_path=None):
+    '''
+    Write the index of 'transactions' to 'path'.  If 'capture_path' is given,
+    its size and modification time are stored, so that TransactionIndex.open()
+    can tell when the index is out of date.
+    '''
+    rows = build_rows(transactions)
+    by_lba = _lba_order(rows)
+    max_blocks = int(rows['blocks'][by_lba].max()) if len(by_lba) else 0
+    size, mtime = _capture_stamp(capture_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(rows), len(by_lba), max_blocks, size, mtime))
+        f.write(rows.tobytes())
+        f.write(by_lba.tobytes())
+    os.replace(tmp_path, path)
+
+
+class TransactionIndex:
+    '''
+    A transaction index, opened read-only (memory-mapped).  Queries return
+    arrays of INDEX_DTYPE rows, in sample order.
+    '''
+
+    def __init__(self, rows, by_lba, max_blocks):
+        self.rows = rows
+        self.by_lba = by_lba
+        self.max_blocks = max_blocks
+        self._starts = rows['startsample']
+        self._lbas = rows['lba'][by_lba]
+
+    @classmethod
+    def from_transactions(cls, transactions):
+        rows = build_rows(transactions)
+        by_lba = _lba_order(rows)
+        return cls(rows, by_lba, int(rows['blocks'][by_lba].max()) if len(by_lba) else 0)
+
+    @classmethod
+    def open(cls, path, capture_path=None):
+        '''
+        Open an index file.  With 'capture_path', IndexFileError is raised if
+        the index was made from a different version of the capture.
+        '''
+        with open(path, 'rb') as f:
+            header = f.read(INDEX_HEADER.size)
+        if len(header) < INDEX_HEADER.size:
+            raise IndexFileError('%s: not a transaction index' % path)
+        (magic, version, num_rows, num_lba, max_blocks, size, mtime) = INDEX_HEADER.unpack(header)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise IndexFileError('%s: not a transaction index (or version %d)' % (path, version))
+        if capture_path is not None and (size, mtime) != _capture_stamp(capture_path):
+            raise IndexFileError('%s: out of date for %s' % (path, capture_path))
+        if os.path.getsize(path) != INDEX_HEADER.size + num_rows * INDEX_DTYPE.itemsize + num_lba * 4:
+            raise IndexFileError('%s: truncated' % path)
+        if num_rows == 0:
+            return cls(np.zeros(0, dtype=INDEX_DTYPE), np.zeros(0, dtype='<i4'), 0)
+        rows = np.memmap(path, dtype=INDEX_DTYPE, mode='r', offset=INDEX_HEADER.size, shape=(num_rows,))
+        if num_lba:
+            by_lba = np.memmap(path, dtype='<i4', mode='r', shape=(num_lba,),
+                               offset=INDEX_HEADER.size + num_rows * INDEX_DTYPE.itemsize)
+        else:
+            by_lba = np.zeros(0, dtype='<i4')
+        return cls(rows, by_lba, max_blocks)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def at_sample(self, samplenum):
+        '''The transaction in progress at 'samplenum' (a row), or None.'''
+        i = int(np.searchsorted(self._starts, samplenum, side='right')) - 1
+        if i >= 0 and samplenum <= self.rows['endsample'][i]:
+            return self.rows[i]
+        return None
+
+    def between(self, startsample, endsample):
+        '''Transactions which overlap samples 'startsample' to 'endsample'.'''
+        hi = int(np.searchsorted(self._starts, endsample, side='right'))
+        lo = int(np.searchsorted(self._starts, startsample, side='right')) - 1
+        lo = max(lo, 0)
+        rows = self.rows[lo:hi]
+        return rows[rows['endsample'] >= startsample]
+
+    def lba_range(self, first, last=None):
+        '''
+        Commands whose address range touches LBAs 'first' to 'last'.  A
+        command with 0 blocks (i.e. SEEK) touches only its own LBA.
+        '''
+        if last is None:
+            last = first
+        # Only addresses from first - max_blocks + 1 onwards can reach 'first'
+        lo = int(np.searchsorted(self._lbas, first - max(self.max_blocks, 1) + 1, side='left'))
+        hi = int(np.searchsorted(self._lbas, last, side='right'))
+        candidates = np.asarray(self.by_lba[lo:hi])
+        ends = self._lbas[lo:hi].astype(np.int64) + np.maximum(self.rows['blocks'][candidates], 1) - 1
+        return self.rows[np.sort(candidates[ends >= first])]
+
+
+def row_text(row):
+    '''One line of text for an index row, with the command label.'''
+    cdb = bytes(row['cdb'][:row['cdb_length']])
+    if not cdb:
+        return '%d-%d (no command)' % (row['startsample'], row['endsample'])
+    if not row['flags'] & HAS_STATUS:
+        status = 'no status'
+    else:
+        status = 'status 0x%02X' % row['status']
+    return '%d-%d %s, %s, %d bytes' % (row['startsample'], row['endsample'],
+                                      command_label(cdb)[0], status, row['data_length'])
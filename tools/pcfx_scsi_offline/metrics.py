@@ -0,0 +1,156 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# End-of-capture timing summary
+#
+# The per-command metrics which the decoder puts on OUTPUT_META (see
+# transaction_metrics() in scsi.py), collected by opcode with min/mean/max
+# and a histogram of each, to show whether time goes into seeking (latency),
+# the drive's transfer rate, or the host between commands (host gap).
+#
+
+import math
+
+from pcfx_scsi.scsi import COMMANDS, METRICS, transaction_metrics, host_gap
+
+UNITS = {'data_rate': 'B/s'}         # all others are in seconds
+
+HISTOGRAM_WIDTH = 40                 # characters for the longest bar
+
+
+class MetricStats:
+    '''Count, min, mean and max of one metric, with a histogram in half-decades.'''
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.bins = {}               # bin number -> count; bin n covers 10**(n/2) to 10**((n+1)/2)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value > 0:
+            index = math.floor(2 * math.log10(value))
+            self.bins[index] = self.bins.get(index, 0) + 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class CaptureMetrics:
+    '''Metrics of all transactions of a capture, by opcode.'''
+
+    def __init__(self, samplerate):
+        self.samplerate = samplerate
+        self.by_opcode = {}          # opcode (None without a command) -> {metric name: MetricStats}
+        self.counts = {}             # opcode -> number of transactions
+        self.last = None
+
+    def add(self, transaction):
+        opcode = transaction.cdb[0] if transaction.cdb else None
+        stats = self.by_opcode.get(opcode)
+        if stats is None:
+            stats = self.by_opcode[opcode] = {name: MetricStats() for (name, label, desc) in METRICS}
+            self.counts[opcode] = 0
+        self.counts[opcode] += 1
+        for (name, value) in transaction_metrics(transaction, self.samplerate).items():
+            if value is not None:
+                stats[name].add(value)
+        # the host gap before a command is counted with the command before it
+        if self.last is not None:
+            last_opcode = self.last.cdb[0] if self.last.cdb else None
+            self.by_opcode[last_opcode]['host_gap'].add(host_gap(self.last, transaction.startsample, self.samplerate))
+        self.last = transaction
+
+    def totals(self):
+        # All opcodes together
+        merged = {name: MetricStats() for (name, label, desc) in METRICS}
+        for stats in self.by_opcode.values():
+            for (name, metric) in stats.items():
+                merged[name].count += metric.count
+                merged[name].total += metric.total
+                for value in (metric.min, metric.max):
+                    if value is not None:
+                        merged[name].min = value if merged[name].min is None else min(merged[name].min, value)
+                        merged[name].max = value if merged[name].max is None else max(merged[name].max, value)
+                for (index, count) in metric.bins.items():
+                    merged[name].bins[index] = merged[name].bins.get(index, 0) + count
+        return merged
+
+
+def capture_metrics(transactions, samplerate):
+    metrics = CaptureMetrics(samplerate)
+    for transaction in transactions:
+        metrics.add(transaction)
+    return metrics
+
+
+_PREFIXES = ((1e9, 'G'), (1e6, 'M'), (1e3, 'k'), (1, ''), (1e-3, 'm'), (1e-6, 'u'), (1e-9, 'n'))
+
+
+def format_value(value, unit='s'):
+    # 3 significant digits with an SI prefix: '1.25 ms', '312 kB/s'
+    if value is None:
+        return '-'
+    if value == 0:
+        return '0 %s' % unit
+    for (scale, prefix) in _PREFIXES:
+        if abs(value) >= scale:
+            break
+    return '%.3g %s%s' % (value / scale, prefix, unit)
+
+
+def _bin_label(index, unit):
+    return '%s - %s' % (format_value(10 ** (index / 2), unit), format_value(10 ** ((index + 1) / 2), unit))
+
+
+def format_summary(metrics):
+    '''The summary as lines of text: per opcode, each metric with its histogram.'''
+    lines = []
+    groups = sorted(metrics.by_opcode.items(), key=lambda item: -1 if item[0] is None else item[0])
+    groups.append(('all', metrics.totals()))
+    for (opcode, stats) in groups:
+        if opcode == 'all':
+            lines.append('All commands: %d' % sum(metrics.counts.values()))
+        elif opcode is None:
+            lines.append('No command: %d' % metrics.counts[opcode])
+        else:
+            name = COMMANDS[opcode][0] if opcode in COMMANDS else 'Unknown command'
+            lines.append('[%02X] %s: %d' % (opcode, name, metrics.counts[opcode]))
+        for (name, label, desc) in METRICS:
+            metric = stats[name]
+            if not metric.count:
+                continue
+            unit = UNITS.get(name, 's')
+            lines.append('  %-10s min %-11s mean %-11s max %s' % (label, format_value(metric.min, unit),
+                                                                  format_value(metric.mean, unit),
+                                                                  format_value(metric.max, unit)))
+            largest = max(metric.bins.values(), default=0)
+            for index in sorted(metric.bins):
+                count = metric.bins[index]
+                bar = '#' * max(1, round(HISTOGRAM_WIDTH * count / largest))
+                lines.append('    %-23s %6d %s' % (_bin_label(index, unit), count, bar))
+        lines.append('')
+    return lines
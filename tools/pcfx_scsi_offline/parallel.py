@@ -0,0 +1,206 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Parallel offline decode
+#
+# Between transactions the bus is free (SEL and BSY high) and the state
+# machine waits in BUS FREE for SEL to fall.  All it carries over to the
+# next transaction is the start of the Bus Free annotation, the last CDB and
+# the block length set by MODE SELECT (OfflineDecoder.carried_state).
+#
+# A long capture is therefore cut in the middle of idle gaps, the pieces
+# are decoded in a process pool, and the results are joined in sample
+# order, passing the carried state along.  A piece which was decoded with
+# the wrong carried state (i.e. after a MODE SELECT) is decoded again, and
+# if a piece does not end in BUS FREE (a selection which never completed),
+# it is decoded again together with the next one; the result is therefore
+# always the same as OfflineDecoder.decode() on the whole capture.
+#
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from pcfx_scsi.scsi import DEFAULT_BLOCK_LENGTH, TIMING_DEFAULTS, TransactionStore
+
+from .engine import Edges, OfflineDecoder, SEL, BSY
+
+DEFAULT_MIN_GAP = 1000       # samples of free bus needed to cut there
+PIECES_PER_JOB = 4           # more pieces than workers, to even out the load
+
+
+class _Assumed(int):
+    # A block length a piece was started with, as opposed to one set by a
+    # MODE SELECT within it (which replaces it with a plain int)
+    pass
+
+
+class _PieceStore(TransactionStore):
+    # The transactions of a piece; 'assumed' counts those sent with the
+    # block length the piece was started with (which the store keeps as a
+    # plain number)
+    def __init__(self):
+        TransactionStore.__init__(self)
+        self.assumed = 0
+
+    def append(self, t):
+        if type(t.block_length) is _Assumed:
+            self.assumed += 1
+        TransactionStore.append(self, t)
+
+
+def piece_min_gap(deglitch, options, min_gap=DEFAULT_MIN_GAP):
+    '''The shortest free gap a capture may be cut in, for these decoder options.'''
+    # a pending BSY edge must be confirmed well within the gap, and a piece
+    # does not know when the bus was released, so no gap it starts in may
+    # be too short a Bus Free for the timing checks
+    min_gap = max(min_gap, 2 * deglitch + 2)
+    if options.get('timing') is not None:
+        bus_free = options['timing'].get('bus_free', TIMING_DEFAULTS['bus_free'])
+        min_gap = max(min_gap, int(bus_free * options['samplerate'] / 1e9) + 1)
+    return min_gap
+
+
+def free_gap_middles(edges, min_gap):
+    '''The middles of all gaps of at least 'min_gap' samples in which SEL and BSY are both high.'''
+    (samples, now, before) = edges.arrays
+    control = np.flatnonzero(((now ^ before) & (SEL | BSY)) != 0)
+    starts = samples[control]
+    ends = np.append(starts[1:], edges.num_samples)
+    gaps = ends - starts
+    free = ((now[control] & (SEL | BSY)) == (SEL | BSY)) & (gaps >= min_gap)
+    return starts[free] + gaps[free] // 2
+
+
+def split_points(edges, pieces, min_gap=DEFAULT_MIN_GAP):
+    '''
+    Up to 'pieces' - 1 sample numbers at which to cut the capture: the
+    middles of free gaps (see free_gap_middles()), chosen to give pieces
+    with about the same number of edges.
+    '''
+    (samples, now, before) = edges.arrays
+    if pieces <= 1 or not len(samples):
+        return []
+    points = free_gap_middles(edges, min_gap)
+    if not len(points):
+        return []
+    edge_counts = np.searchsorted(samples, points)
+    targets = np.arange(1, pieces) * (len(samples) / pieces)
+    chosen = points[np.minimum(np.searchsorted(edge_counts, targets), len(points) - 1)]
+    return np.unique(chosen).tolist()
+
+
+def span_arrays(edges, start, end):
+    # Change points of samples start..end-1, and the word at 'start'
+    (samples, now, before) = edges.arrays
+    lo = int(np.searchsorted(samples, start, side='right'))
+    hi = int(np.searchsorted(samples, end, side='left'))
+    return (edges.word_at(start), samples[lo:hi], now[lo:hi], before[lo:hi])
+
+
+def decode_span(task):
+    '''
+    Worker: decode samples start..end-1 as if the bus had been free since
+    'start' ('final' if the capture ends there).  Returns the annotations, transactions and final state, and the
+    carried state it leaves, with None for each part the piece did not set.
+    '''
+    (start, end, arrays, block_length, deglitch, options, final) = task
+    decoder = OfflineDecoder(deglitch, **options)
+    decoder.set_carried_state((start, [], _Assumed(block_length)))
+    decoder.transactions = _PieceStore()
+    decoder.decode(Edges.from_arrays(end, *arrays), start, final)
+    (startsamplenum, cmd_type, block_length) = decoder.carried_state()
+    return (decoder.annotations, decoder.transactions, decoder.state,
+            (startsamplenum if startsamplenum != start else None,
+             cmd_type or None,
+             block_length if type(block_length) is not _Assumed else None))
+
+
+def parallel_decode(edges, deglitch=2, jobs=None, min_gap=DEFAULT_MIN_GAP, **options):
+    '''
+    Decode 'edges' in a pool of 'jobs' processes (default: one per CPU);
+    returns an OfflineDecoder holding the annotations and transactions, as
+    if it had decoded the whole capture.  'options' are passed on to
+    OfflineDecoder (data_detail, group_bytes, timing, samplerate and
+    sector_check).
+    '''
+    jobs = jobs or os.cpu_count() or 1
+    decoder = OfflineDecoder(deglitch, **options)
+    points = split_points(edges, jobs * PIECES_PER_JOB, piece_min_gap(deglitch, options, min_gap))
+    if jobs <= 1 or not points:
+        decoder.decode(edges)
+        return decoder
+
+    bounds = [0] + points + [edges.num_samples]
+
+    def task(index, block_length):
+        (start, end) = (bounds[index], bounds[index + 1])
+        return (start, end, span_arrays(edges, start, end), block_length, deglitch, options,
+                end == edges.num_samples)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # Every piece is decoded with the default block length first
+        results = list(pool.map(decode_span, [task(i, DEFAULT_BLOCK_LENGTH) for i in range(len(points) + 1)]))
+        decoded_with = [DEFAULT_BLOCK_LENGTH] * len(results)
+
+        # Pass the carried state along; this shows which pieces need another go
+        carried = decoder.carried_state()
+        incoming = []
+        index = 0
+        while index < len(results):
+            (annotations, transactions, state, leaves) = results[index]
+            if state != 'BUS FREE' and index + 1 < len(results):
+                # still in a transaction at the cut: join the next piece to this one
+                del bounds[index + 1], results[index + 1], decoded_with[index + 1]
+                results[index] = decode_span(task(index, carried[2]))
+                decoded_with[index] = carried[2]
+                continue
+            incoming.append(carried)
+            carried = tuple(carried[part] if leaves[part] is None else leaves[part] for part in range(3))
+            index += 1
+
+        # Only 'per sector' grouping and the sector checks depend on the block length at the start
+        if decoder.data_detail == 'per sector' or decoder.sectors:
+            redo = [i for i in range(len(results)) if decoded_with[i] != incoming[i][2]]
+            for (i, result) in zip(redo, pool.map(decode_span, [task(i, incoming[i][2]) for i in redo])):
+                results[i] = result
+
+    join_pieces(decoder, bounds, results, incoming)
+    decoder.set_carried_state(carried)
+    return decoder
+
+
+def join_pieces(decoder, bounds, results, incoming):
+    '''
+    Append the results of decode_span() for the pieces between 'bounds'
+    to 'decoder', given the carried state each piece should have started
+    with ('incoming').
+    '''
+    for (index, (annotations, transactions, state, leaves)) in enumerate(results):
+        # The Bus Free annotation which opens a piece starts where the previous piece left off
+        if annotations and annotations[0][0] == bounds[index]:
+            annotations[0] = (incoming[index][0],) + annotations[0][1:]
+        decoder.annotations.extend(annotations)
+        # the block length a piece was started with, until a MODE SELECT in it
+        for number in range(transactions.assumed):
+            transactions.block_length[number] = incoming[index][2]
+        decoder.transactions.extend(transactions)
+        decoder.state = state
@@ -0,0 +1,279 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2024 David Shadoff <david.shadoff@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+#
+# Live (streaming) decode
+#
+# Raw samples are read from a pipe as they are captured, for example from
+# 'sigrok-cli -O binary' on stdout: 'unitsize' bytes per sample, little-
+# endian, with decoder channel 'n' (see CHANNEL_IDS) on bit 'n' unless a
+# probe bit map is given.
+#
+# StreamDecoder runs the OfflineDecoder state machine on each chunk as it
+# arrives.  A wait() which cannot be answered from the samples received so
+# far stops decoding until the next chunk, in the same state; since all
+# edges before the end of the chunk are known by then, the result is the
+# same as decoding the whole capture at once.  Edges behind the decoder are
+# dropped after every chunk, and transactions are handed out as they
+# complete, so memory use does not grow with the length of the capture.
+#
+
+from bisect import bisect_left
+from collections import deque
+import time
+
+import numpy as np
+
+from pcfx_scsi.scsi import command_label
+
+from .engine import Edges, OfflineDecoder, EndOfCapture
+from .dsl import CHANNEL_IDS, DEFAULT_CHUNK_SAMPLES
+
+DEFAULT_STREAM_CHUNK = 1 << 16       # samples read at a time
+LAG_WINDOW = 8                       # progress reports the decode rate is averaged over
+
+
+class StreamEdges(Edges):
+    '''Edges of the samples received so far, from the decoder's position on.'''
+
+    def __init__(self):
+        self.num_samples = 0
+        self.first_word = 0
+        self.arrays = None
+        self.samples = []
+        self.words = []
+        self.sel_fall = []
+        self.sel_rise = []
+        self.bsy_fall = []
+        self.info_samples = []
+        self.info_words = []
+        self.info_match = []
+        self._last = None            # last sample received
+
+    def extend(self, words):
+        '''Add the edges of the next 'words' samples.'''
+        if not len(words):
+            return
+        offset = self.num_samples
+        if self._last is None:
+            self.first_word = int(words[0])
+            self._last = words[:1]
+        joined = np.concatenate((self._last, words))
+        changed = np.flatnonzero(joined[1:] != joined[:-1])
+        part = Edges.from_arrays(0, 0, changed + offset, joined[changed + 1], joined[changed])
+        for name in ('samples', 'words', 'sel_fall', 'sel_rise', 'bsy_fall',
+                     'info_samples', 'info_words', 'info_match'):
+            getattr(self, name).extend(getattr(part, name))
+        self._last = words[-1:].copy()
+        self.num_samples = offset + len(words)
+
+    def trim(self, pos):
+        '''
+        Drop the edges before sample 'pos', which no wait() can match any
+        more; returns the number of INFO XFER edges dropped.
+        '''
+        index = bisect_left(self.samples, pos)
+        if index:
+            self.first_word = self.words[index - 1]
+            del self.samples[:index], self.words[:index]
+        for edge_list in (self.sel_fall, self.sel_rise, self.bsy_fall):
+            del edge_list[:bisect_left(edge_list, pos)]
+        index = bisect_left(self.info_samples, pos)
+        del self.info_samples[:index], self.info_words[:index], self.info_match[:index]
+        return index
+
+
+class StreamDecoder(OfflineDecoder):
+    '''
+    OfflineDecoder fed one chunk of samples at a time (see feed()).
+    Completed transactions are queued in 'transactions' (a deque) for the
+    caller to take; annotations are only kept if 'annotations' is True.
+    '''
+
+    def __init__(self, deglitch=2, annotations=False, **options):
+        self.keep_annotations = annotations
+        OfflineDecoder.__init__(self, deglitch, **options)
+        self.transactions = deque()
+        self.annotations = deque()
+        self.edges = StreamEdges()
+        self.pos = 0
+        self.info_index = 0
+
+    def put(self, ss, es, ann, texts):
+        if self.keep_annotations:
+            self.annotations.append((ss, es, ann, texts))
+
+    def _next(self, edge_list):
+        # No match before the end of the samples received: none can come
+        # before it later either, so the next wait() may start there.
+        index = bisect_left(edge_list, max(self.pos, 1))
+        if index == len(edge_list):
+            self.pos = max(self.pos, self.edges.num_samples)
+            raise EndOfCapture()
+        samplenum = edge_list[index]
+        self.pos = samplenum + 1
+        return samplenum
+
+    def feed(self, words):
+        '''Decode the next chunk of samples (one uint16 word per sample).'''
+        self.edges.extend(words)
+        try:
+            while True:
+                self.step()
+        except EndOfCapture:
+            pass
+        self.info_index = max(self.info_index - self.edges.trim(self.pos), 0)
+
+    @property
+    def decoded_samples(self):
+        # Samples before this one will not change the output any more
+        return min(self.pos, self.edges.num_samples)
+
+
+def read_samples(stream, chunk_samples=DEFAULT_STREAM_CHUNK, unitsize=2, probe_bits=None):
+    '''
+    Yield chunks of samples from a binary file object (a pipe or FIFO) as
+    uint16 words in decoder channel order, as soon as they are available.
+    The input buffer is allocated once, so at most 'chunk_samples' are
+    held at a time.  'probe_bits' gives the input bit of each decoder
+    channel (in CHANNEL_IDS order) if they are not on bits 0-13.
+    '''
+    dtype = {2: '<u2', 4: '<u4'}[unitsize]
+    buffer = bytearray(chunk_samples * unitsize)
+    view = memoryview(buffer)
+    filled = 0
+    while True:
+        count = stream.readinto(view[filled:])
+        if not count:
+            break
+        filled += count
+        usable = filled - filled % unitsize
+        if not usable:
+            continue
+        raw = np.frombuffer(buffer, dtype=dtype, count=usable // unitsize)
+        if probe_bits is None:
+            words = raw.astype(np.uint16)
+        else:
+            words = np.zeros(len(raw), dtype=np.uint16)
+            for (channel, bit) in enumerate(probe_bits):
+                words |= (((raw >> bit) & 1) << channel).astype(np.uint16)
+        yield words
+        buffer[:filled - usable] = buffer[usable:filled]
+        filled -= usable
+
+
+def dsl_transactions(capture, deglitch=2, chunk_samples=DEFAULT_CHUNK_SAMPLES, **options):
+    '''
+    Yield the transactions of an open DslCapture as they are decoded, one
+    chunk of samples at a time ('deglitch' in samples), so that the whole
+    capture is never held.  'options' are passed on to OfflineDecoder
+    (data_detail, group_bytes); the capture's sample rate is used for the
+    timing checks.
+    '''
+    if options.get('timing') is not None:
+        options.setdefault('samplerate', capture.samplerate)
+    decoder = StreamDecoder(deglitch, **options)
+    for (offset, words) in capture.iter_chunks(chunk_samples):
+        decoder.feed(words)
+        while decoder.transactions:
+            yield decoder.transactions.popleft()
+    decoder.finish()
+    yield from decoder.transactions
+
+
+def parse_probe_bits(text):
+    bits = [int(bit) for bit in text.split(',')]
+    if len(bits) != len(CHANNEL_IDS):
+        raise ValueError('%d probe bits needed (%s)' % (len(CHANNEL_IDS), ', '.join(CHANNEL_IDS)))
+    return bits
+
+
+def transaction_text(t):
+    '''One line of text for a Transaction, as written by stream_decode().'''
+    if not t.cdb:
+        return '%d-%d %s: (no command)' % (t.startsample, t.endsample, t.luns)
+    status = 'no status' if t.status is None else 'status 0x%02X' % t.status
+    data = (len(t.data_in) if t.data_in is not None else 0) + (len(t.data_out) if t.data_out is not None else 0)
+    return '%d-%d %s, %s, %d bytes' % (t.startsample, t.endsample, command_label(t.cdb)[0], status, data)
+
+
+class LagMonitor:
+    '''
+    Compares the samples decoded with the wall-clock time since the first
+    chunk: 'lag' is how far the decoded output is behind the capture if the
+    samples are produced in real time.
+    '''
+
+    def __init__(self, samplerate):
+        self.samplerate = samplerate
+        self.start = None
+        self.history = deque(maxlen=LAG_WINDOW)          # (wall time, samples decoded)
+
+    def update(self, decoded_samples):
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        self.history.append((now, decoded_samples))
+        return self.report()
+
+    def report(self):
+        (now, decoded) = self.history[-1]
+        elapsed = now - self.start
+        lag = elapsed - decoded / self.samplerate
+        (then, before) = self.history[0]
+        speed = ((decoded - before) / self.samplerate) / (now - then) if now > then else 0.0
+        return 'elapsed %.1f s, decoded %.1f s, lag %.2f s, %.2fx real time' % (
+            elapsed, decoded / self.samplerate, lag, speed)
+
+
+def stream_decode(stream, out, samplerate, deglitch=2, chunk_samples=DEFAULT_STREAM_CHUNK,
+                  unitsize=2, probe_bits=None, report=None, report_interval=5.0, exporter=None, **options):
+    '''
+    Decode samples from 'stream' until it ends, writing one line per
+    transaction to 'out' as it completes (or giving it to 'exporter', see
+    export.py, which writes to 'out' in batches).  Every 'report_interval'
+    seconds, a lag report (see LagMonitor) is written to 'report', if given.
+    '''
+    decoder = StreamDecoder(deglitch, **options)
+    monitor = LagMonitor(samplerate)
+    next_report = None
+
+    def write_transactions():
+        while decoder.transactions:
+            if exporter is not None:
+                exporter.add(decoder.transactions.popleft())
+            else:
+                out.write(transaction_text(decoder.transactions.popleft()) + '\n')
+        out.flush()
+
+    for words in read_samples(stream, chunk_samples, unitsize, probe_bits):
+        decoder.feed(words)
+        write_transactions()
+        if report is not None:
+            monitor.update(decoder.decoded_samples)
+            if next_report is None or time.monotonic() >= next_report:
+                next_report = time.monotonic() + report_interval
+                report.write(monitor.report() + '\n')
+                report.flush()
+    decoder.finish()
+    write_transactions()
+    if exporter is not None:
+        exporter.close()
+        out.flush()
+    return decoder